@@ -0,0 +1,291 @@
+# bench_format_alpaca.py
+"""Micro-benchmark of the Alpaca bar formatting paths.
+Compares the original per-ticker format_dataframe loop and the
+combined frame with the pandas-free converters on synthetic
+multi-symbol responses, reporting the overhead per symbol. Each
+path starts from its cached payload: a pickled DataFrame before,
+a JSON list of raw bars after. The raw bars also skip the
+SDK's DataFrame build at download time, which is timed too.
+
+Run from the root of the project:
+    python -m benchmarks.bench_format_alpaca
+"""
+import json
+import pickle
+import random
+from datetime import datetime as dt
+from datetime import timezone
+from timeit import repeat
+
+import numpy as np
+import pandas as pd
+
+from daily_price_updates import ALPACA_VENDOR_ID
+from daily_price_updates import bars_to_rows
+
+
+# Number of symbols per multi-symbol request
+NUM_SYMBOLS = 200
+
+# Bars per symbol of a nightly and a catch-up request
+NUM_BARS = (1, 20)
+
+# Number of timed runs of each path
+REPEATS = 5
+
+
+def make_raw_bars(num_symbols, num_bars):
+    """Create synthetic raw Alpaca bars.
+
+    Parameters
+    ----------
+    num_symbols : 'int'
+        The number of symbols in the request
+    num_bars : 'int'
+        The number of daily bars per symbol
+
+    Returns
+    -------
+    'list'
+        The raw bar dicts, grouped by symbol like Alpaca's
+        multi-symbol responses
+    """
+
+    days = pd.bdate_range('2021-09-01', periods=num_bars)
+    bars = []
+    for i in range(num_symbols):
+        for day in days:
+            price = 50 + random.random() * 100
+            bars.append({
+                't': day.strftime('%Y-%m-%dT04:00:00Z'),
+                'o': price,
+                'h': price * 1.02,
+                'l': price * 0.98,
+                'c': price * 1.01,
+                'v': random.randint(100000, 50000000),
+                'n': random.randint(1000, 50000),
+                'vw': price,
+                'S': f"SYM{i}"
+            })
+
+    return bars
+
+
+def bars_to_frame(bars):
+    """Build the combined DataFrame the SDK's get_bars(...).df
+    returns for raw bars.
+
+    Parameters
+    ----------
+    bars : 'list'
+        The raw bar dicts
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The bars indexed by UTC timestamp with a symbol column
+    """
+
+    bars_df = pd.DataFrame(bars).rename(columns={
+        't': 'timestamp',
+        'o': 'open',
+        'h': 'high',
+        'l': 'low',
+        'c': 'close',
+        'v': 'volume',
+        'n': 'trade_count',
+        'vw': 'vwap',
+        'S': 'symbol'
+    })
+    bars_df.index = pd.to_datetime(bars_df.pop('timestamp'), utc=True)
+
+    return bars_df
+
+
+def format_dataframe(price_data_df, ticker_id):
+    """Convert the format of the price data DataFrame obtained
+    from Alpaca to match the schema of the daily_price table.
+    The original formatting path of daily_price_updates.py,
+    kept as the baseline.
+
+    Parameters
+    ----------
+    price_data_df : 'pandas.DataFrame'
+        The dataframe of price data generated by Alpaca
+    ticker_id : 'int' or 'numpy.ndarray'
+        The ticker's id from the symbol table, e.g. 13, or
+        an array with the symbol id of each row
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        A dataframe of the price data that matches the schema
+        of the daily_price table
+    """
+    # Convert DataFrame to daily_price schema
+    price_data_df = price_data_df.drop(
+        ['trade_count', 'vwap', 'symbol'],
+        axis=1,
+        errors='ignore'
+    )
+
+    price_data_df.index = price_data_df.index.date
+    price_data_df.reset_index(inplace=True)
+    price_data_df.rename(
+        {
+            'index': 'price_date',
+            'open': 'open_price',
+            'high': 'high_price',
+            'low': 'low_price',
+            'close': 'close_price'
+        },
+        axis=1,
+        inplace=True
+    )
+
+    # Add the additional columns, broadcasting
+    # scalars over every row.
+    now = dt.now(timezone.utc)
+    insert_df = price_data_df.assign(
+        data_vendor_id=ALPACA_VENDOR_ID,
+        symbol_id=ticker_id,
+        created_date=now,
+        last_updated=now
+    )
+
+    # Reorder columns.
+    sorted_cols = [
+        'data_vendor_id',
+        'symbol_id',
+        'price_date',
+        'created_date',
+        'last_updated',
+        'open_price',
+        'high_price',
+        'low_price',
+        'close_price',
+        'volume'
+    ]
+    insert_df = insert_df[sorted_cols]
+
+    return insert_df
+
+
+def frame_to_rows(price_data_df, symbol_ids, now=None):
+    """Convert one combined DataFrame of Alpaca bars for several
+    symbols, e.g. the SDK's get_bars(...).df, to daily_price rows
+    by zipping its columns instead of reshaping the frame.
+
+    Parameters
+    ----------
+    price_data_df : 'pandas.DataFrame'
+        The dataframe of price data generated by Alpaca, with a
+        UTC timestamp index and a symbol column
+    symbol_ids : 'dict'
+        The symbol ids keyed by ticker
+    now : 'datetime.datetime'
+        The created_date and last_updated of every row,
+        defaults to the current time
+
+    Returns
+    -------
+    'list'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS
+    """
+
+    stamp = (now or dt.now(timezone.utc)).isoformat(sep=' ')
+    num_bars = len(price_data_df)
+
+    return list(zip(
+        [ALPACA_VENDOR_ID] * num_bars,
+        [symbol_ids[symbol] for symbol in price_data_df['symbol'].tolist()],
+        np.datetime_as_string(price_data_df.index.to_numpy(dtype='datetime64[ns]'), unit='D').tolist(),
+        [stamp] * num_bars,
+        [stamp] * num_bars,
+        price_data_df['open'].tolist(),
+        price_data_df['high'].tolist(),
+        price_data_df['low'].tolist(),
+        price_data_df['close'].tolist(),
+        price_data_df['volume'].tolist()
+    ))
+
+
+def format_per_ticker(bars_df, symbol_ids):
+    """The original path: format_dataframe per ticker, concat
+    the frames and rebuild tuples with to_numpy().
+
+    Parameters
+    ----------
+    bars_df : 'pandas.DataFrame'
+        The combined DataFrame of bars
+    symbol_ids : 'dict'
+        The symbol ids keyed by ticker
+
+    Returns
+    -------
+    'list'
+        The rows for the bulk loader
+    """
+
+    frames = [
+        format_dataframe(ticker_df, symbol_ids[ticker])
+        for ticker, ticker_df in bars_df.groupby('symbol', sort=False)
+    ]
+    daily_data_df = pd.concat(frames, ignore_index=True)
+
+    return [tuple(prices) for prices in daily_data_df.to_numpy()]
+
+
+def format_combined(bars_df, symbol_ids):
+    """The combined frame path: one format_dataframe call for
+    every symbol, then tuples rebuilt with to_numpy().
+
+    Parameters
+    ----------
+    bars_df : 'pandas.DataFrame'
+        The combined DataFrame of bars
+    symbol_ids : 'dict'
+        The symbol ids keyed by ticker
+
+    Returns
+    -------
+    'list'
+        The rows for the bulk loader
+    """
+
+    ticker_ids = bars_df['symbol'].map(symbol_ids).to_numpy()
+    daily_data_df = format_dataframe(bars_df, ticker_ids)
+
+    return [tuple(prices) for prices in daily_data_df.to_numpy()]
+
+
+def best_time(function):
+    """Return the best time in seconds of a function call."""
+    return min(repeat(function, number=1, repeat=REPEATS))
+
+
+if __name__ == "__main__":
+    for num_bars in NUM_BARS:
+        bars = make_raw_bars(NUM_SYMBOLS, num_bars)
+        bars_payload = json.dumps(bars).encode('utf-8')
+        bars_df = bars_to_frame(bars)
+        frame_payload = pickle.dumps(bars_df)
+        symbol_ids = {f"SYM{i}": i + 1 for i in range(NUM_SYMBOLS)}
+
+        # Every path produces the same prices.
+        now = dt.now()
+        expected = sorted((row[1], str(row[2]), row[5:]) for row in format_combined(bars_df, symbol_ids))
+        for rows in (bars_to_rows(bars, symbol_ids, now), frame_to_rows(bars_df, symbol_ids, now)):
+            assert sorted((row[1], row[2], row[5:]) for row in rows) == expected
+
+        paths = {
+            'SDK DataFrame build': lambda: bars_to_frame(bars),
+            'format_dataframe per ticker': lambda: format_per_ticker(pickle.loads(frame_payload), symbol_ids),
+            'format_dataframe combined': lambda: format_combined(pickle.loads(frame_payload), symbol_ids),
+            'frame_to_rows': lambda: frame_to_rows(pickle.loads(frame_payload), symbol_ids),
+            'bars_to_rows': lambda: bars_to_rows(json.loads(bars_payload), symbol_ids)
+        }
+        print(f"{NUM_SYMBOLS} symbols x {num_bars} bars:")
+        for name, path in paths.items():
+            seconds = best_time(path)
+            print(f"{name:>30}: {seconds * 1000:8.2f} ms ({seconds / NUM_SYMBOLS * 1e6:7.1f} us per symbol)")
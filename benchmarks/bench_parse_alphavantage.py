@@ -0,0 +1,97 @@
+# bench_parse_alphavantage.py
+"""Micro-benchmark of the AlphaVantage time series parsers.
+Compares the original per-bar Python loop with the vectorized
+parser on synthetic full-history responses.
+
+Run from the root of the project:
+    python -m benchmarks.bench_parse_alphavantage
+"""
+import random
+from datetime import date
+from datetime import datetime as dt
+from datetime import timedelta
+from timeit import repeat
+
+from utils.parsing import parse_alphavantage_daily
+
+
+# Number of bars in a synthetic full history (~20 years)
+NUM_BARS = 5000
+
+# Number of timed runs of each parser
+REPEATS = 5
+
+
+def make_time_series(num_bars):
+    """Create a synthetic `Time Series (Daily)` dict.
+
+    Parameters
+    ----------
+    num_bars : 'int'
+        The number of daily bars to create
+
+    Returns
+    -------
+    'dict'
+        The bars keyed by 'YYYY-MM-DD' date strings
+    """
+
+    start = date(2000, 1, 3)
+    time_series = {}
+    for i in range(num_bars):
+        price = 50 + random.random() * 100
+        time_series[(start + timedelta(days=i)).isoformat()] = {
+            '1. open': f"{price:.4f}",
+            '2. high': f"{price * 1.02:.4f}",
+            '3. low': f"{price * 0.98:.4f}",
+            '4. close': f"{price * 1.01:.4f}",
+            '5. volume': str(random.randint(100000, 50000000))
+        }
+
+    return time_series
+
+
+def parse_loop(time_series):
+    """The original per-bar parser from retrieve_historic_prices.py.
+
+    Parameters
+    ----------
+    time_series : 'dict'
+        The bars keyed by 'YYYY-MM-DD' date strings
+
+    Returns
+    -------
+    'list'
+        The list of tuples comprised of OHLCV prices and volumes
+    """
+
+    prices = []
+    for date_str in sorted(time_series.keys()):
+        bar = time_series[date_str]
+        prices.append(
+            (
+                dt.strptime(date_str, '%Y-%m-%d'),
+                float(bar['1. open']),
+                float(bar['2. high']),
+                float(bar['3. low']),
+                float(bar['4. close']),
+                int(bar['5. volume'])
+            )
+        )
+
+    return prices
+
+
+if __name__ == "__main__":
+    time_series = make_time_series(NUM_BARS)
+
+    results = {}
+    for name, parser in [('loop', parse_loop), ('vectorized', parse_alphavantage_daily)]:
+        best = min(repeat(lambda: parser(time_series), number=1, repeat=REPEATS))
+        results[name] = best
+        print(
+            f"{name:>10}: {best * 1000:8.2f} ms per {NUM_BARS} bars "
+            f"({NUM_BARS / best:,.0f} bars/sec)"
+        )
+
+    print(f"   speedup: {results['loop'] / results['vectorized']:.1f}x")
@@ -0,0 +1,114 @@
+# bench_startup.py
+"""Startup benchmark of the nightly daily_price_updates.py job.
+Times importing the script against importing the libraries it
+used to load at startup, and the trading_day lookup against
+building the NYSE calendar, which is all a run on a day the
+market was closed needs.
+
+Run from the root of the project:
+    python -m benchmarks.bench_startup
+"""
+import subprocess
+import sys
+from datetime import date
+from datetime import timedelta
+from time import perf_counter
+
+import psycopg2
+
+
+# Number of timed runs of each measurement
+REPEATS = 5
+
+# Imports timed in a fresh interpreter
+IMPORTS = {
+    'daily_price_updates': "import daily_price_updates",
+    'eager imports': "import pandas, pandas_market_calendars, alpaca_trade_api"
+}
+
+
+def time_import(statement):
+    """Time a statement in a fresh Python interpreter.
+
+    Parameters
+    ----------
+    statement : 'str'
+        The Python code to run
+
+    Returns
+    -------
+    'float'
+        The best wall clock time in seconds of REPEATS runs
+    """
+
+    times = []
+    for _ in range(REPEATS):
+        start = perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def time_calls(function):
+    """Time a function call.
+
+    Parameters
+    ----------
+    function : 'function'
+        The function to call without arguments
+
+    Returns
+    -------
+    'float'
+        The best wall clock time in seconds of REPEATS calls
+    """
+
+    times = []
+    for _ in range(REPEATS):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+
+def nyse_schedule_check(day):
+    """The original trading day check from daily_price_updates.py.
+
+    Parameters
+    ----------
+    day : 'datetime.date'
+        The date to check
+
+    Returns
+    -------
+    'bool'
+        True if the date was a trading session
+    """
+
+    import pandas_market_calendars as mcal
+
+    return bool(mcal.get_calendar('NYSE').schedule(day, day).index.tolist())
+
+
+if __name__ == "__main__":
+    for name, statement in IMPORTS.items():
+        print(f"{name:>20}: {time_import(statement) * 1000:8.1f} ms to import")
+
+    yesterday = date.today() - timedelta(days=1)
+    print(f"{'NYSE schedule':>20}: {time_calls(lambda: nyse_schedule_check(yesterday)) * 1000:8.1f} ms per check")
+
+    # The trading_day lookup needs the database.
+    from utils.db import close_pool
+    from utils.db import db_connection
+    from utils.trading_calendar import is_trading_day
+
+    try:
+        with db_connection() as conn:
+            is_trading_day(conn, yesterday)
+            best = time_calls(lambda: is_trading_day(conn, yesterday))
+        close_pool()
+        print(f"{'trading_day':>20}: {best * 1000:8.1f} ms per check")
+    except psycopg2.Error as err:
+        print(f"{'trading_day':>20}: skipped, no database ({err.__class__.__name__})")
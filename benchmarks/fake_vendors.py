@@ -0,0 +1,316 @@
+# fake_vendors.py
+"""Local stand-ins for the AlphaVantage and Alpaca APIs.
+Serves synthetic TIME_SERIES_DAILY responses and multi-symbol
+Alpaca bars over HTTP, with configurable latency, error rate and
+rate limits, so the loaders can be load-tested without spending
+API quota. Point the loaders at a server with the
+ALPHAVANTAGE_BASE_URL and APCA_API_DATA_URL environment variables.
+
+Run from the root of the project to serve until interrupted:
+    python -m benchmarks.fake_vendors --port 8000
+"""
+import json
+import random
+import threading
+from argparse import ArgumentParser
+from datetime import date
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from time import monotonic
+from time import sleep
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+
+# Bars in a compact AlphaVantage response
+COMPACT_BARS = 100
+
+# Largest page of Alpaca bars, as in the SDK
+ALPACA_PAGE_LIMIT = 10000
+
+# AlphaVantage's answer to calls over the rate limit
+ALPHAVANTAGE_NOTE = {
+    'Note': "Thank you for using Alpha Vantage! Our standard API call frequency "
+            "is 5 calls per minute and 500 calls per day."
+}
+
+
+def business_days(first, last):
+    """List the weekdays between two dates.
+
+    Parameters
+    ----------
+    first : 'datetime.date'
+        The first date
+    last : 'datetime.date'
+        The last date
+
+    Returns
+    -------
+    'list'
+        The weekdays from first to last, inclusive
+    """
+
+    days = []
+    day = first
+    while day <= last:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+
+    return days
+
+
+class VendorProfile:
+    """Behaviour of a fake vendor API.
+
+    Parameters
+    ----------
+    latency : 'float'
+        The seconds every request takes before it's answered
+    error_rate : 'float'
+        The fraction of requests answered with an HTTP 500
+    calls_per_minute : 'float'
+        The vendor's rate limit, or None for no limit; calls
+        over it are throttled the way the vendor does
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, calls_per_minute=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls_per_minute = calls_per_minute
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Count a call and decide how it's answered.
+
+        Returns
+        -------
+        'str'
+            'ok', 'error' or 'throttled'
+        """
+
+        now = monotonic()
+        with self._lock:
+            self.calls += 1
+            if self.calls_per_minute:
+                # Sliding window of the calls
+                # answered in the last minute.
+                self._window = [t for t in self._window if now - t < 60]
+                if len(self._window) >= self.calls_per_minute:
+                    self.throttled += 1
+                    return 'throttled'
+                self._window.append(now)
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return 'error'
+
+        return 'ok'
+
+    def stats(self):
+        """Return the call, error and throttle counts."""
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors, 'throttled': self.throttled}
+
+
+class FakeVendorServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering AlphaVantage queries under
+    /query and Alpaca bars under /v2/stocks/bars.
+
+    Prices are synthetic and identical for every symbol, so
+    responses are built once per shape and reused.
+
+    Parameters
+    ----------
+    port : 'int'
+        The port to listen on, 0 for any free port
+    history_bars : 'int'
+        The number of bars in a full AlphaVantage history
+    history_end : 'datetime.date'
+        The date of the last AlphaVantage bar
+    alphavantage : 'VendorProfile'
+        The AlphaVantage latency, errors and rate limit
+    alpaca : 'VendorProfile'
+        The Alpaca latency, errors and rate limit
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, history_bars=1000, history_end=None, alphavantage=None,
+                 alpaca=None):
+        super().__init__(('127.0.0.1', port), FakeVendorHandler)
+        self.history_bars = history_bars
+        self.history_end = history_end or date.today() - timedelta(days=1)
+        self.alphavantage = alphavantage or VendorProfile()
+        self.alpaca = alpaca or VendorProfile()
+        self._time_series = {}
+        self._bars = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """The base URL of the server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """Serve requests from a daemon thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def time_series(self, outputsize):
+        """Return the encoded TIME_SERIES_DAILY response of an
+        output size."""
+        with self._lock:
+            if outputsize not in self._time_series:
+                num_bars = COMPACT_BARS if outputsize == 'compact' else self.history_bars
+                first = self.history_end - timedelta(days=num_bars * 7 // 5 + 7)
+                days = business_days(first, self.history_end)[-num_bars:]
+                self._time_series[outputsize] = json.dumps({
+                    'Meta Data': {'1. Information': 'Daily Prices (open, high, low, close) and Volumes'},
+                    'Time Series (Daily)': {
+                        day.isoformat(): {
+                            '1. open': f"{100 + i % 50:.4f}",
+                            '2. high': f"{102 + i % 50:.4f}",
+                            '3. low': f"{99 + i % 50:.4f}",
+                            '4. close': f"{101 + i % 50:.4f}",
+                            '5. volume': str(1000000 + i)
+                        }
+                        for i, day in enumerate(reversed(days))
+                    }
+                }).encode('utf-8')
+
+            return self._time_series[outputsize]
+
+    def bars(self, start, end):
+        """Return a symbol's raw Alpaca bars between two dates."""
+        with self._lock:
+            if (start, end) not in self._bars:
+                self._bars[(start, end)] = [
+                    {
+                        't': f"{day.isoformat()}T04:00:00Z",
+                        'o': 100.0 + i,
+                        'h': 102.0 + i,
+                        'l': 99.0 + i,
+                        'c': 101.0 + i,
+                        'v': 1000000 + i,
+                        'n': 5000 + i,
+                        'vw': 100.5 + i
+                    }
+                    for i, day in enumerate(business_days(start, end))
+                ]
+
+            return self._bars[(start, end)]
+
+    def stats(self):
+        """Return the call counts of both vendors."""
+        return {'alphavantage': self.alphavantage.stats(), 'alpaca': self.alpaca.stats()}
+
+
+class FakeVendorHandler(BaseHTTPRequestHandler):
+    """Request handler of FakeVendorServer."""
+
+    # Headers and body are sent in separate writes; with Nagle's
+    # algorithm every response would wait for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Don't log every request."""
+
+    def send_body(self, status, body, headers=None):
+        """Send a response with a JSON or bytes body."""
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Answer an AlphaVantage or Alpaca request."""
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == '/query':
+            self.alphavantage(params)
+        elif url.path == '/v2/stocks/bars':
+            self.alpaca_bars(params)
+        else:
+            self.send_body(404, {'message': 'not found'})
+
+    def alphavantage(self, params):
+        """Answer an AlphaVantage query."""
+        profile = self.server.alphavantage
+        outcome = profile.admit()
+        sleep(profile.latency)
+        if outcome == 'throttled':
+            # AlphaVantage throttles with a 200 and a note.
+            self.send_body(200, ALPHAVANTAGE_NOTE)
+        elif outcome == 'error':
+            self.send_body(500, {'Error Message': 'Internal server error'})
+        elif params.get('function') == 'TIME_SERIES_DAILY':
+            self.send_body(200, self.server.time_series(params.get('outputsize', 'compact')))
+        elif params.get('function') in ('DIVIDENDS', 'SPLITS'):
+            self.send_body(200, {'symbol': params.get('symbol'), 'data': []})
+        else:
+            self.send_body(200, {'Error Message': 'Invalid API call.'})
+
+    def alpaca_bars(self, params):
+        """Answer a multi-symbol Alpaca bars request, paging
+        through the symbols like the real API."""
+        profile = self.server.alpaca
+        outcome = profile.admit()
+        sleep(profile.latency)
+        if outcome == 'throttled':
+            self.send_body(429, {'message': 'too many requests.'}, {'Retry-After': '1'})
+            return
+        if outcome == 'error':
+            self.send_body(500, {'message': 'internal server error'})
+            return
+
+        symbols = params.get('symbols', '').split(',')
+        start = date.fromisoformat(params['start'][:10])
+        end = date.fromisoformat(params.get('end', params['start'])[:10])
+        bars = self.server.bars(start, end)
+        limit = int(params.get('limit') or ALPACA_PAGE_LIMIT)
+        offset = int(params.get('page_token') or 0)
+
+        # Whole symbols per page, at least one.
+        per_page = max(1, limit // max(1, len(bars)))
+        page = symbols[offset:offset + per_page]
+        next_offset = offset + len(page)
+        self.send_body(200, {
+            'bars': {symbol: bars for symbol in page},
+            'next_page_token': str(next_offset) if next_offset < len(symbols) else None
+        })
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serve fake AlphaVantage and Alpaca APIs.")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on")
+    parser.add_argument('--bars', type=int, default=1000, help="Bars in a full AlphaVantage history")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests failing")
+    parser.add_argument('--av-calls-per-minute', type=float, default=None,
+                        help="AlphaVantage rate limit")
+    parser.add_argument('--alpaca-calls-per-minute', type=float, default=None,
+                        help="Alpaca rate limit")
+    args = parser.parse_args()
+
+    server = FakeVendorServer(
+        args.port,
+        history_bars=args.bars,
+        alphavantage=VendorProfile(args.latency, args.error_rate, args.av_calls_per_minute),
+        alpaca=VendorProfile(args.latency, args.error_rate, args.alpaca_calls_per_minute)
+    )
+    print(f"Serving AlphaVantage at {server.url}/query and Alpaca at {server.url}/v2/stocks/bars")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
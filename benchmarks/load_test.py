@@ -0,0 +1,376 @@
+# load_test.py
+"""End-to-end load test of the loaders.
+Builds a throwaway database on a local PostgreSQL server, starts
+the fake AlphaVantage and Alpaca servers from fake_vendors.py and
+times retrieve_historic_prices.py backfilling every symbol's
+history, then daily_price_updates.py --catch-up filling the
+sessions since. Each scale multiplies the number of symbols, and
+the throughput of every run is printed, and optionally saved as
+JSON, so regressions show up as numbers.
+
+The database settings are read from the UW_SEC_MASTER_*
+environment variables; only the server is used, the load test
+database is created and dropped by the test.
+
+Run from the root of the project:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --scales 1 --latency 0.05 --error-rate 0.01
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from datetime import date
+from datetime import timedelta
+from pathlib import Path
+from time import perf_counter
+
+import psycopg2
+
+from benchmarks.fake_vendors import FakeVendorServer
+from benchmarks.fake_vendors import VendorProfile
+from utils.db import db_settings
+
+
+# Number of symbols at scale 1, the size of the S&P 500
+# with its past constituents
+NUM_SYMBOLS = 782
+
+# Multiples of NUM_SYMBOLS that are load tested
+SCALES = (1, 10)
+
+# Bars in every symbol's AlphaVantage history, about a
+# trading year
+HISTORY_BARS = 250
+
+# Calendar days between the last AlphaVantage bar and
+# yesterday, filled by the catch-up from Alpaca
+GAP_DAYS = 14
+
+# Name of the throwaway database
+LOAD_TEST_DB = 'securities_master_loadtest'
+
+# Hosts the load test may create and drop databases on
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Root of the project, where the loaders live
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def is_local(host):
+    """Return True if a database host is this machine or a
+    local Unix socket directory."""
+    return not host or host in LOCAL_HOSTS or host.startswith('/')
+
+
+def admin_connection(settings):
+    """Connect to the server's postgres database to create and
+    drop the load test database.
+
+    Parameters
+    ----------
+    settings : 'dict'
+        The psycopg2 connection keyword arguments
+
+    Returns
+    -------
+    'psycopg2.extensions.connection'
+        An autocommit connection to the postgres database
+    """
+
+    connection = psycopg2.connect(**dict(settings, database='postgres'))
+    connection.autocommit = True
+
+    return connection
+
+
+def recreate_database(settings, name):
+    """Drop and create the load test database."""
+    connection = admin_connection(settings)
+    cur = connection.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    cur.execute(f'CREATE DATABASE "{name}"')
+    cur.close()
+    connection.close()
+
+
+def drop_database(settings, name):
+    """Drop the load test database."""
+    connection = admin_connection(settings)
+    cur = connection.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    cur.close()
+    connection.close()
+
+
+def seed_symbols(settings, num_symbols):
+    """Add the two data vendors and synthetic symbols to a
+    freshly built database.
+
+    Parameters
+    ----------
+    settings : 'dict'
+        The psycopg2 connection keyword arguments of the
+        load test database
+    num_symbols : 'int'
+        The number of symbols to add
+    """
+
+    connection = psycopg2.connect(**settings)
+    cur = connection.cursor()
+    cur.execute(
+        "INSERT INTO data_vendor (name, created_date, last_updated) "
+        "VALUES ('AlphaVantage', now(), now()), ('Alpaca', now(), now())"
+    )
+    cur.execute(
+        "INSERT INTO symbol (ticker, instrument, current_constituent, created_date, last_updated) "
+        "SELECT 'LT' || lpad(g::text, 5, '0'), 'stock', true, now(), now() "
+        "FROM generate_series(1, %s) AS g",
+        (num_symbols,)
+    )
+    connection.commit()
+    cur.close()
+    connection.close()
+
+
+def count_rows(settings, data_vendor_id):
+    """Count a vendor's rows in daily_price."""
+    connection = psycopg2.connect(**settings)
+    cur = connection.cursor()
+    cur.execute("SELECT count(*) FROM daily_price WHERE data_vendor_id = %s", (data_vendor_id,))
+    count = cur.fetchone()[0]
+    connection.commit()
+    cur.close()
+    connection.close()
+
+    return count
+
+
+def stage_seconds(metrics_dir, job):
+    """Read the total seconds per stage from a loader's latest
+    run report.
+
+    Parameters
+    ----------
+    metrics_dir : 'str'
+        The METRICS_DIR of the loaders
+    job : 'str'
+        The name of the loader's job
+
+    Returns
+    -------
+    'dict'
+        The seconds spent in every stage, keyed by stage
+    """
+
+    reports = sorted(glob.glob(os.path.join(metrics_dir, f"{job}_*.json")))
+    if not reports:
+        return {}
+    with open(reports[-1]) as f:
+        report = json.load(f)
+
+    return {
+        histogram['labels']['stage']: round(histogram['sum'], 3)
+        for histogram in report['histograms']
+        if histogram['name'] == 'stage_seconds'
+    }
+
+
+def run_loader(script, arguments, env, workdir):
+    """Run a loader to completion and time it.
+
+    Parameters
+    ----------
+    script : 'str'
+        The loader's file name, e.g. 'retrieve_historic_prices.py'
+    arguments : 'list'
+        The command line arguments
+    env : 'dict'
+        The loader's environment
+    workdir : 'str'
+        The working directory, which holds the loader's output
+
+    Returns
+    -------
+    'float'
+        The wall clock time in seconds
+    """
+
+    log_path = Path(workdir) / f"{Path(script).stem}.log"
+    start = perf_counter()
+    with open(log_path, 'a') as log:
+        result = subprocess.run(
+            [sys.executable, str(PROJECT_ROOT / script)] + arguments,
+            cwd=workdir,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+    seconds = perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"{script} exited with {result.returncode}:\n{log_path.read_text()[-2000:]}"
+        )
+
+    return seconds
+
+
+def run_scale(num_symbols, args, settings):
+    """Load test both loaders with a number of symbols.
+
+    Parameters
+    ----------
+    num_symbols : 'int'
+        The number of symbols in the database
+    args : 'argparse.Namespace'
+        The command line arguments of the load test
+    settings : 'dict'
+        The psycopg2 connection keyword arguments of the
+        load test database
+
+    Returns
+    -------
+    'list'
+        The results of the two loaders
+    """
+
+    yesterday = date.today() - timedelta(days=1)
+    server = FakeVendorServer(
+        history_bars=args.bars,
+        history_end=yesterday - timedelta(days=args.gap_days),
+        alphavantage=VendorProfile(args.latency, args.error_rate, args.av_calls_per_minute),
+        alpaca=VendorProfile(args.latency, args.error_rate, args.alpaca_calls_per_minute)
+    ).start()
+
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    os.makedirs(os.path.join(workdir, 'failed_inserts'))
+    metrics_dir = os.path.join(workdir, 'metrics')
+
+    # Every call reaches the fake servers; the
+    # response cache starts empty.
+    env = dict(
+        os.environ,
+        UW_SEC_MASTER_DB=settings['database'],
+        RESPONSE_CACHE_DIR=os.path.join(workdir, 'response_cache'),
+        RESPONSE_CACHE_OFFLINE='',
+        METRICS_DIR=metrics_dir,
+        ALPHAVANTAGE_BASE_URL=server.url,
+        ALPHAVANTAGE_API_KEY='load-test',
+        ALPHAVANTAGE_CALLS_PER_MINUTE=str(args.client_calls_per_minute),
+        ALPHAVANTAGE_CALLS_PER_DAY='',
+        APCA_API_DATA_URL=server.url,
+        APCA_RETRY_WAIT='1',
+        ALPACA_API_KEY='load-test',
+        ALPACA_SECRET_KEY='load-test'
+    )
+
+    try:
+        recreate_database(settings, settings['database'])
+        run_loader('build_db_tables.py', [], env, workdir)
+        seed_symbols(settings, num_symbols)
+
+        loaders = [
+            ('retrieve_historic_prices', ['--new-job'], 'alphavantage', 1),
+            ('daily_price_updates', ['--catch-up', '--days', str(args.gap_days + 7)], 'alpaca', 2)
+        ]
+        results = []
+        for job, arguments, vendor, data_vendor_id in loaders:
+            calls_before = server.stats()[vendor]
+            seconds = run_loader(f"{job}.py", arguments, env, workdir)
+            calls = {
+                name: count - calls_before[name]
+                for name, count in server.stats()[vendor].items()
+            }
+            rows = count_rows(settings, data_vendor_id)
+            results.append({
+                'loader': job,
+                'symbols': num_symbols,
+                'seconds': round(seconds, 3),
+                'rows': rows,
+                'symbols_per_second': round(num_symbols / seconds, 1),
+                'rows_per_second': round(rows / seconds, 1),
+                'api_calls': calls['calls'],
+                'api_errors': calls['errors'],
+                'api_throttled': calls['throttled'],
+                'stage_seconds': stage_seconds(metrics_dir, job)
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+        if not args.keep:
+            drop_database(settings, settings['database'])
+
+    print(f"Logs and run reports of {num_symbols} symbols are in {workdir}")
+
+    return results
+
+
+def print_results(results):
+    """Print the load test results as a table."""
+    print(
+        f"\n{'loader':>26} {'symbols':>8} {'seconds':>9} {'symbols/s':>10} {'rows':>10} "
+        f"{'rows/s':>10} {'calls':>7} {'errors':>7} {'throttled':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['loader']:>26} {result['symbols']:>8} {result['seconds']:>9.2f} "
+            f"{result['symbols_per_second']:>10.1f} {result['rows']:>10} "
+            f"{result['rows_per_second']:>10.1f} {result['api_calls']:>7} "
+            f"{result['api_errors']:>7} {result['api_throttled']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Load test the loaders against fake vendor APIs and a local database."
+    )
+    parser.add_argument('--symbols', type=int, default=NUM_SYMBOLS,
+                        help="Number of symbols at scale 1")
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help="Multiples of --symbols to test")
+    parser.add_argument('--bars', type=int, default=HISTORY_BARS,
+                        help="Bars in every symbol's AlphaVantage history")
+    parser.add_argument('--gap-days', type=int, default=GAP_DAYS,
+                        help="Calendar days the catch-up fills from Alpaca")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds the fake servers take per request")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with an HTTP 500")
+    parser.add_argument('--av-calls-per-minute', type=float, default=None,
+                        help="Rate limit of the fake AlphaVantage server")
+    parser.add_argument('--alpaca-calls-per-minute', type=float, default=None,
+                        help="Rate limit of the fake Alpaca server")
+    parser.add_argument('--client-calls-per-minute', type=float, default=60000,
+                        help="ALPHAVANTAGE_CALLS_PER_MINUTE of the AlphaVantage loader")
+    parser.add_argument('--database', default=LOAD_TEST_DB,
+                        help="Name of the throwaway database")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the database after the test")
+    parser.add_argument('--allow-remote', action='store_true',
+                        help="Allow a database server that isn't local")
+    parser.add_argument('--output', default=None,
+                        help="Save the results as JSON to this path")
+    args = parser.parse_args()
+
+    settings = dict(db_settings(), database=args.database)
+    if not (is_local(settings['host']) or args.allow_remote):
+        sys.exit(
+            f"UW_SEC_MASTER_HOST is {settings['host']}; load test against a local "
+            "server, or pass --allow-remote."
+        )
+    if args.database == os.getenv('UW_SEC_MASTER_DB', 'securities_master'):
+        sys.exit(f"Refusing to drop the configured database {args.database}.")
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(args.symbols * scale, args, settings))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results were saved to {args.output}.")
@@ -1,9 +1,16 @@
 # build_db_tables.py
 
 # Imports
-import psycopg2
-import os
-from dotenv import load_dotenv
+import argparse
+from datetime import date
+from utils.db import close_pool
+from utils.consolidation import rebuild_consolidated_price
+from utils.db import db_connection
+from utils.trading_calendar import fill_trading_days
+
+# First year of the yearly daily_price partitions. AlphaVantage
+# full histories begin in late 1999.
+PARTITION_START_YEAR = 1999
 
 
 def create_exchange_table(connection, cursor):
@@ -117,44 +124,642 @@ def create_daily_price_table(connection, cursor):
     high_price NUMERIC(19,4) NULL,
     low_price NUMERIC(19,4) NULL,
     close_price NUMERIC(19,4) NULL,
-    volume BIGINT NULL
+    volume BIGINT NULL,
+    CONSTRAINT daily_price_natural_key UNIQUE (data_vendor_id, symbol_id, price_date)
+    )""")
+    connection.commit()
+
+
+def create_symbol_coverage_table(connection, cursor):
+    """Create the symbol_coverage table to store the first and
+    last price_date and the number of daily_price rows of each
+    symbol and data vendor. The price loaders keep it up to date
+    so tools don't need to scan daily_price.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE symbol_coverage(
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    data_vendor_id INT NOT NULL REFERENCES data_vendor (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    first_price_date DATE NOT NULL,
+    last_price_date DATE NOT NULL,
+    row_count BIGINT NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (symbol_id, data_vendor_id)
+    )""")
+    connection.commit()
+
+
+def rebuild_symbol_coverage(connection, cursor):
+    """Rebuild the symbol_coverage table from a full scan of
+    daily_price, creating the table if it doesn't exist. Only
+    needed once for a database loaded before the table existed.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("SELECT to_regclass('symbol_coverage')")
+    if cursor.fetchone()[0] is None:
+        create_symbol_coverage_table(connection, cursor)
+
+    cursor.execute("TRUNCATE symbol_coverage")
+    cursor.execute("""
+    INSERT INTO symbol_coverage (symbol_id, data_vendor_id, first_price_date,
+    last_price_date, row_count, last_updated)
+    SELECT symbol_id, data_vendor_id, MIN(price_date), MAX(price_date), COUNT(*), now()
+    FROM daily_price
+    GROUP BY symbol_id, data_vendor_id""")
+    connection.commit()
+
+
+def create_consolidated_price_table(connection, cursor):
+    """Create the consolidated_price table to store one price
+    per symbol and date, taken from the data vendor with the
+    highest precedence. The price loaders keep it up to date
+    for the keys they touch.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE consolidated_price(
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    price_date DATE NOT NULL,
+    data_vendor_id INT NOT NULL REFERENCES data_vendor (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    open_price NUMERIC(19,4) NULL,
+    high_price NUMERIC(19,4) NULL,
+    low_price NUMERIC(19,4) NULL,
+    close_price NUMERIC(19,4) NULL,
+    volume BIGINT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (symbol_id, price_date)
+    )""")
+    connection.commit()
+
+
+def build_consolidated_price(connection, cursor):
+    """Create the consolidated_price table if it doesn't exist
+    and rebuild it from daily_price with the current vendor
+    precedence policy.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("SELECT to_regclass('consolidated_price')")
+    if cursor.fetchone()[0] is None:
+        create_consolidated_price_table(connection, cursor)
+
+    rebuild_consolidated_price(connection, cursor)
+
+
+def create_corporate_action_table(connection, cursor):
+    """Create the corporate_action table to store the split and
+    dividend events of each symbol. A split's value is the number
+    of new shares per old share and a dividend's value is the cash
+    amount per share. The price and volume factors are filled in
+    when the symbol's adjusted prices are computed.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE corporate_action(
+    id SERIAL PRIMARY KEY NOT NULL,
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    data_vendor_id INT NULL REFERENCES data_vendor (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    ex_date DATE NOT NULL,
+    action_type VARCHAR(16) NOT NULL CHECK (action_type IN ('split', 'dividend')),
+    value NUMERIC(19,6) NOT NULL,
+    price_factor DOUBLE PRECISION NULL,
+    volume_factor DOUBLE PRECISION NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    CONSTRAINT corporate_action_natural_key UNIQUE(symbol_id, ex_date, action_type)
+    )""")
+    connection.commit()
+
+
+def create_adjusted_price_table(connection, cursor):
+    """Create the adjusted_price table to store the split and
+    dividend adjusted consolidated prices of each symbol and
+    the cumulative factors applied to them.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE adjusted_price(
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    price_date DATE NOT NULL,
+    open_price DOUBLE PRECISION NULL,
+    high_price DOUBLE PRECISION NULL,
+    low_price DOUBLE PRECISION NULL,
+    close_price DOUBLE PRECISION NULL,
+    volume BIGINT NULL,
+    price_factor DOUBLE PRECISION NOT NULL,
+    volume_factor DOUBLE PRECISION NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (symbol_id, price_date)
+    )""")
+    connection.commit()
+
+
+def create_index_membership_table(connection, cursor):
+    """Create the index_membership table to store the intervals
+    during which each symbol was a constituent of an index. An
+    interval runs from start_date up to, but excluding, end_date;
+    a NULL start_date predates the change history and a NULL
+    end_date is still open. A GiST index on the date range serves
+    point-in-time universe queries.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE index_membership(
+    id SERIAL PRIMARY KEY NOT NULL,
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    index_name VARCHAR(64) NOT NULL,
+    start_date DATE NULL,
+    end_date DATE NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    CHECK (start_date IS NULL OR end_date IS NULL OR start_date < end_date)
+    )""")
+    cursor.execute("""
+    CREATE INDEX index_membership_period_idx
+    ON index_membership
+    USING gist (daterange(start_date, end_date, '[)'))""")
+    connection.commit()
+
+
+def create_trading_day_table(connection, cursor):
+    """Create the trading_day table to store the NYSE calendar,
+    one row per calendar day, so the scripts don't rebuild
+    the exchange calendar on every run.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE trading_day(
+    calendar_date DATE PRIMARY KEY NOT NULL,
+    is_session BOOLEAN NOT NULL,
+    market_open TIMESTAMPTZ NULL,
+    market_close TIMESTAMPTZ NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL
     )""")
     connection.commit()
 
 
+def build_trading_days(connection, cursor):
+    """Create the trading_day table if it doesn't exist and fill
+    it from the first partition year through the end of next year.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("SELECT to_regclass('trading_day')")
+    if cursor.fetchone()[0] is None:
+        create_trading_day_table(connection, cursor)
+
+    fill_trading_days(
+        connection,
+        date(PARTITION_START_YEAR, 1, 1),
+        date(date.today().year + 1, 12, 31)
+    )
+
+
+def create_ingest_job_table(connection, cursor):
+    """Create the ingest_job table to store each run of a loader,
+    so an interrupted run can be resumed instead of restarted.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE ingest_job(
+    id SERIAL PRIMARY KEY NOT NULL,
+    job_name VARCHAR(64) NOT NULL,
+    status VARCHAR(16) NOT NULL CHECK (status IN ('running', 'completed', 'failed')),
+    source VARCHAR(255) NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    finished_date TIMESTAMPTZ NULL
+    )""")
+    connection.commit()
+
+
+def create_ingest_task_table(connection, cursor):
+    """Create the ingest_task table to store the status, number
+    of attempts and last error of every ticker of a loader run.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE ingest_task(
+    id SERIAL PRIMARY KEY NOT NULL,
+    job_id INT NOT NULL REFERENCES ingest_job (id) ON DELETE CASCADE ON UPDATE CASCADE,
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    ticker VARCHAR(32) NOT NULL,
+    status VARCHAR(16) NOT NULL CHECK (status IN ('pending', 'completed', 'failed')),
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    finished_date TIMESTAMPTZ NULL,
+    CONSTRAINT ingest_task_job_symbol UNIQUE(job_id, symbol_id)
+    )""")
+    connection.commit()
+
+
+def create_vendor_quota_table(connection, cursor):
+    """Create the vendor_quota table to count the API calls and
+    throttled calls made to each vendor per day, so the daily
+    quota is shared across runs.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    CREATE TABLE vendor_quota(
+    vendor VARCHAR(32) NOT NULL,
+    usage_date DATE NOT NULL,
+    calls INT NOT NULL DEFAULT 0,
+    throttled INT NOT NULL DEFAULT 0,
+    last_updated TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (vendor, usage_date)
+    )""")
+    connection.commit()
+
+
+def add_daily_price_natural_key(connection, cursor):
+    """Add the (data_vendor_id, symbol_id, price_date) unique
+    key to a daily_price table built without it. Duplicate rows
+    are removed first, keeping the most recently inserted row
+    for each key.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    cursor.execute("""
+    DELETE FROM daily_price AS dp
+    USING daily_price AS newer
+    WHERE dp.data_vendor_id = newer.data_vendor_id
+    AND dp.symbol_id = newer.symbol_id
+    AND dp.price_date = newer.price_date
+    AND dp.id < newer.id""")
+
+    cursor.execute("""
+    ALTER TABLE daily_price
+    ADD CONSTRAINT daily_price_natural_key
+    UNIQUE (data_vendor_id, symbol_id, price_date)""")
+    connection.commit()
+
+
+def create_partitioned_daily_price_table(connection, cursor,
+                                         table_name='daily_price',
+                                         start_year=PARTITION_START_YEAR,
+                                         end_year=None):
+    """Create the daily_price table range partitioned by
+    price_date, with one partition per year and a default
+    partition for dates outside of those years.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    table_name : 'str'
+        The name of the partitioned table
+    start_year : 'int'
+        The first year to create a partition for
+    end_year : 'int'
+        The last year to create a partition for, defaults
+        to next year
+    """
+
+    # The primary and natural keys of a partitioned
+    # table must include the partition key.
+    cursor.execute("""
+    CREATE TABLE {0}(
+    id SERIAL NOT NULL,
+    data_vendor_id INT NOT NULL REFERENCES data_vendor (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    symbol_id INT NOT NULL REFERENCES symbol (id) ON DELETE RESTRICT ON UPDATE CASCADE,
+    price_date DATE NOT NULL,
+    created_date TIMESTAMPTZ NOT NULL,
+    last_updated TIMESTAMPTZ NOT NULL,
+    open_price NUMERIC(19,4) NULL,
+    high_price NUMERIC(19,4) NULL,
+    low_price NUMERIC(19,4) NULL,
+    close_price NUMERIC(19,4) NULL,
+    volume BIGINT NULL,
+    CONSTRAINT {0}_pkey PRIMARY KEY (id, price_date),
+    CONSTRAINT {0}_natural_key UNIQUE (data_vendor_id, symbol_id, price_date)
+    ) PARTITION BY RANGE (price_date)""".format(table_name))
+
+    # Indexes created on the parent are created
+    # on every partition.
+    cursor.execute("""
+    CREATE INDEX {0}_symbol_date_idx
+    ON {0} (symbol_id, price_date)""".format(table_name))
+
+    cursor.execute("""
+    CREATE TABLE {0}_default
+    PARTITION OF {0} DEFAULT""".format(table_name))
+    connection.commit()
+
+    if end_year is None:
+        end_year = date.today().year + 1
+
+    create_daily_price_partitions(connection, cursor, start_year, end_year, table_name)
+
+
+def create_daily_price_partitions(connection, cursor, start_year, end_year,
+                                  table_name='daily_price'):
+    """Create the yearly partitions of the partitioned daily_price
+    table from start_year through end_year. Partitions that
+    already exist are skipped, and rows of a new partition's year
+    that were stored in the default partition are moved into it.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    start_year : 'int'
+        The first year to create a partition for
+    end_year : 'int'
+        The last year to create a partition for
+    table_name : 'str'
+        The name of the partitioned table
+    """
+
+    cursor.execute("SELECT to_regclass(%s)", ('{}_default'.format(table_name),))
+    has_default = cursor.fetchone()[0] is not None
+
+    for year in range(start_year, end_year + 1):
+        cursor.execute("SELECT to_regclass(%s)", ('{}_y{}'.format(table_name, year),))
+        if cursor.fetchone()[0] is not None:
+            continue
+
+        # A partition can't be attached while the default
+        # partition holds rows of its year, so set them aside.
+        if has_default:
+            cursor.execute("""
+            CREATE TEMP TABLE {0}_moved (LIKE {0}) ON COMMIT DROP""".format(table_name))
+            cursor.execute("""
+            WITH moved AS (
+            DELETE FROM {0}_default
+            WHERE price_date >= '{1}-01-01' AND price_date < '{2}-01-01'
+            RETURNING *)
+            INSERT INTO {0}_moved SELECT * FROM moved""".format(table_name, year, year + 1))
+
+        cursor.execute("""
+        CREATE TABLE {0}_y{1}
+        PARTITION OF {0}
+        FOR VALUES FROM ('{1}-01-01') TO ('{2}-01-01')""".format(
+            table_name,
+            year,
+            year + 1
+        ))
+
+        if has_default:
+            cursor.execute("INSERT INTO {0} SELECT * FROM {0}_moved".format(table_name))
+        connection.commit()
+
+
 if __name__ == "__main__":
-    # Connect to the remote database.
-    load_dotenv()
-    user = os.getenv('UW_SEC_MASTER_USER')
-    password = os.getenv('UW_SEC_MASTER_PASSWORD')
-    host = os.getenv('UW_SEC_MASTER_HOST')
-
-    conn = psycopg2.connect(
-        database='securities_master',
-        user=user,
-        password=password,
-        host=host,
-        port='5432'
+    parser = argparse.ArgumentParser(
+        description="Build the Securities Master database tables."
+    )
+    parser.add_argument(
+        '--add-natural-key',
+        action='store_true',
+        help="Add the natural key to an existing daily_price table instead"
+    )
+    parser.add_argument(
+        '--rebuild-coverage',
+        action='store_true',
+        help="Rebuild symbol_coverage from daily_price instead"
+    )
+    parser.add_argument(
+        '--rebuild-consolidated',
+        action='store_true',
+        help="Rebuild consolidated_price with the vendor precedence policy instead"
+    )
+    parser.add_argument(
+        '--corporate-actions',
+        action='store_true',
+        help="Add the corporate_action and adjusted_price tables to an existing database instead"
+    )
+    parser.add_argument(
+        '--index-membership',
+        action='store_true',
+        help="Add the index_membership table to an existing database instead"
     )
+    parser.add_argument(
+        '--ingest-jobs',
+        action='store_true',
+        help="Add the ingest_job and ingest_task tables to an existing database instead"
+    )
+    parser.add_argument(
+        '--create-partitions',
+        action='store_true',
+        help="Add the yearly partitions of a partitioned daily_price through next year instead"
+    )
+    parser.add_argument(
+        '--vendor-quota',
+        action='store_true',
+        help="Add the vendor_quota table to an existing database instead"
+    )
+    parser.add_argument(
+        '--trading-days',
+        action='store_true',
+        help="Create or refill the trading_day calendar instead"
+    )
+    parser.add_argument(
+        '--partitioned',
+        action='store_true',
+        help="Build daily_price range partitioned by year of price_date"
+    )
+    args = parser.parse_args()
 
-    cur = conn.cursor()
+    # Connect to the remote database.
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        if args.add_natural_key:
+            # Upgrade an existing daily_price table.
+            add_daily_price_natural_key(conn, cur)
+            message = "Added the natural key to daily_price.\n\nScript complete."
+        elif args.rebuild_coverage:
+            # Backfill symbol_coverage for an existing database.
+            rebuild_symbol_coverage(conn, cur)
+            message = "Rebuilt symbol_coverage from daily_price.\n\nScript complete."
+        elif args.rebuild_consolidated:
+            # Apply a new vendor precedence policy.
+            build_consolidated_price(conn, cur)
+            message = "Rebuilt consolidated_price from daily_price.\n\nScript complete."
+        elif args.corporate_actions:
+            # Add the adjustment tables to an existing database.
+            create_corporate_action_table(conn, cur)
+            create_adjusted_price_table(conn, cur)
+            message = (
+                "Added the corporate_action and adjusted_price tables."
+                "\n\nScript complete."
+            )
+        elif args.index_membership:
+            # Add the membership table to an existing database.
+            create_index_membership_table(conn, cur)
+            message = "Added the index_membership table.\n\nScript complete."
+        elif args.ingest_jobs:
+            # Add the job state tables to an existing database.
+            create_ingest_job_table(conn, cur)
+            create_ingest_task_table(conn, cur)
+            message = "Added the ingest_job and ingest_task tables.\n\nScript complete."
+        elif args.create_partitions:
+            # Run once a year so new years get their partition.
+            create_daily_price_partitions(conn, cur, PARTITION_START_YEAR, date.today().year + 1)
+            message = "Created the daily_price partitions through next year.\n\nScript complete."
+        elif args.vendor_quota:
+            # Add the quota table to an existing database.
+            create_vendor_quota_table(conn, cur)
+            message = "Added the vendor_quota table.\n\nScript complete."
+        elif args.trading_days:
+            # Add the calendar to an existing database.
+            build_trading_days(conn, cur)
+            message = "Filled the trading_day calendar.\n\nScript complete."
+        else:
+            # Build the tables in the remote database.
+            table_creators = [
+                create_exchange_table,
+                create_data_vendor_table,
+                create_symbol_table,
+                create_partitioned_daily_price_table if args.partitioned else create_daily_price_table,
+                create_symbol_coverage_table,
+                create_consolidated_price_table,
+                create_corporate_action_table,
+                create_adjusted_price_table,
+                create_index_membership_table,
+                create_ingest_job_table,
+                create_ingest_task_table,
+                create_vendor_quota_table,
+                build_trading_days
+            ]
 
-    # Build the tables in the remote database.
-    table_creators = [
-        create_exchange_table,
-        create_data_vendor_table,
-        create_symbol_table,
-        create_daily_price_table
-    ]
+            for creator in table_creators:
+                creator(conn, cur)
 
-    for creator in table_creators:
-        creator(conn, cur)
+            message = (
+                "The following tables have successfully been added "
+                "to the Securities Master database:\nexchange"
+                "\ndata_vendor\nsymbol\ndaily_price\nsymbol_coverage\nconsolidated_price\ncorporate_action\nadjusted_price\nindex_membership\ningest_job\ningest_task\nvendor_quota\ntrading_day\n\nScript complete."
+            )
+
+        cur.close()
 
     # Close connections to the database
-    cur.close()
-    conn.close()
-    print(
-        "The following tables have successfully been added "
-        "to the Securities Master database:\nexchange"
-        "\ndata_vendor\nsymbol\ndaily_price\n\nScript complete."
-    )
+    close_pool()
+    print(message)
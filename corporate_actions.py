@@ -0,0 +1,462 @@
+# corporate_actions.py
+
+# Imports
+import argparse
+import csv
+import io
+import json
+import os
+import numpy as np
+import requests
+
+from datetime import date
+from datetime import datetime as dt
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from utils.db import close_pool
+from utils.db import db_connection
+from utils.progress import print_progress_bar
+from utils.response_cache import response_cache_from_env
+from utils.vendor_client import QuotaExceededError
+from utils.vendor_client import RateLimitedError
+from utils.vendor_client import VendorRequestError
+from utils.vendor_client import alphavantage_client_from_env
+from utils.vendor_client import alphavantage_error
+
+# Load variables into shell
+load_dotenv()
+
+# AlphaVantage variables
+ALPHA_VANTAGE_API_KEY = os.getenv('ALPHAVANTAGE_API_KEY')
+ALPHA_VANTAGE_BASE_URL = os.getenv('ALPHAVANTAGE_BASE_URL', 'https://www.alphavantage.co').rstrip('/')
+ALPHA_VANTAGE_VENDOR_ID = 1
+
+# AlphaVantage endpoints of each action type, with the
+# fields holding the ex-date and the value of an event
+ALPHA_VANTAGE_ACTION_CALLS = {
+    'dividend': ('DIVIDENDS', 'ex_dividend_date', 'amount'),
+    'split': ('SPLITS', 'effective_date', 'split_factor')
+}
+
+# Compressed cache of raw AlphaVantage responses
+response_cache = response_cache_from_env()
+
+# AlphaVantage client sharing the daily quota
+# with retrieve_historic_prices.py
+alphavantage = alphavantage_client_from_env()
+
+
+def download_corporate_actions_alphavantage(ticker, action_type):
+    """Download a ticker's dividend or split history from
+    AlphaVantage, reading through the response cache.
+
+    Parameters
+    ----------
+    ticker : 'str'
+        The ticker symbol, e.g. 'AAPL'
+    action_type : 'str'
+        'dividend' or 'split'
+
+    Returns
+    -------
+    'bytes'
+        The raw JSON response
+    """
+
+    function = ALPHA_VANTAGE_ACTION_CALLS[action_type][0]
+    av_url = "{}/query?function={}&symbol={}&apikey={}".format(
+        ALPHA_VANTAGE_BASE_URL,
+        function,
+        ticker.replace('.', '-'),
+        ALPHA_VANTAGE_API_KEY
+    )
+    cache_key = ('alphavantage', function, ticker, date.today().isoformat())
+
+    def download():
+        response = alphavantage.get(av_url)
+        error = alphavantage_error(response)
+        if error is not None:
+            raise VendorRequestError(f"{ticker}: {error}")
+        # Only cache responses that contain events.
+        if '"data"' not in response.text:
+            raise ValueError(response.text[:200])
+        return response.content
+
+    return response_cache.fetch(cache_key, download)
+
+
+def parse_corporate_actions_alphavantage(symbol_id, action_type, payload):
+    """Parse an AlphaVantage dividend or split history.
+
+    Parameters
+    ----------
+    symbol_id : 'int'
+        The ticker's id from the symbol table
+    action_type : 'str'
+        'dividend' or 'split'
+    payload : 'bytes'
+        The raw JSON response
+
+    Returns
+    -------
+    'list'
+        The tuples of symbol_id, data_vendor_id, ex_date,
+        action_type and value of every event
+    """
+
+    _, date_field, value_field = ALPHA_VANTAGE_ACTION_CALLS[action_type]
+    actions = []
+    for event in json.loads(payload).get('data', []):
+        try:
+            ex_date = date.fromisoformat(event[date_field])
+            value = float(event[value_field])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if value > 0:
+            actions.append((symbol_id, ALPHA_VANTAGE_VENDOR_ID, ex_date, action_type, value))
+
+    return actions
+
+
+def read_corporate_actions_csv(connection, path):
+    """Read corporate actions from a csv file with ticker,
+    ex_date, action_type and value columns.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    path : 'str'
+        The path of the csv file
+
+    Returns
+    -------
+    'list'
+        The tuples of symbol_id, data_vendor_id, ex_date,
+        action_type and value of every event with a
+        known ticker
+    """
+
+    with open(path, newline='') as csvfile:
+        rows = list(csv.DictReader(csvfile))
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT DISTINCT ON (ticker) ticker, id FROM symbol "
+        "WHERE ticker = ANY(%s) ORDER BY ticker, id",
+        (sorted({row['ticker'] for row in rows}),)
+    )
+    symbol_ids = dict(cur.fetchall())
+    connection.commit()
+    cur.close()
+
+    return [
+        (
+            symbol_ids[row['ticker']],
+            None,
+            date.fromisoformat(row['ex_date']),
+            row['action_type'],
+            float(row['value'])
+        )
+        for row in rows
+        if row['ticker'] in symbol_ids
+    ]
+
+
+def upsert_corporate_actions(connection, actions):
+    """Merge corporate actions into the corporate_action table
+    on (symbol_id, ex_date, action_type).
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    actions : 'list'
+        The tuples of symbol_id, data_vendor_id, ex_date,
+        action_type and value
+
+    Returns
+    -------
+    'set'
+        The ids of the symbols with new or changed actions
+    """
+
+    if not actions:
+        return set()
+
+    # An event listed twice keeps its last value.
+    actions = list({action[0:1] + action[2:4]: action for action in actions}.values())
+
+    now = dt.utcnow()
+    cur = connection.cursor()
+    changed = execute_values(
+        cur,
+        "INSERT INTO corporate_action (symbol_id, data_vendor_id, ex_date, action_type, "
+        "value, created_date, last_updated) VALUES %s "
+        "ON CONFLICT (symbol_id, ex_date, action_type) DO UPDATE SET "
+        "value = EXCLUDED.value, data_vendor_id = EXCLUDED.data_vendor_id, "
+        "last_updated = EXCLUDED.last_updated "
+        "WHERE corporate_action.value IS DISTINCT FROM EXCLUDED.value "
+        "RETURNING symbol_id",
+        [action + (now, now) for action in actions],
+        page_size=len(actions),
+        fetch=True
+    )
+    connection.commit()
+    cur.close()
+
+    return {row[0] for row in changed}
+
+
+def compute_adjustment_factors(price_dates, closes, ex_dates, action_types, values):
+    """Compute split and dividend adjustment factors with
+    vectorized NumPy operations.
+
+    A split of r new shares per old share scales earlier prices
+    by 1 / r and earlier volumes by r. A dividend of d scales
+    earlier prices by 1 - d / c, where c is the close on the last
+    price date before the ex-date. Each price is scaled by the
+    product of the factors of every action with a later ex-date.
+
+    Parameters
+    ----------
+    price_dates : 'numpy.ndarray'
+        The sorted datetime64[D] dates of the prices
+    closes : 'numpy.ndarray'
+        The close of every price date
+    ex_dates : 'numpy.ndarray'
+        The datetime64[D] ex-date of every action
+    action_types : 'numpy.ndarray'
+        'split' or 'dividend' for every action
+    values : 'numpy.ndarray'
+        The split ratio or dividend amount of every action
+
+    Returns
+    -------
+    'tuple'
+        The price and volume factors of every action, and
+        the cumulative price and volume factors of every
+        price date
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    is_split = np.asarray(action_types) == 'split'
+
+    # Close on the last price date before each ex-date.
+    previous = np.searchsorted(price_dates, ex_dates) - 1
+    previous_close = np.where(
+        previous >= 0,
+        closes[np.clip(previous, 0, None)] if len(closes) else np.nan,
+        np.nan
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        split_factor = np.where(values > 0, 1 / values, 1.0)
+        dividend_factor = 1 - values / previous_close
+    # Dividends without a valid prior close are left unadjusted.
+    dividend_factor = np.where(
+        np.isfinite(dividend_factor) & (dividend_factor > 0),
+        dividend_factor,
+        1.0
+    )
+    price_factor = np.where(is_split, split_factor, dividend_factor)
+    volume_factor = np.where(is_split, np.where(values > 0, values, 1.0), 1.0)
+
+    # Suffix products over the actions ordered by ex-date, so
+    # a price picks up every action after its date.
+    order = np.argsort(ex_dates, kind='stable')
+    sorted_ex_dates = np.asarray(ex_dates)[order]
+    price_suffix = np.append(np.cumprod(price_factor[order][::-1])[::-1], 1.0)
+    volume_suffix = np.append(np.cumprod(volume_factor[order][::-1])[::-1], 1.0)
+    first_later = np.searchsorted(sorted_ex_dates, price_dates, side='right')
+
+    return price_factor, volume_factor, price_suffix[first_later], volume_suffix[first_later]
+
+
+def adjust_symbol(connection, symbol_id):
+    """Recompute the adjusted prices of one symbol from its
+    consolidated prices and corporate actions, and store the
+    factor of every action, in a single transaction.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    symbol_id : 'int'
+        The symbol's id from the symbol table
+
+    Returns
+    -------
+    'int'
+        The number of adjusted prices written
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT price_date, open_price::float8, high_price::float8, low_price::float8, "
+        "close_price::float8, volume FROM consolidated_price "
+        "WHERE symbol_id = %s ORDER BY price_date",
+        (symbol_id,)
+    )
+    prices = cur.fetchall()
+    cur.execute(
+        "SELECT id, ex_date, action_type, value::float8 FROM corporate_action "
+        "WHERE symbol_id = %s",
+        (symbol_id,)
+    )
+    actions = cur.fetchall()
+
+    price_dates = np.array([price[0] for price in prices], dtype='datetime64[D]')
+    ohlc = np.array([price[1:5] for price in prices], dtype=np.float64).reshape(-1, 4)
+    volumes = np.array([price[5] for price in prices], dtype=np.float64)
+    price_factor, volume_factor, row_price_factor, row_volume_factor = compute_adjustment_factors(
+        price_dates,
+        ohlc[:, 3],
+        np.array([action[1] for action in actions], dtype='datetime64[D]'),
+        np.array([action[2] for action in actions], dtype=object),
+        np.array([action[3] for action in actions], dtype=np.float64)
+    )
+
+    # Store the factors the loaders apply to new prices.
+    if actions:
+        execute_values(
+            cur,
+            "UPDATE corporate_action AS ca SET price_factor = v.price_factor, "
+            "volume_factor = v.volume_factor FROM (VALUES %s) "
+            "AS v(id, price_factor, volume_factor) WHERE ca.id = v.id",
+            list(zip(
+                [action[0] for action in actions],
+                price_factor.tolist(),
+                volume_factor.tolist()
+            )),
+            page_size=len(actions)
+        )
+
+    # Replace the symbol's adjusted prices.
+    adjusted = (ohlc * row_price_factor[:, None]).tolist()
+    adjusted_volumes = np.round(volumes * row_volume_factor).tolist()
+    factors = zip(row_price_factor.tolist(), row_volume_factor.tolist())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    now = dt.utcnow().isoformat()
+    for price, values, volume, (price_factor, volume_factor) in zip(
+        prices, adjusted, adjusted_volumes, factors
+    ):
+        writer.writerow(
+            [symbol_id, price[0]]
+            + ['' if np.isnan(value) else repr(value) for value in values]
+            + ['' if np.isnan(volume) else int(volume)]
+            + [repr(price_factor), repr(volume_factor), now]
+        )
+    buffer.seek(0)
+
+    cur.execute("DELETE FROM adjusted_price WHERE symbol_id = %s", (symbol_id,))
+    cur.copy_expert(
+        "COPY adjusted_price (symbol_id, price_date, open_price, high_price, low_price, "
+        "close_price, volume, price_factor, volume_factor, last_updated) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    connection.commit()
+    cur.close()
+
+    return len(prices)
+
+
+def adjust_symbols(connection, symbol_ids):
+    """Recompute the adjusted prices of several symbols,
+    one transaction per symbol.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    symbol_ids : 'list'
+        The ids of the symbols to recompute
+    """
+
+    symbol_ids = sorted(symbol_ids)
+    for i, symbol_id in enumerate(symbol_ids):
+        adjust_symbol(connection, symbol_id)
+        print_progress_bar(i + 1, len(symbol_ids), prefix='Progress', suffix='Complete', length=50)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load split and dividend events and recompute adjusted prices."
+    )
+    parser.add_argument(
+        '--csv',
+        default=None,
+        help="Load the events of a csv file with ticker, ex_date, action_type "
+             "and value columns instead of AlphaVantage"
+    )
+    parser.add_argument(
+        '--tickers',
+        nargs='+',
+        default=None,
+        help="Only fetch these tickers from AlphaVantage"
+    )
+    parser.add_argument(
+        '--all',
+        action='store_true',
+        help="Recompute the adjusted prices of every symbol"
+    )
+    args = parser.parse_args()
+
+    with db_connection() as conn:
+        if args.csv:
+            actions = read_corporate_actions_csv(conn, args.csv)
+        else:
+            # Fetch the events of every ticker with prices.
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT DISTINCT s.id, s.ticker FROM symbol_coverage AS c "
+                "JOIN symbol AS s ON c.symbol_id = s.id ORDER BY s.id"
+            )
+            tickers = cur.fetchall()
+            conn.commit()
+            cur.close()
+            if args.tickers:
+                tickers = [ticker for ticker in tickers if ticker[1] in args.tickers]
+
+            actions = []
+            failed_tickers = []
+            print(f"Fetching corporate actions for {len(tickers)} tickers")
+            for i, (symbol_id, ticker) in enumerate(tickers):
+                try:
+                    for action_type in ALPHA_VANTAGE_ACTION_CALLS:
+                        try:
+                            payload = download_corporate_actions_alphavantage(ticker, action_type)
+                        except (requests.RequestException, RateLimitedError, ValueError):
+                            failed_tickers.append((symbol_id, ticker))
+                            continue
+                        actions.extend(
+                            parse_corporate_actions_alphavantage(symbol_id, action_type, payload)
+                        )
+                except QuotaExceededError:
+                    # Store what was fetched and leave
+                    # the rest for the next run.
+                    skipped = [ticker for _, ticker in tickers[i:]]
+                    print(
+                        f"\nThe daily AlphaVantage quota was reached; skipped {len(skipped)} "
+                        f"tickers, run again with --tickers {' '.join(skipped)}"
+                    )
+                    break
+                print_progress_bar(i + 1, len(tickers), prefix='Progress', suffix='Complete', length=50)
+            if failed_tickers:
+                print(f"Failed to fetch corporate actions for: {sorted(set(failed_tickers))}")
+
+        # Only the symbols whose actions changed are recomputed.
+        changed = upsert_corporate_actions(conn, actions)
+        if args.all:
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT symbol_id FROM symbol_coverage")
+            changed = {row[0] for row in cur.fetchall()}
+            conn.commit()
+            cur.close()
+
+        print(f"Recomputing adjusted prices for {len(changed)} symbols")
+        adjust_symbols(conn, changed)
+
+    close_pool()
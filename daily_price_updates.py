@@ -1,21 +1,59 @@
 # daily_price_updates.py
 
 # Imports
+import argparse
+import json
 import os
 import sys
-import psycopg2
-import pandas as pd
-import pandas_market_calendars as mcal
-import alpaca_trade_api as tradeapi
 
-from alpaca_trade_api.rest import TimeFrame
+from bisect import bisect_right
 from datetime import date
 from datetime import timedelta
+from datetime import timezone
 from datetime import datetime as dt
-from time import sleep
 from dotenv import load_dotenv
+from time import perf_counter
+from utils.bulk_load import copy_daily_prices
+from utils.db import close_pool
+from utils.db import db_connection
 from utils.fileio import save_csv
-from utils.progress import print_progress_bar
+from utils.ingest_jobs import MAX_ATTEMPTS
+from utils.ingest_jobs import read_failed_tickers
+from utils.ingest_jobs import run_with_retries
+from utils.metrics import metrics
+from utils.metrics import profiled
+from utils.metrics import write_report
+from utils.pipeline import IngestPipeline
+from utils.response_cache import response_cache_from_env
+from utils.trading_calendar import is_trading_day
+from utils.trading_calendar import trading_sessions
+
+# pandas and the Alpaca SDK are imported where they're used
+# so a run on a day the market was closed exits quickly.
+
+# Number of symbols requested per Alpaca bars call
+BAR_CHUNK_SIZE = 200
+
+# Number of Alpaca requests kept in flight
+FETCH_WORKERS = 4
+
+# Number of processes formatting Alpaca bars
+PARSE_WORKERS = 2
+
+# Number of Alpaca requests written per COPY and commit,
+# bounding the rows held in memory and in one transaction
+WRITE_BATCH_SIZE = 4
+
+# Number of calendar days the catch-up mode looks back
+# for missing sessions
+CATCH_UP_DAYS = 30
+
+# AlphaVantage's and Alpaca's ids in the data_vendor table
+ALPHAVANTAGE_VENDOR_ID = 1
+ALPACA_VENDOR_ID = 2
+
+# Compressed cache of raw Alpaca responses
+response_cache = response_cache_from_env()
 
 
 def get_tickers_from_daily_price(connection):
@@ -34,11 +72,12 @@ def get_tickers_from_daily_price(connection):
         from the daily_price table in Securities Master database
     """
 
-    # Obtain list of tickers in daily_price.
-    ticker_query = """SELECT DISTINCT dp.symbol_id, s.ticker
-    FROM daily_price AS dp
-    JOIN symbol AS s ON dp.symbol_id = s.id
-    ORDER BY dp.symbol_id"""
+    # Obtain list of tickers in daily_price from the
+    # coverage table instead of scanning daily_price.
+    ticker_query = """SELECT DISTINCT c.symbol_id, s.ticker
+    FROM symbol_coverage AS c
+    JOIN symbol AS s ON c.symbol_id = s.id
+    ORDER BY c.symbol_id"""
 
     # Query the database.
     cur = connection.cursor()
@@ -50,108 +89,362 @@ def get_tickers_from_daily_price(connection):
     return [(ticker[0], ticker[1]) for ticker in tickers]
 
 
-def format_dataframe(price_data_df, ticker_id):
-    """Convert the format of the price data DataFrame obtained
-    from Alpaca to match the schema of the daily_price table.
+def get_last_price_dates(connection):
+    """Get the last stored Alpaca price_date of every symbol
+    with historic data from the symbol_coverage table. Symbols
+    without Alpaca prices yet use their last price from any
+    data vendor.
 
     Parameters
     ----------
-    price_data_df : 'pandas.DataFrame'
-        The dataframe of price data generated by Alpaca
-    ticker_id : 'int'
-        The ticker's id from the symbol table, e.g. 13
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
 
     Returns
     -------
-    'pandas.DataFrame'
-        A dataframe of the price data that matches the schema
-        of the daily_price table
+    'list'
+        The list of tuples of ids, ticker symbols and
+        last stored price dates
     """
-    # Convert DataFrame to daily_price schema
-    price_data_df.drop(['trade_count', 'vwap'], axis=1, inplace=True)
-
-    price_data_df.index = price_data_df.index.date
-    price_data_df.reset_index(inplace=True)
-    price_data_df.rename(
-        {
-            'index': 'price_date',
-            'open': 'open_price',
-            'high': 'high_price',
-            'low': 'low_price',
-            'close': 'close_price'
-        },
-        axis=1,
-        inplace=True
-    )
 
-    # Create a DataFrame with the additional columns to be added
-    additional_cols_df = pd.DataFrame({
-        'data_vendor_id': [2],
-        'symbol_id': [ticker_id],
-        'created_date': [dt.now()],
-        'last_updated': [dt.now()]
-    })
-
-    # Concatenate dataframes.
-    sorted_cols = [
-        'data_vendor_id',
-        'symbol_id',
-        'price_date',
-        'created_date',
-        'last_updated',
-        'open_price',
-        'high_price',
-        'low_price',
-        'close_price',
-        'volume'
-    ]
-    insert_df = pd.concat([price_data_df, additional_cols_df], axis=1)
-    insert_df = insert_df[sorted_cols]
+    # Another vendor's later prices must not hide
+    # sessions missing from Alpaca.
+    cur = connection.cursor()
+    cur.execute("""SELECT c.symbol_id, s.ticker,
+    COALESCE(MAX(c.last_price_date) FILTER (WHERE c.data_vendor_id = %s), MAX(c.last_price_date))
+    FROM symbol_coverage AS c
+    JOIN symbol AS s ON c.symbol_id = s.id
+    GROUP BY c.symbol_id, s.ticker
+    ORDER BY c.symbol_id""", (ALPACA_VENDOR_ID,))
+    connection.commit()
+    last_price_dates = cur.fetchall()
+    cur.close()
+
+    return last_price_dates
+
+
+def group_missing_sessions(last_price_dates, sessions):
+    """Group symbols by the range of trading sessions missing
+    since their last stored price, so every group can be
+    fetched with ranged multi-symbol requests.
+
+    Parameters
+    ----------
+    last_price_dates : 'list'
+        The list of tuples of ids, ticker symbols and
+        last stored price dates
+    sessions : 'list'
+        The trading sessions to fill in ascending order
+
+    Returns
+    -------
+    'dict'
+        The lists of (id, ticker) tuples keyed by the first
+        and last missing session
+    """
+
+    groups = {}
+    for symbol_id, ticker, last_date in last_price_dates:
+        # Sessions after the last stored price are missing.
+        first_missing = bisect_right(sessions, last_date)
+        if first_missing == len(sessions):
+            continue
+        key = (sessions[first_missing], sessions[-1])
+        groups.setdefault(key, []).append((symbol_id, ticker))
+
+    return groups
+
+
+def chunk_tickers(tickers, chunk_size):
+    """Split the list of tickers into chunks for
+    multi-symbol requests.
 
-    return insert_df
+    Parameters
+    ----------
+    tickers : 'list'
+        The list of tuples of ids and ticker symbols
+    chunk_size : 'int'
+        The maximum number of tickers per chunk
+
+    Returns
+    -------
+    'list'
+        The list of ticker chunks
+    """
 
+    return [
+        tickers[i:i + chunk_size]
+        for i in range(0, len(tickers), chunk_size)
+    ]
 
-def get_prior_day_price_data(ticker, date, alpaca):
-    """Get the prior day's price data from Alpaca.
+
+def download_price_data(tickers, start, end, alpaca):
+    """Download the daily bars between two dates from Alpaca
+    for several tickers with a single multi-symbol request,
+    reading through the response cache.
 
     Parameters
     ----------
-    ticker : 'tuple'
-        The id and ticker symbol, e.g. (23, 'AAPL')
-    date : 'datetime.date'
-        The prior day's date
+    tickers : 'list'
+        The list of tuples of ids and ticker symbols,
+        e.g. [(23, 'AAPL'), (24, 'MSFT')]
+    start : 'datetime.date'
+        The first date of bars to download
+    end : 'datetime.date'
+        The last date of bars to download
     alpaca : 'alpaca_trade_api.rest.REST'
         An instantiation of the Alpaca REST API
         from the SDK.
 
     Returns
     -------
-    'pandas.DataFrame'
-        A dataframe of the prior day's price data that
-        matches the schema of the daily_price table
+    'bytes'
+        The JSON list of raw bars returned by Alpaca
     """
 
-    # Get the prior days price data as
-    # a pandas dataframe.
-    price_data_df = alpaca.get_bars(
-        ticker[1],
+    from alpaca_trade_api.rest import TimeFrame
+
+    symbols = [ticker for _, ticker in tickers]
+    cache_key = (
+        'alpaca',
+        'bars_json',
+        ','.join(symbols),
         TimeFrame.Day,
-        start=date,
-        end=date
-    ).df
+        start.isoformat(),
+        end.isoformat()
+    )
 
-    # If dataframe is empty skip formatting.
-    if price_data_df.empty:
-        return price_data_df
-    else:
-        return format_dataframe(price_data_df, ticker[0])
+    # The raw bars skip the SDK's DataFrame and Bar objects,
+    # and are cached as JSON so reading a cache entry never
+    # runs code.
+    def download():
+        return json.dumps(list(alpaca.get_bars_iter(
+            symbols,
+            TimeFrame.Day,
+            start=start,
+            end=end,
+            raw=True
+        ))).encode('utf-8')
+
+    # Bars fetched before Alpaca publishes the last session
+    # would be replayed by every later run; only cache a
+    # response with the last session of every symbol.
+    def complete(payload):
+        last_session = end.isoformat()
+        published = {
+            bar.get('S', symbols[0])
+            for bar in json.loads(payload)
+            if bar['t'][:10] == last_session
+        }
+        return published.issuperset(symbols)
+
+    return response_cache.fetch(cache_key, download, cacheable=complete)
+
+
+def bars_to_rows(bars, symbol_ids, now=None):
+    """Convert raw Alpaca bars straight to daily_price rows
+    for the bulk loader, without building a DataFrame.
+
+    Parameters
+    ----------
+    bars : 'list'
+        The raw bar dicts returned by Alpaca, with the symbol
+        in 'S', the UTC timestamp in 't' and the prices and
+        volume in 'o', 'h', 'l', 'c' and 'v'
+    symbol_ids : 'dict'
+        The symbol ids keyed by ticker
+    now : 'datetime.datetime'
+        The created_date and last_updated of every row,
+        defaults to the current time
+
+    Returns
+    -------
+    'list'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS,
+        with the dates as ISO strings COPY reads directly
+    """
+
+    # Stamp and format the timestamps once per batch.
+    stamp = (now or dt.now(timezone.utc)).isoformat(sep=' ')
+
+    # Daily bars are stamped at midnight New York time,
+    # so the UTC date is the session date.
+    return [
+        (
+            ALPACA_VENDOR_ID,
+            symbol_ids[bar['S']],
+            bar['t'][:10],
+            stamp,
+            stamp,
+            bar['o'],
+            bar['h'],
+            bar['l'],
+            bar['c'],
+            bar['v']
+        )
+        for bar in bars
+    ]
+
+
+def parse_price_bars(tickers, payload):
+    """Convert the raw bars of a multi-symbol request to
+    daily_price rows.
+
+    Parameters
+    ----------
+    tickers : 'list'
+        The list of tuples of ids and ticker symbols,
+        e.g. [(23, 'AAPL'), (24, 'MSFT')]
+    payload : 'bytes'
+        The JSON list of raw bars returned by Alpaca
+
+    Returns
+    -------
+    'list'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS
+    """
+
+    symbol_ids = {ticker: ticker_id for ticker_id, ticker in tickers}
+    bars = json.loads(payload)
+
+    # Single symbol responses don't include the symbol.
+    for bar in bars:
+        bar.setdefault('S', tickers[0][1])
+    metrics.increment('bars_parsed', len(bars), vendor='alpaca')
+
+    with metrics.timer(stage='format'):
+        return bars_to_rows(bars, symbol_ids)
+
+
+def parse_price_range(item, payload):
+    """Convert the bars of a ranged request to daily_price
+    rows.
+
+    Parameters
+    ----------
+    item : 'tuple'
+        The list of (id, ticker) tuples and the first and
+        last date of the request
+    payload : 'bytes'
+        The JSON list of raw bars returned by Alpaca
+
+    Returns
+    -------
+    'list'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS
+    """
+
+    return parse_price_bars(item[0], payload)
+
+
+def range_items(groups, chunk_size):
+    """Split groups of symbols into ranged request items.
+
+    Parameters
+    ----------
+    groups : 'dict'
+        The lists of (id, ticker) tuples keyed by the first
+        and last date to request
+    chunk_size : 'int'
+        The maximum number of tickers per request
+
+    Returns
+    -------
+    'list'
+        The tuples of a list of (id, ticker) tuples and the
+        first and last date to request for them
+    """
+
+    return [
+        (chunk, start, end)
+        for (start, end), tickers in sorted(groups.items())
+        for chunk in chunk_tickers(tickers, chunk_size)
+    ]
+
+
+def load_price_ranges(connection, alpaca, items, max_attempts=MAX_ATTEMPTS):
+    """Fetch and format the bars of several ranged requests
+    concurrently, and enter them into the daily_price table.
+    Failed requests are retried with exponential backoff, and
+    the tickers of requests that fail every attempt are written
+    to a csv.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    alpaca : 'alpaca_trade_api.rest.REST'
+        An instantiation of the Alpaca REST API
+        from the SDK.
+    items : 'list'
+        The tuples of a list of (id, ticker) tuples and the
+        first and last date to request for them
+    max_attempts : 'int'
+        The number of times a request is tried
+    """
+
+    def fetch_range(item):
+        tickers, start, end = item
+        fetch_start = perf_counter()
+        payload = download_price_data(tickers, start, end, alpaca)
+
+        # Spread the request's latency over its tickers.
+        latency = (perf_counter() - fetch_start) / len(tickers)
+        for _ in tickers:
+            metrics.observe('ticker_latency_seconds', latency, vendor='alpaca')
+
+        return payload
+
+    def write_ranges(batch):
+        daily_data = [row for _, rows in batch for row in rows]
+        if daily_data:
+            # Stream records into securities master db, rolling
+            # back a failed batch so its items can be retried.
+            try:
+                copy_daily_prices(connection, daily_data, upsert=True, update_coverage=True,
+                                  consolidate=True)
+            except Exception:
+                connection.rollback()
+                raise
+
+    pipeline = IngestPipeline(
+        fetch_range,
+        parse_price_range,
+        write_ranges,
+        fetch_workers=FETCH_WORKERS,
+        parse_workers=PARSE_WORKERS,
+        batch_size=WRITE_BATCH_SIZE
+    )
+    def run_ranges(ranges):
+        failed = pipeline.run(ranges)
+
+        # Roll back a failed transaction before a retry.
+        if failed:
+            connection.rollback()
+        return failed
+
+    failed = run_with_retries(run_ranges, items, max_attempts=max_attempts)
+    failed_updates = [ticker for item, err in failed for ticker in item[0]]
+
+    # If any tickers failed, write the tickers to
+    # a csv file.
+    if failed_updates:
+        filename = 'failed_updates_' + dt.today().strftime('%Y%m%d')
+        save_csv(failed_updates, filename)
+        print(
+            "One or more tickers failed. They were saved to "
+            "a csv in the failed_inserts directory with the "
+            "file name failed_updates_yyyymmdd.csv. Run them "
+            "again with --retry-csv."
+        )
+        sys.exit()
 
 
-def insert_into_daily_price(connection, alpaca):
+def insert_into_daily_price(connection, alpaca, chunk_size=BAR_CHUNK_SIZE):
     """If the NYSE was open the prior day, collect the prior
     day's price data for all of the stocks with historic price
     data in the daily_price table and insert the data into
-    the table.
+    the table in a single transaction.
 
     Parameters
     ----------
@@ -160,116 +453,214 @@ def insert_into_daily_price(connection, alpaca):
     alpaca : 'alpaca_trade_api.rest.REST'
         An instantiation of the Alpaca REST API
         from the SDK.
+    chunk_size : 'int'
+        The number of tickers requested per Alpaca call
     """
     # Confirm if yesterday was a
     # valid trading day.
-    nyse = mcal.get_calendar('NYSE')
     yesterday = date.today() - timedelta(days=1)
 
-    if not nyse.schedule(yesterday, yesterday).index.tolist():
+    if not is_trading_day(connection, yesterday):
         print("The NYSE was not open yesterday.")
         sys.exit()
     else:
         # Get the id and ticker symbol from all stocks in
         # the daily_price table.
         tickers = get_tickers_from_daily_price(connection=connection)
-        num_tickers = len(tickers)
-
-        # Enter the price data from the prior day into the
-        # daily_price table for each stock.
-        failed_updates = []
-
-        for i, ticker in enumerate(tickers):
-            daily_data_df = get_prior_day_price_data(ticker, yesterday, alpaca)
-            # If dataframe is empty proceed to the next ticker.
-            if daily_data_df.empty:
-                continue
-            else:
-                daily_data = [tuple(prices) for prices in daily_data_df.to_numpy()]
-
-                # Create insert string
-                fields = (
-                    "data_vendor_id, symbol_id, price_date, created_date, "
-                    "last_updated, open_price, high_price, low_price, "
-                    "close_price, volume"
-                )
-                records_list_template = ','.join(['%s'] * len(daily_data))
-                sql_insert = "INSERT INTO daily_price ({}) VALUES {}".format(
-                    fields,
-                    records_list_template
-                )
 
-                try:
-                    # Insert records into securities master db
-                    cur = connection.cursor()
-                    cur.execute(sql_insert, daily_data)
-                    connection.commit()
-                except Exception as err:
-                    # Rollback the previous transaction before starting another
-                    conn.rollback()
-                    failed_updates.append(ticker)
-
-                # Wait several seconds before continuing
-                # to the next element.
-                sleep(2)
-
-            print_progress_bar(
-                i + 1,
-                num_tickers,
-                prefix='Progress',
-                suffix='Complete',
-                length=50
-            )
-
-        # If any tickers failed, write the tickers to
-        # a csv file.
-        if failed_updates:
-            filename = 'failed_updates_' + dt.today().strftime('%Y%m%d')
-            save_csv(failed_updates, filename)
-            print(
-                "One or more tickers failed. They were saved to "
-                "a csv in the failed_inserts directory with the "
-                "file name failed_updates_yyyymmdd.csv"
-            )
-            sys.exit()
+        # Request the prior day for each chunk of stocks.
+        items = [
+            (chunk, yesterday, yesterday)
+            for chunk in chunk_tickers(tickers, chunk_size)
+        ]
+        load_price_ranges(connection, alpaca, items)
 
 
-if __name__ == "__main__":
-    # Set environment variables
-    load_dotenv()
+def catch_up_daily_price(connection, alpaca, chunk_size=BAR_CHUNK_SIZE, days=CATCH_UP_DAYS,
+                         tickers=None):
+    """Fill every NYSE session missed since each symbol's last
+    stored price, e.g. after the nightly job didn't run. Symbols
+    missing the same sessions are requested together, one ranged
+    multi-symbol call per chunk, instead of one call per day.
 
-    # Postgres
-    db_host = os.getenv('UW_SEC_MASTER_HOST')
-    db_user = os.getenv('UW_SEC_MASTER_USER')
-    db_pass = os.getenv('UW_SEC_MASTER_PASSWORD')
-
-    # Alpaca
-    ALPACA_API_KEY = os.getenv('ALPACA_API_KEY')
-    ALPACA_SECRET_KEY = os.getenv('ALPACA_SECRET_KEY')
-
-    # Establish connection to database.
-    db_name = "dev_sec_master"
-    db_port = "5432"
-
-    conn = psycopg2.connect(
-        database=db_name,
-        user=db_user,
-        password=db_pass,
-        host=db_host,
-        port=db_port
-    )
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    alpaca : 'alpaca_trade_api.rest.REST'
+        An instantiation of the Alpaca REST API
+        from the SDK.
+    chunk_size : 'int'
+        The number of tickers requested per Alpaca call
+    days : 'int'
+        The number of calendar days to look back; older gaps
+        are left to retrieve_historic_prices.py
+    tickers : 'list'
+        The (id, ticker) tuples to catch up, e.g. the failures
+        of an earlier run, or None for every symbol
+    """
+
+    # List the sessions up to yesterday.
+    yesterday = date.today() - timedelta(days=1)
+    sessions = trading_sessions(connection, yesterday - timedelta(days=days), yesterday)
+
+    last_price_dates = get_last_price_dates(connection)
+    if tickers is not None:
+        symbol_ids = {symbol_id for symbol_id, _ in tickers}
+        last_price_dates = [row for row in last_price_dates if row[0] in symbol_ids]
 
-    # Create the Alpaca API object.
-    alpaca = tradeapi.REST(
-        ALPACA_API_KEY,
-        ALPACA_SECRET_KEY,
-        api_version='v2'
+    groups = group_missing_sessions(last_price_dates, sessions)
+    if not groups:
+        print("No trading sessions are missing.")
+        return
+
+    items = range_items(groups, chunk_size)
+    print(f"Catching up {sum(map(len, groups.values()))} symbols in {len(items)} requests.")
+    load_price_ranges(connection, alpaca, items)
+
+
+def read_refetch_plan(path):
+    """Read the Alpaca ranges of a refetch plan written by
+    scan_daily_price.py and group their symbols by the range of
+    sessions to refetch.
+
+    Parameters
+    ----------
+    path : 'str'
+        The path of the refetch plan csv
+
+    Returns
+    -------
+    'dict'
+        The lists of (id, ticker) tuples keyed by the first
+        and last date to refetch
+    """
+
+    from scan_daily_price import read_plan_ranges
+
+    groups = {}
+    for symbol_id, ticker, start, end in read_plan_ranges(path, ALPACA_VENDOR_ID):
+        groups.setdefault((start, end), []).append((symbol_id, ticker))
+
+    return groups
+
+
+def refetch_daily_price(connection, alpaca, path, chunk_size=BAR_CHUNK_SIZE):
+    """Refetch the Alpaca ranges of a refetch plan and upsert
+    them into the daily_price table. Ranges of AlphaVantage
+    prices are refetched by retrieve_historic_prices.py --plan.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    alpaca : 'alpaca_trade_api.rest.REST'
+        An instantiation of the Alpaca REST API
+        from the SDK.
+    path : 'str'
+        The path of the refetch plan csv
+    chunk_size : 'int'
+        The number of tickers requested per Alpaca call
+    """
+
+    from scan_daily_price import read_plan_ranges
+
+    other_ranges = len(read_plan_ranges(path, ALPHAVANTAGE_VENDOR_ID))
+    if other_ranges:
+        print(
+            f"Skipping {other_ranges} ranges of AlphaVantage prices; refetch them with "
+            f"python retrieve_historic_prices.py --plan {path}"
+        )
+
+    groups = read_refetch_plan(path)
+    if not groups:
+        print("The refetch plan has no Alpaca ranges.")
+        return
+
+    items = range_items(groups, chunk_size)
+    print(f"Refetching {sum(map(len, groups.values()))} ranges in {len(items)} requests.")
+    load_price_ranges(connection, alpaca, items)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the prior day's prices from Alpaca into daily_price."
+    )
+    parser.add_argument(
+        '--catch-up',
+        action='store_true',
+        help="Fill every session missed since each symbol's last stored price"
+    )
+    parser.add_argument(
+        '--plan',
+        default=None,
+        help="Refetch the ranges of a refetch plan from scan_daily_price.py"
+    )
+    parser.add_argument(
+        '--retry-csv',
+        default=None,
+        help="Catch up the tickers of a failed_updates csv from an earlier run"
+    )
+    parser.add_argument(
+        '--days',
+        type=int,
+        default=CATCH_UP_DAYS,
+        help="Number of calendar days the catch-up looks back"
     )
+    parser.add_argument(
+        '--profile',
+        default=None,
+        help="Run under cProfile and save the stats to this path"
+    )
+    args = parser.parse_args()
 
-    # Insert prior day's price data if the NYSE was open
-    insert_into_daily_price(connection=conn, alpaca=alpaca)
+    # Set environment variables
+    load_dotenv()
 
-    # Close all remote connections
-    alpaca.close()
-    conn.close()
+    # Number of symbols per Alpaca bars request
+    chunk_size = int(os.getenv('ALPACA_BAR_CHUNK_SIZE', BAR_CHUNK_SIZE))
+
+    # Write the run report even when the job exits early.
+    try:
+        with profiled(args.profile):
+            with db_connection() as conn:
+                # Exit before loading the Alpaca SDK
+                # if the NYSE was closed yesterday.
+                yesterday = date.today() - timedelta(days=1)
+                nightly = not (args.catch_up or args.plan or args.retry_csv)
+                if nightly and not is_trading_day(conn, yesterday):
+                    print("The NYSE was not open yesterday.")
+                    sys.exit()
+
+                import alpaca_trade_api as tradeapi
+
+                # Alpaca
+                ALPACA_API_KEY = os.getenv('ALPACA_API_KEY')
+                ALPACA_SECRET_KEY = os.getenv('ALPACA_SECRET_KEY')
+
+                # Create the Alpaca API object.
+                alpaca = tradeapi.REST(
+                    ALPACA_API_KEY,
+                    ALPACA_SECRET_KEY,
+                    api_version='v2'
+                )
 
+                if args.retry_csv:
+                    # Rerun the failures of an earlier run
+                    catch_up_daily_price(conn, alpaca, chunk_size=chunk_size, days=args.days,
+                                         tickers=read_failed_tickers(args.retry_csv))
+                elif args.plan:
+                    # Refetch the gaps and anomalies of a scan
+                    refetch_daily_price(conn, alpaca, args.plan, chunk_size=chunk_size)
+                elif args.catch_up:
+                    # Insert every missed session's price data
+                    catch_up_daily_price(conn, alpaca, chunk_size=chunk_size, days=args.days)
+                else:
+                    # Insert prior day's price data if the NYSE was open
+                    insert_into_daily_price(connection=conn, alpaca=alpaca, chunk_size=chunk_size)
+
+            # Close all remote connections
+            alpaca.close()
+            close_pool()
+    finally:
+        write_report('daily_price_updates')
@@ -0,0 +1,283 @@
+# migrate_daily_price.py
+
+# Imports
+import argparse
+
+from datetime import date
+from build_db_tables import PARTITION_START_YEAR
+from build_db_tables import create_partitioned_daily_price_table
+from utils.bulk_load import DAILY_PRICE_FIELDS
+from utils.bulk_load import daily_price_upsert_sql
+from utils.db import close_pool
+from utils.db import db_connection
+from utils.progress import print_progress_bar
+
+# Name of the partitioned table while it is being filled.
+NEW_TABLE = 'daily_price_partitioned'
+
+# Name the existing table is given once the new one takes its place.
+LEGACY_TABLE = 'daily_price_legacy'
+
+# Number of rows copied per transaction.
+BATCH_SIZE = 50000
+
+
+def get_daily_price_bounds(connection):
+    """Get the id and price_date ranges of the existing
+    daily_price table.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+
+    Returns
+    -------
+    'tuple'
+        The minimum id, maximum id, earliest price_date and
+        latest price_date, all None if the table is empty
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT MIN(id), MAX(id), MIN(price_date), MAX(price_date) "
+        "FROM daily_price"
+    )
+    bounds = cur.fetchone()
+    connection.commit()
+    cur.close()
+
+    return bounds
+
+
+def copy_id_range(connection, low_id, high_id):
+    """Copy the rows of daily_price with low_id < id <= high_id
+    into the partitioned table in one short transaction.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    low_id : 'int'
+        The exclusive lower bound of the ids to copy
+    high_id : 'int'
+        The inclusive upper bound of the ids to copy
+    """
+
+    fields = ", ".join(('id',) + DAILY_PRICE_FIELDS)
+
+    cur = connection.cursor()
+    cur.execute(
+        "INSERT INTO {0} ({1}) SELECT {1} FROM daily_price "
+        "WHERE id > %s AND id <= %s "
+        "ON CONFLICT DO NOTHING".format(NEW_TABLE, fields),
+        (low_id, high_id)
+    )
+    connection.commit()
+    cur.close()
+
+
+def swap_tables(connection, last_copied_id, snapshot):
+    """Copy the rows written since the batches were copied and
+    swap the partitioned table in for daily_price.
+
+    Writes to daily_price are blocked for the duration of this
+    transaction but reads are not.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    last_copied_id : 'int'
+        The highest id copied by the batches
+    snapshot : 'str'
+        The server's transaction snapshot from when the
+        migration started; rows written by transactions it
+        doesn't see are copied again
+    """
+
+    fields = ", ".join(('id',) + DAILY_PRICE_FIELDS)
+
+    cur = connection.cursor()
+    cur.execute("LOCK TABLE daily_price IN EXCLUSIVE MODE")
+
+    # Rows inserted after the last batch.
+    cur.execute(
+        "INSERT INTO {0} ({1}) SELECT {1} FROM daily_price "
+        "WHERE id > %s ON CONFLICT DO NOTHING".format(NEW_TABLE, fields),
+        (last_copied_id,)
+    )
+
+    # Continue the id sequence where daily_price left off,
+    # before the upsert below draws ids from it.
+    cur.execute(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+        "(SELECT COALESCE(MAX(id), 1) FROM daily_price))",
+        (NEW_TABLE,)
+    )
+
+    # Rows the loaders upserted after they were copied, found
+    # by the transaction that wrote them rather than by any
+    # timestamp. xmin is widened to a 64-bit txid in the
+    # current epoch to test it against the start snapshot.
+    cur.execute(
+        "CREATE TEMP TABLE daily_price_changed ON COMMIT DROP AS "
+        "SELECT {} FROM daily_price WHERE NOT txid_visible_in_snapshot("
+        "txid_current() - ((txid_current() - xmin::text::bigint) %% 4294967296 "
+        "+ 4294967296) %% 4294967296, %s::txid_snapshot)".format(
+            ", ".join(DAILY_PRICE_FIELDS)
+        ),
+        (snapshot,)
+    )
+    cur.execute(daily_price_upsert_sql('daily_price_changed', target=NEW_TABLE, stamp=False))
+
+    # Rename the old table and its constraints out of the way.
+    cur.execute("ALTER TABLE daily_price RENAME TO {}".format(LEGACY_TABLE))
+    cur.execute(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND conname LIKE 'daily_price%%'",
+        (LEGACY_TABLE,)
+    )
+    for (constraint,) in cur.fetchall():
+        cur.execute("ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+            LEGACY_TABLE,
+            constraint,
+            constraint.replace('daily_price', LEGACY_TABLE, 1)
+        ))
+
+    # Give the partitioned table, its partitions, their
+    # constraints and their indexes the daily_price names.
+    cur.execute(
+        "SELECT inhrelid::regclass::text FROM pg_inherits "
+        "WHERE inhparent = %s::regclass",
+        (NEW_TABLE,)
+    )
+    for (partition,) in cur.fetchall():
+        cur.execute("ALTER TABLE {} RENAME TO {}".format(
+            partition,
+            partition.replace(NEW_TABLE, 'daily_price', 1)
+        ))
+    cur.execute("ALTER TABLE {} RENAME TO daily_price".format(NEW_TABLE))
+
+    cur.execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+        "WHERE conname LIKE %s",
+        (NEW_TABLE + '%',)
+    )
+    for table, constraint in cur.fetchall():
+        cur.execute("ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+            table,
+            constraint,
+            constraint.replace(NEW_TABLE, 'daily_price', 1)
+        ))
+
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relkind IN ('i', 'I') "
+        "AND relname LIKE %s",
+        (NEW_TABLE + '%',)
+    )
+    for (index,) in cur.fetchall():
+        cur.execute("ALTER INDEX {} RENAME TO {}".format(
+            index,
+            index.replace(NEW_TABLE, 'daily_price', 1)
+        ))
+
+    # Swap the names of the id sequences.
+    cur.execute("ALTER SEQUENCE daily_price_id_seq RENAME TO {}_id_seq".format(LEGACY_TABLE))
+    cur.execute("ALTER SEQUENCE {}_id_seq RENAME TO daily_price_id_seq".format(NEW_TABLE))
+
+    connection.commit()
+    cur.close()
+
+
+def migrate_daily_price(connection, batch_size=BATCH_SIZE, drop_legacy=False):
+    """Move the existing daily_price table into a partitioned
+    table online. Rows are copied in batches of ids, each in
+    its own transaction, while the loaders keep writing to
+    daily_price. The tables are then swapped in one short
+    transaction.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    batch_size : 'int'
+        The number of ids copied per transaction
+    drop_legacy : 'bool'
+        If True, drop the old table after the swap
+    """
+
+    # Every write committed after this snapshot is
+    # replayed at the swap.
+    cur = connection.cursor()
+    cur.execute("SELECT txid_current_snapshot()::text")
+    snapshot = cur.fetchone()[0]
+    connection.commit()
+    cur.close()
+
+    min_id, max_id, first_date, last_date = get_daily_price_bounds(connection)
+
+    # Build the partitioned table with a partition
+    # for every year already stored.
+    cur = connection.cursor()
+    this_year = date.today().year
+    create_partitioned_daily_price_table(
+        connection,
+        cur,
+        table_name=NEW_TABLE,
+        start_year=first_date.year if first_date else PARTITION_START_YEAR,
+        end_year=max(last_date.year if last_date else this_year, this_year) + 1
+    )
+    cur.close()
+
+    # Copy the rows in batches.
+    last_copied_id = 0
+    if max_id is not None:
+        batch_starts = range(min_id - 1, max_id, batch_size)
+        num_batches = len(batch_starts)
+
+        for i, low_id in enumerate(batch_starts):
+            high_id = min(low_id + batch_size, max_id)
+            copy_id_range(connection, low_id, high_id)
+            last_copied_id = high_id
+
+            print_progress_bar(
+                i + 1,
+                num_batches,
+                prefix='Progress',
+                suffix='Complete',
+                length=50
+            )
+
+    swap_tables(connection, last_copied_id, snapshot)
+
+    if drop_legacy:
+        cur = connection.cursor()
+        cur.execute("DROP TABLE {}".format(LEGACY_TABLE))
+        connection.commit()
+        cur.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate daily_price into a table partitioned by year."
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=BATCH_SIZE,
+        help="Number of ids copied per transaction"
+    )
+    parser.add_argument(
+        '--drop-legacy',
+        action='store_true',
+        help="Drop the unpartitioned table once the migration completes"
+    )
+    args = parser.parse_args()
+
+    # Connect to the remote database.
+    with db_connection() as conn:
+        migrate_daily_price(conn, batch_size=args.batch_size, drop_legacy=args.drop_legacy)
+
+    close_pool()
+    print("daily_price has been migrated to a partitioned table.\n\nScript complete.")
@@ -0,0 +1,338 @@
+# price_mirror.py
+
+# Imports
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from datetime import datetime as dt
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+from utils.db import close_pool
+from utils.db import db_connection
+
+# Directory the local mirror is written to
+MIRROR_DIR = 'price_mirror'
+
+# Columns stored in the mirror and their NumPy types. Missing
+# volumes are stored as -1 since int64 has no NaN.
+MIRROR_COLUMNS = {
+    'data_vendor_id': np.int32,
+    'symbol_id': np.int32,
+    'price_date': 'datetime64[D]',
+    'open_price': np.float64,
+    'high_price': np.float64,
+    'low_price': np.float64,
+    'close_price': np.float64,
+    'volume': np.int64,
+    'last_updated': 'datetime64[us]'
+}
+
+# Natural key of a row in the mirror
+MIRROR_KEY = ['data_vendor_id', 'symbol_id', 'price_date']
+
+# Rows committed slightly out of last_updated order are caught
+# by re-reading this much history before the watermark.
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+# Number of rows fetched from the server per round trip
+CHUNK_SIZE = 100000
+
+
+def read_watermark(directory=MIRROR_DIR):
+    """Read the last_updated watermark of the previous sync.
+
+    Parameters
+    ----------
+    directory : 'str'
+        The directory of the local mirror
+
+    Returns
+    -------
+    'datetime.datetime'
+        The newest last_updated value mirrored, or None if
+        the mirror has never been synced
+    """
+
+    try:
+        with open(Path(directory) / 'watermark.json') as f:
+            return dt.fromisoformat(json.load(f)['last_updated'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def write_watermark(watermark, directory=MIRROR_DIR):
+    """Write the last_updated watermark of a sync.
+
+    Parameters
+    ----------
+    watermark : 'datetime.datetime'
+        The newest last_updated value mirrored
+    directory : 'str'
+        The directory of the local mirror
+    """
+
+    tmp_path = Path(directory) / 'watermark.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_updated': watermark.isoformat()}, f)
+    os.replace(tmp_path, Path(directory) / 'watermark.json')
+
+
+def fetch_changed_prices(connection, since, chunk_size=CHUNK_SIZE):
+    """Stream the rows of daily_price updated after a
+    watermark through a named server-side cursor.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    since : 'datetime.datetime'
+        Only rows with a newer last_updated are read, or
+        None to read the whole table
+    chunk_size : 'int'
+        The number of rows fetched per round trip
+
+    Yields
+    ------
+    'pandas.DataFrame'
+        A chunk of changed rows with the MIRROR_COLUMNS
+    """
+
+    query = (
+        "SELECT data_vendor_id, symbol_id, price_date, open_price::float8, "
+        "high_price::float8, low_price::float8, close_price::float8, volume, "
+        "last_updated FROM daily_price"
+    )
+    params = []
+    if since is not None:
+        query += " WHERE last_updated > %s"
+        params.append(since)
+
+    cur = connection.cursor(name='sync_price_mirror')
+    cur.itersize = chunk_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=list(MIRROR_COLUMNS))
+    finally:
+        cur.close()
+        connection.commit()
+
+
+def to_mirror_types(prices_df):
+    """Convert a DataFrame of prices to the mirror's column types.
+
+    Parameters
+    ----------
+    prices_df : 'pandas.DataFrame'
+        Rows with the MIRROR_COLUMNS
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The rows with NumPy typed columns
+    """
+
+    prices_df = prices_df.copy()
+    prices_df['price_date'] = pd.to_datetime(prices_df['price_date'])
+    prices_df['last_updated'] = pd.to_datetime(
+        prices_df['last_updated'],
+        utc=True
+    ).dt.tz_convert(None)
+    prices_df['volume'] = prices_df['volume'].fillna(-1)
+
+    return prices_df.astype({
+        column: dtype
+        for column, dtype in MIRROR_COLUMNS.items()
+        if column not in ('price_date', 'last_updated')
+    })
+
+
+def load_year_frame(year, directory=MIRROR_DIR):
+    """Load one year of the mirror into a DataFrame.
+
+    Parameters
+    ----------
+    year : 'int'
+        The year of price_date to load
+    directory : 'str'
+        The directory of the local mirror
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The mirrored rows, empty if the year isn't mirrored
+    """
+
+    columns = open_price_mirror(year, directory=directory)
+    if not columns:
+        return pd.DataFrame(columns=list(MIRROR_COLUMNS))
+
+    return pd.DataFrame({column: np.asarray(values) for column, values in columns.items()})
+
+
+def write_year(year, prices_df, directory=MIRROR_DIR):
+    """Write one year of the mirror as a .npy file per column.
+    The files are written to a temporary directory that then
+    replaces the year, so readers never see a partial write.
+
+    Parameters
+    ----------
+    year : 'int'
+        The year of price_date being written
+    prices_df : 'pandas.DataFrame'
+        Every mirrored row of the year
+    directory : 'str'
+        The directory of the local mirror
+    """
+
+    year_dir = Path(directory) / f"year={year}"
+    tmp_dir = Path(directory) / f"year={year}.tmp"
+    old_dir = Path(directory) / f"year={year}.old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    for column, dtype in MIRROR_COLUMNS.items():
+        np.save(tmp_dir / f"{column}.npy", prices_df[column].to_numpy().astype(dtype))
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if year_dir.exists():
+        year_dir.rename(old_dir)
+    tmp_dir.rename(year_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def sync_price_mirror(connection, directory=MIRROR_DIR, chunk_size=CHUNK_SIZE):
+    """Mirror the daily_price table into the local columnar store.
+    The first sync copies the whole table; later syncs only pull
+    rows with a last_updated newer than the previous watermark
+    and merge them into the affected years.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    directory : 'str'
+        The directory of the local mirror
+    chunk_size : 'int'
+        The number of rows fetched per round trip
+
+    Returns
+    -------
+    'int'
+        The number of changed rows pulled from the database
+    """
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    watermark = read_watermark(directory)
+    # The watermark is stored as naive UTC.
+    since = None
+    if watermark is not None:
+        since = (watermark - WATERMARK_OVERLAP).replace(tzinfo=timezone.utc)
+
+    # Group the changed rows by year of price_date.
+    changed = {}
+    num_rows = 0
+    for chunk_df in fetch_changed_prices(connection, since, chunk_size):
+        chunk_df = to_mirror_types(chunk_df)
+        num_rows += len(chunk_df)
+        for year, year_df in chunk_df.groupby(chunk_df['price_date'].dt.year):
+            changed.setdefault(year, []).append(year_df)
+
+        newest = chunk_df['last_updated'].max().to_pydatetime()
+        if watermark is None or newest > watermark.replace(tzinfo=None):
+            watermark = newest
+
+    # Merge the changes into each affected year, keeping
+    # the most recently updated row for every key.
+    for year, year_dfs in changed.items():
+        year_df = pd.concat([load_year_frame(year, directory)] + year_dfs, ignore_index=True)
+        year_df = to_mirror_types(year_df)
+        year_df = year_df.sort_values(MIRROR_KEY + ['last_updated'], kind='stable')
+        year_df = year_df.drop_duplicates(MIRROR_KEY, keep='last')
+        year_df = year_df.sort_values(['symbol_id', 'price_date', 'data_vendor_id'])
+        write_year(year, year_df, directory)
+
+    if watermark is not None:
+        write_watermark(watermark.replace(tzinfo=None), directory)
+
+    return num_rows
+
+
+def mirrored_years(directory=MIRROR_DIR):
+    """List the years stored in the local mirror.
+
+    Parameters
+    ----------
+    directory : 'str'
+        The directory of the local mirror
+
+    Returns
+    -------
+    'list'
+        The mirrored years in ascending order
+    """
+
+    return sorted(
+        int(path.name.split('=')[1])
+        for path in Path(directory).glob('year=*')
+        if path.is_dir() and path.name.split('=')[1].isdigit()
+    )
+
+
+def open_price_mirror(year, columns=None, directory=MIRROR_DIR):
+    """Open one year of the local mirror as memory-mapped
+    NumPy arrays. No data is copied; pages are read from
+    disk as the arrays are accessed.
+
+    Parameters
+    ----------
+    year : 'int'
+        The year of price_date to open
+    columns : 'list'
+        The columns to open, defaults to every column
+    directory : 'str'
+        The directory of the local mirror
+
+    Returns
+    -------
+    'dict'
+        Read-only memory-mapped arrays keyed by column name,
+        sorted by symbol_id and price_date; empty if the year
+        isn't mirrored
+    """
+
+    year_dir = Path(directory) / f"year={year}"
+    if not year_dir.is_dir():
+        return {}
+
+    return {
+        column: np.load(year_dir / f"{column}.npy", mmap_mode='r')
+        for column in (columns or MIRROR_COLUMNS)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync daily_price into a local memory-mapped columnar mirror."
+    )
+    parser.add_argument(
+        '--directory',
+        default=MIRROR_DIR,
+        help="Directory of the local mirror"
+    )
+    args = parser.parse_args()
+
+    # Connect to the remote database.
+    with db_connection() as conn:
+        num_rows = sync_price_mirror(conn, directory=args.directory)
+
+    close_pool()
+    print(f"{num_rows} changed rows were synced to {args.directory}.")
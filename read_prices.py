@@ -0,0 +1,221 @@
+# read_prices.py
+
+# Imports
+import pandas as pd
+from snp500_insert import SNP500_INDEX
+
+
+# Columns of daily_price that can be loaded, with the SQL used
+# to select them. NUMERIC prices are cast to float8 on the
+# server so they arrive as floats instead of Decimals.
+PRICE_FIELDS = {
+    'open_price': 'dp.open_price::float8',
+    'high_price': 'dp.high_price::float8',
+    'low_price': 'dp.low_price::float8',
+    'close_price': 'dp.close_price::float8',
+    'volume': 'dp.volume'
+}
+
+# Number of rows fetched from the server per round trip
+CHUNK_SIZE = 100000
+
+
+def resolve_symbol_ids(connection, tickers):
+    """Resolve ticker symbols to their ids in the symbol
+    table with a single query.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    tickers : 'list'
+        The ticker symbols, e.g. ['AAPL', 'MSFT']
+
+    Returns
+    -------
+    'dict'
+        The ticker symbols keyed by symbol id
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT id, ticker FROM symbol WHERE ticker = ANY(%s)",
+        (list(tickers),)
+    )
+    symbols = cur.fetchall()
+    cur.close()
+
+    return {symbol[0]: symbol[1] for symbol in symbols}
+
+
+def iter_prices(connection, tickers, start, end, fields=('close_price',), vendor=None,
+                chunk_size=CHUNK_SIZE):
+    """Stream prices from the daily_price table through a named
+    server-side cursor, one DataFrame per chunk of rows, so
+    results larger than memory can be processed incrementally.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    tickers : 'list'
+        The ticker symbols, e.g. ['AAPL', 'MSFT']
+    start : 'datetime.date'
+        The first price_date to load
+    end : 'datetime.date'
+        The last price_date to load
+    fields : 'list'
+        The price columns to load, any of the keys of PRICE_FIELDS
+    vendor : 'int'
+        The data_vendor id to load prices from, or None
+        for the consolidated_price of every key
+    chunk_size : 'int'
+        The number of rows fetched per round trip
+
+    Yields
+    ------
+    'pandas.DataFrame'
+        A long format chunk with price_date, ticker and the
+        requested fields, ordered by price_date
+    """
+
+    unknown = [field for field in fields if field not in PRICE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown price fields: {unknown}")
+
+    symbols = resolve_symbol_ids(connection, tickers)
+    if not symbols:
+        return
+
+    # Without a vendor, read the one consolidated
+    # price per key through its primary key.
+    query = (
+        "SELECT dp.price_date, dp.symbol_id, {} FROM {} AS dp "
+        "WHERE dp.symbol_id = ANY(%s) "
+        "AND dp.price_date BETWEEN %s AND %s"
+    ).format(
+        ", ".join(PRICE_FIELDS[field] for field in fields),
+        'consolidated_price' if vendor is None else 'daily_price'
+    )
+    params = [list(symbols), start, end]
+    if vendor is not None:
+        query += " AND dp.data_vendor_id = %s"
+        params.append(vendor)
+    query += " ORDER BY dp.price_date, dp.symbol_id"
+
+    # Rows stay on the server until they are fetched.
+    cur = connection.cursor(name='load_prices')
+    cur.itersize = chunk_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            chunk_df = pd.DataFrame(rows, columns=['price_date', 'symbol_id'] + list(fields))
+            chunk_df['price_date'] = pd.to_datetime(chunk_df['price_date'])
+            chunk_df['ticker'] = chunk_df.pop('symbol_id').map(symbols)
+
+            yield chunk_df[['price_date', 'ticker'] + list(fields)]
+    finally:
+        cur.close()
+        connection.commit()
+
+
+def load_prices(connection, tickers, start, end, fields='close_price', vendor=None,
+                chunk_size=CHUNK_SIZE):
+    """Load prices from the daily_price table as a wide
+    date by symbol panel.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    tickers : 'list'
+        The ticker symbols, e.g. ['AAPL', 'MSFT']
+    start : 'datetime.date'
+        The first price_date to load
+    end : 'datetime.date'
+        The last price_date to load
+    fields : 'str' or 'list'
+        A price column, or a list of price columns, to load
+    vendor : 'int'
+        The data_vendor id to load prices from, or None
+        for the consolidated_price of every key
+    chunk_size : 'int'
+        The number of rows fetched per round trip
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The prices indexed by price_date with a column per
+        ticker. When a list of fields is requested the columns
+        are a (field, ticker) MultiIndex.
+    """
+
+    single_field = isinstance(fields, str)
+    field_list = [fields] if single_field else list(fields)
+
+    chunks = list(iter_prices(connection, tickers, start, end, field_list, vendor, chunk_size))
+    if not chunks:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='price_date'))
+
+    prices_df = pd.concat(chunks, ignore_index=True)
+
+    # A ticker can map to more than one symbol id; keep the last.
+    panel_df = prices_df.pivot_table(
+        index='price_date',
+        columns='ticker',
+        values=field_list,
+        aggfunc='last'
+    )
+
+    if single_field:
+        panel_df = panel_df[fields]
+
+    return panel_df
+
+
+def load_universe(connection, dates, index_name=SNP500_INDEX):
+    """Load the constituents of an index as of many dates with
+    a single set-based query against the index_membership table,
+    e.g. every rebalance date of a backtest.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    dates : 'list'
+        The as-of dates, e.g. [date(2008, 9, 15)]
+    index_name : 'str'
+        The name of the index, e.g. 'S&P 500'
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The as_of date, symbol_id and ticker of every
+        constituent, ordered by as_of and ticker
+    """
+
+    # Every as-of date is probed against the
+    # GiST index on the membership periods.
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT d.as_of, m.symbol_id, s.ticker "
+        "FROM unnest(%s::date[]) AS d(as_of) "
+        "JOIN index_membership AS m "
+        "ON daterange(m.start_date, m.end_date, '[)') @> d.as_of "
+        "JOIN symbol AS s ON m.symbol_id = s.id "
+        "WHERE m.index_name = %s "
+        "ORDER BY d.as_of, s.ticker",
+        (sorted(set(pd.to_datetime(list(dates)).date)), index_name)
+    )
+    rows = cur.fetchall()
+    connection.commit()
+    cur.close()
+
+    universe_df = pd.DataFrame(rows, columns=['as_of', 'symbol_id', 'ticker'])
+    universe_df['as_of'] = pd.to_datetime(universe_df['as_of'])
+
+    return universe_df
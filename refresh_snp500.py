@@ -0,0 +1,107 @@
+# refresh_snp500.py
+
+# Imports
+import argparse
+import io
+import pandas as pd
+
+from scrape_snp500_current import obtain_parse_wiki_snp500_current
+from scrape_snp500_membership import SNP500_URL
+from scrape_snp500_membership import obtain_parse_wiki_snp500_membership
+from scrape_snp500_past import obtain_parse_wiki_snp500_past
+from snp500_insert import SNP500_INDEX
+from snp500_insert import apply_symbol_changes
+from snp500_insert import diff_symbols
+from snp500_insert import obtain_symbols
+from snp500_insert import replace_index_membership
+from utils.db import close_pool
+from utils.db import db_connection
+from utils.response_cache import response_cache_from_env
+
+# Wikipedia asks automated clients to identify themselves
+REQUEST_HEADERS = {'User-Agent': 'securities-master-database/1.0'}
+
+# Compressed cache of the Wikipedia page
+response_cache = response_cache_from_env()
+
+
+def fetch_snp500_tables():
+    """Download the Wikipedia list of S&P 500 companies once,
+    revalidating a cached copy with a conditional request, and
+    parse its tables.
+
+    Returns
+    -------
+    'list'
+        The DataFrames parsed from the page
+    """
+
+    html = response_cache.fetch_conditional(SNP500_URL, headers=REQUEST_HEADERS)
+
+    return pd.read_html(io.StringIO(html.decode('utf-8')))
+
+
+def refresh_snp500_symbols(connection, tables, dry_run=False):
+    """Bring the symbol table in line with the S&P 500 current
+    and past constituents, writing only the rows that changed.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    tables : 'list'
+        The DataFrames parsed from the Wikipedia page
+    dry_run : 'bool'
+        If True, compute the changes without applying them
+
+    Returns
+    -------
+    'dict'
+        The records to 'insert', 'update' and 'deactivate'
+    """
+
+    symbols = obtain_parse_wiki_snp500_current(tables) + obtain_parse_wiki_snp500_past(tables)
+    changes = diff_symbols(obtain_symbols(connection), symbols)
+    if not dry_run:
+        apply_symbol_changes(connection, changes)
+
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Refresh the S&P 500 symbols and index membership from Wikipedia."
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help="Report the changes without applying them"
+    )
+    parser.add_argument(
+        '--skip-membership',
+        action='store_true',
+        help="Don't rebuild the index_membership intervals"
+    )
+    args = parser.parse_args()
+
+    tables = fetch_snp500_tables()
+
+    with db_connection() as conn:
+        changes = refresh_snp500_symbols(conn, tables, dry_run=args.dry_run)
+
+    print(
+        f"{len(changes['insert'])} symbols inserted, {len(changes['update'])} updated "
+        f"and {len(changes['deactivate'])} deactivated"
+        + (" (dry run)." if args.dry_run else ".")
+    )
+
+    if not args.dry_run and not args.skip_membership:
+        num_intervals, missing = replace_index_membership(
+            obtain_parse_wiki_snp500_membership(tables),
+            SNP500_INDEX
+        )
+        print(f"{num_intervals} {SNP500_INDEX} membership intervals were refreshed.")
+        if missing:
+            print(f"{len(missing)} tickers aren't in the symbol table: {', '.join(missing)}")
+
+    close_pool()
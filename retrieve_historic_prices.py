@@ -1,50 +1,76 @@
 # retrieve_historic_prices.py
 
 # imports
+from argparse import ArgumentParser
+from datetime import date
 from datetime import datetime as dt
+from datetime import timedelta
+from datetime import timezone
 from dotenv import load_dotenv
+from scan_daily_price import read_plan_ranges
+from utils.bulk_load import copy_daily_price_frame
+from utils.db import close_pool
+from utils.db import db_connection
 from utils.fileio import save_csv
+from utils.ingest_jobs import MAX_ATTEMPTS
+from utils.ingest_jobs import complete_tasks
+from utils.ingest_jobs import fail_tasks
+from utils.ingest_jobs import finish_job
+from utils.ingest_jobs import pending_tasks
+from utils.ingest_jobs import read_failed_tickers
+from utils.ingest_jobs import reopen_job
+from utils.ingest_jobs import run_with_retries
+from utils.ingest_jobs import start_job
+from utils.metrics import metrics
+from utils.metrics import profiled
+from utils.metrics import write_report
+from utils.parsing import parse_alphavantage_daily
+from utils.pipeline import IngestPipeline
+from utils.response_cache import response_cache_from_env
+from utils.vendor_client import QuotaExceededError
+from utils.vendor_client import VendorRequestError
+from utils.vendor_client import alphavantage_client_from_env
+from utils.vendor_client import alphavantage_error
 import os
 import json
-import time
 import warnings
 
-import psycopg2
-import requests
+import numpy as np
+import pandas as pd
 
 # Load variables into shell
 load_dotenv()
 
 # AlphaVantage variables
 ALPHA_VANTAGE_API_KEY = os.getenv('ALPHAVANTAGE_API_KEY')
-ALPHA_VANTAGE_BASE_URL = 'https://www.alphavantage.co'
+ALPHA_VANTAGE_BASE_URL = os.getenv('ALPHAVANTAGE_BASE_URL', 'https://www.alphavantage.co').rstrip('/')
 ALPHA_VANTAGE_TIME_SERIES_CALL = 'query?function=TIME_SERIES_DAILY'
 
 # Script operation
 TICKER_COUNT = 10  # Change this to adjust number of downloads, 505 records in `symbol` table as of 2021-09-02
-WAIT_TIME_IN_SECONDS = 15.0  # Adjust how frequently the API is called
+MAX_WORKERS = 4  # Number of AlphaVantage requests kept in flight
+PARSE_WORKERS = 2  # Number of processes parsing AlphaVantage responses
+WRITE_BATCH_SIZE = 8  # Number of tickers written per COPY and commit
+COMPACT_WINDOW_DAYS = 130  # Calendar days safely covered by the 100 bars of outputsize=compact
+JOB_NAME = 'retrieve_historic_prices'  # Name of the runs in the ingest_job table
 
-# Connect to securities master db
-db_host = os.getenv('UW_SEC_MASTER_HOST')
-db_user = os.getenv('UW_SEC_MASTER_USER')
-db_pass = os.getenv('UW_SEC_MASTER_PASSWORD')
-db_name = "dev_sec_master"
-db_port = "5432"
-
-conn = psycopg2.connect(
-    database=db_name,
-    user=db_user,
-    password=db_pass,
-    host=db_host,
-    port=db_port
-)
+# Compressed cache of raw AlphaVantage responses
+response_cache = response_cache_from_env()
 
+# AlphaVantage client paced to the API plan's calls/minute and
+# calls/day quotas, which slows down when it's throttled
+alphavantage = alphavantage_client_from_env()
 
 # Functions
 # Query Securities Master for tickers
-def obtain_list_of_db_tickers():
+def obtain_list_of_db_tickers(connection):
     """Obtain list of ticker symbols in Securities Master database.
     
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+
     Returns
     -------
     'list'
@@ -53,17 +79,100 @@ def obtain_list_of_db_tickers():
     """
     
     # Query symbol table
-    cur = conn.cursor()
+    cur = connection.cursor()
     cur.execute("SELECT id, ticker FROM symbol")
-    conn.commit()
+    connection.commit()
     data = cur.fetchall()
     cur.close()
     
     return [(d[0], d[1]) for d in data]
 
 
+# Query Securities Master for the latest stored prices
+def obtain_last_price_dates(connection, data_vendor_id):
+    """Obtain the last stored price_date of every symbol with
+    prices from a data vendor from the symbol_coverage table.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    data_vendor_id : 'int'
+        The id of the data vendor from the
+        data_vendor table
+
+    Returns
+    -------
+    'dict'
+        The last price_date keyed by symbol id
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT symbol_id, last_price_date FROM symbol_coverage "
+        "WHERE data_vendor_id = %s",
+        (data_vendor_id,)
+    )
+    connection.commit()
+    data = cur.fetchall()
+    cur.close()
+
+    return {d[0]: d[1] for d in data}
+
+
+# Choose how much history to request
+def choose_outputsize(last_date, today=None):
+    """Choose the AlphaVantage outputsize needed to cover the
+    gap between a symbol's last stored price and today.
+
+    Parameters
+    ----------
+    last_date : 'datetime.date'
+        The last stored price_date, or None if the symbol
+        has no prices yet
+    today : 'datetime.date'
+        The current date, defaults to date.today()
+
+    Returns
+    -------
+    'str'
+        'compact' if the latest 100 bars cover the gap,
+        otherwise 'full'
+    """
+
+    today = today or date.today()
+    if last_date is not None and (today - last_date).days <= COMPACT_WINDOW_DAYS:
+        return 'compact'
+
+    return 'full'
+
+
+# Drop prices that are already stored
+def filter_new_prices(prices, last_date):
+    """Keep only the prices dated after a symbol's last
+    stored price_date.
+
+    Parameters
+    ----------
+    prices : 'pandas.DataFrame'
+        The OHLCV prices and volumes
+    last_date : 'datetime.date'
+        The last stored price_date, or None to keep every price
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The prices dated after last_date
+    """
+
+    if last_date is None:
+        return prices
+
+    return prices[prices['price_date'].to_numpy() > np.datetime64(last_date)]
+
+
 # Call AlphaVantage API
-def construct_alpha_vantage_symbol_call(ticker):
+def construct_alpha_vantage_symbol_call(ticker, outputsize='full'):
     """Construct the full API call to AlphaVantage based on the user
     provided API key and the desired ticker symbol.
     
@@ -71,6 +180,9 @@ def construct_alpha_vantage_symbol_call(ticker):
     ----------
     ticker : 'str'
         The ticker to be passed to the API call
+    outputsize : 'str'
+        'full' for the complete history or 'compact'
+        for the latest 100 bars
     
     Returns
     -------
@@ -78,71 +190,85 @@ def construct_alpha_vantage_symbol_call(ticker):
             The full API call for a ticker time series
     """
     
-    return "{}/{}&symbol={}&outputsize=full&apikey={}".format(
+    return "{}/{}&symbol={}&outputsize={}&apikey={}".format(
         ALPHA_VANTAGE_BASE_URL,
         ALPHA_VANTAGE_TIME_SERIES_CALL,
         ticker,
+        outputsize,
         ALPHA_VANTAGE_API_KEY
     )
 
 
-# Get price data for ticker
-def get_daily_historic_data_alphavantage(ticker):
+# Download price data for ticker
+def download_daily_historic_data_alphavantage(ticker, outputsize='full'):
     """Use the generated API call to query AlphaVantage with the
-    appropriate API key and return a list of price tuples
-    for a particular ticker.
+    appropriate API key, reading through the response cache, and
+    return the raw response for a particular ticker.
 
     Parameters
     ----------
     ticker : 'str'
         The ticker symbol, e.g. 'AAPL'
-    start_date : 'datetime'
-        The starting date to obtain pricing for
-    end_date : 'datetime'
-        The ending date to obtain pricing for
+    outputsize : 'str'
+        'full' for the complete history or 'compact'
+        for the latest 100 bars
 
     Returns
     -------
-    'list'
-        The list of tuples comprised of OHLCV prices and volumes
+    'bytes'
+        The raw JSON response
     """
-    
+
     # Query url
-    av_url = construct_alpha_vantage_symbol_call(ticker.replace('.', '-'))
-    
-    try:
-        av_data_js = requests.get(av_url)
-        data = json.loads(av_data_js.text)['Time Series (Daily)']
-    except Exception as e:
-        print("""
-            Could not download AlphaVantage data for {} ticker 
-            ({})...stopping.
-        """.format(ticker, e))
-        return []
-    else:
-        prices = []
-        for date_str in sorted(data.keys()):
-            bar = data[date_str]
-            prices.append(
-                (
-                    dt.strptime(date_str, '%Y-%m-%d'),
-                    float(bar['1. open']),
-                    float(bar['2. high']),
-                    float(bar['3. low']),
-                    float(bar['4. close']),
-                    int(bar['5. volume'])
-                )
-            )
-    
-    return prices
+    av_url = construct_alpha_vantage_symbol_call(ticker.replace('.', '-'), outputsize)
+    cache_key = (
+        'alphavantage',
+        'TIME_SERIES_DAILY',
+        ticker,
+        outputsize,
+        date.today().isoformat()
+    )
 
+    def download():
+        # Throttled calls are slowed down and retried
+        # by the client.
+        av_data_js = alphavantage.get(av_url)
+        # An invalid call, e.g. for a delisted ticker,
+        # fails the same way on every retry.
+        error = alphavantage_error(av_data_js)
+        if error is not None:
+            raise VendorRequestError(f"{ticker}: {error}")
+        # Only cache responses that contain prices.
+        if '"Time Series (Daily)"' not in av_data_js.text:
+            raise ValueError(av_data_js.text[:200])
+        return av_data_js.content
+
+    return response_cache.fetch(cache_key, download)
+
+
+# Parse price data for ticker
+def parse_daily_historic_data_alphavantage(payload):
+    """Parse a raw AlphaVantage response into typed columns.
+
+    Parameters
+    ----------
+    payload : 'bytes'
+        The raw JSON response
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The OHLCV prices and volumes with typed columns
+    """
+
+    return parse_alphavantage_daily(json.loads(payload)['Time Series (Daily)'])
+
+
+# Add the daily_price columns to the price data
+def format_daily_data(data_vendor_id, symbol_id, daily_data):
+    """Append the vendor ID, symbol ID and timestamps to
+    a DataFrame of daily data.
 
-# Insert stock prices into securities master database
-def insert_daily_data_into_db(data_vendor_id, symbol_id, daily_data):
-    """Takes a list of tuples consisting of daily data and adds it to
-    the Securities Master database. Appends the vendor ID and symbol
-    ID to the data.
-    
     Parameters
     ----------
     data_vendor_id : 'int'
@@ -151,58 +277,241 @@ def insert_daily_data_into_db(data_vendor_id, symbol_id, daily_data):
     symbol_id : 'int'
         The id of the ticker from the
         symbol table
-    daily_data : 'list'
-        The list of tuples with daily price data
-        for each ticker
+    daily_data : 'pandas.DataFrame'
+        The typed columns of daily price data
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The price data with every daily_price column
     """
-    
-    now = dt.utcnow()
-    
-    # Amend data to include vendor ID and symbol ID
-    daily_data = [(data_vendor_id, symbol_id, d[0], now, now, d[1], d[2],
-                   d[3], d[4], d[5]) for d in daily_data]
-    
-    # Create insert string
-    fields = (
-        "data_vendor_id, symbol_id, price_date, created_date, "
-        "last_updated, open_price, high_price, low_price, "
-        "close_price, volume"
+
+    now = dt.now(timezone.utc)
+
+    return daily_data.assign(
+        data_vendor_id=data_vendor_id,
+        symbol_id=symbol_id,
+        created_date=now,
+        last_updated=now
     )
-    records_list_template = ','.join(['%s'] * len(daily_data))
-    sql_insert = "INSERT INTO daily_price ({}) VALUES {}".format(fields, records_list_template)
-    
-    # Insert records into securities master db
-    cur = conn.cursor()
-    cur.execute(sql_insert, daily_data)
-    conn.commit()
-    cur.close()
+
+
+# Pipeline parse stage
+def parse_ticker(item, payload):
+    """Parse a ticker's AlphaVantage response and keep only the
+    prices that aren't stored yet. Runs in a worker process.
+
+    Parameters
+    ----------
+    item : 'tuple'
+        The symbol id, ticker, outputsize and last stored
+        price_date of the ticker
+    payload : 'bytes'
+        The raw JSON response
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The new price data with every daily_price column
+    """
+
+    av_data = parse_daily_historic_data_alphavantage(payload)
+    # An empty download is a failed ticker.
+    if av_data.empty:
+        raise ValueError(f"No AlphaVantage data for {item[1]}")
+    metrics.increment('bars_parsed', len(av_data), vendor='alphavantage')
+    av_data = filter_new_prices(av_data, item[3])
+
+    with metrics.timer(stage='format'):
+        return format_daily_data(1, item[0], av_data)
+
+
+# Pipeline write stage
+def write_ticker_batch(batch, job_id=None):
+    """Write the price data of several tickers with a single
+    COPY and commit.
+
+    Parameters
+    ----------
+    batch : 'list'
+        The (item, price data) tuples of the tickers
+    job_id : 'int'
+        The ingest_job whose tasks are completed in the
+        same transaction, or None
+    """
+
+    with metrics.timer(stage='concat'):
+        daily_data = pd.concat([prices for _, prices in batch], ignore_index=True)
+
+    # A failed transaction is rolled back when the
+    # connection is returned to the pool, and a
+    # dropped connection is replaced.
+    with db_connection() as conn:
+        copy_daily_price_frame(conn, daily_data, upsert=True, update_coverage=True,
+                               consolidate=True, commit=False)
+        if job_id is not None:
+            cur = conn.cursor()
+            complete_tasks(cur, job_id, [item[0] for item, _ in batch])
+            cur.close()
+        conn.commit()
 
 
 if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Load AlphaVantage price history into the Securities Master database."
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help="Download and upsert the full history of every ticker"
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help="Replay cached AlphaVantage responses without calling the API"
+    )
+    parser.add_argument(
+        '--profile',
+        default=None,
+        help="Run under cProfile and save the stats to this path"
+    )
+    parser.add_argument(
+        '--new-job',
+        action='store_true',
+        help="Start a new job instead of resuming an interrupted one"
+    )
+    parser.add_argument(
+        '--job',
+        type=int,
+        default=None,
+        help="Resume the unfinished tickers of this ingest_job id"
+    )
+    parser.add_argument(
+        '--retry-csv',
+        default=None,
+        help="Run the tickers of a csv of failed tickers as a new job"
+    )
+    parser.add_argument(
+        '--plan',
+        default=None,
+        help="Refetch the AlphaVantage ranges of a refetch plan from scan_daily_price.py as a new job"
+    )
+    parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=MAX_ATTEMPTS,
+        help="Number of times a ticker is tried in this run"
+    )
+    args = parser.parse_args()
+    response_cache.offline = response_cache.offline or args.offline
+
     # This ignores the warnings regarding Data Truncation
     # from the AlphaVantage precision to Number(19,4) datatypes
     warnings.filterwarnings('ignore')
 
     # Loop over the tickers and insert the daily historical
     # data into Securities Master database
-    tickers = obtain_list_of_db_tickers() # [:TICKER_COUNT] # Uncomment `[:TICKER_COUNT]` to cap the number of queried tickers.
+    with db_connection() as conn:
+        # Resume the tickers an interrupted run didn't
+        # complete, or record a new run.
+        if args.job is not None:
+            job_id, resumed = args.job, True
+            reopen_job(conn, job_id)
+        elif args.retry_csv:
+            job_id, resumed = start_job(conn, JOB_NAME, read_failed_tickers(args.retry_csv),
+                                        source=args.retry_csv, resume=False)
+        elif args.plan:
+            plan_ranges = read_plan_ranges(args.plan, 1)
+            job_id, resumed = start_job(conn, JOB_NAME,
+                                        list(dict.fromkeys(r[:2] for r in plan_ranges)),
+                                        source=args.plan, resume=False)
+        else:
+            tickers = obtain_list_of_db_tickers(conn) # [:TICKER_COUNT] # Uncomment `[:TICKER_COUNT]` to cap the number of queried tickers.
+            job_id, resumed = start_job(conn, JOB_NAME, tickers, resume=not args.new_job)
+        tickers = pending_tasks(conn, job_id)
+        if resumed:
+            print(f"Resuming ingest_job {job_id}")
+
+        # Only fetch the dates missing since each
+        # ticker's last stored price.
+        last_dates = {} if args.full else obtain_last_price_dates(conn, 1)
+        if args.plan:
+            # Refetch from each ticker's first planned
+            # date, upserting the stored prices.
+            last_dates = {}
+            for symbol_id, _, start, _ in plan_ranges:
+                first = start - timedelta(days=1)
+                last_dates[symbol_id] = min(first, last_dates.get(symbol_id, first))
     lentickers = len(tickers)
 
-    # Store tickers that failed.
-    failed_tickers = []
+    # Fetch, parse and write concurrently. Downloads are paced
+    # by the AlphaVantage client, parsing runs in worker processes
+    # and a single writer commits several tickers at a time.
+    def fetch_ticker(item):
+        with metrics.timer('ticker_latency_seconds', vendor='alphavantage'):
+            return download_daily_historic_data_alphavantage(item[1], item[2])
 
-    for i, t in enumerate(tickers):
-        print(
-            f"Adding data for {t[1]}: {i+1} out of {lentickers}"
-        )
-        try:
-            av_data = get_daily_historic_data_alphavantage(t[1])
-            insert_daily_data_into_db(1, t[0], av_data)
-        except Exception as err:
-            # Rollback the previous transaction before starting another
-            conn.rollback()
-            failed_tickers.append(t)
-        time.sleep(WAIT_TIME_IN_SECONDS)
+    items = [
+        (t[0], t[1], choose_outputsize(last_dates.get(t[0])), last_dates.get(t[0]))
+        for t in tickers
+    ]
+    def write_job_batch(batch):
+        write_ticker_batch(batch, job_id)
+
+    def over_quota(err):
+        return isinstance(err, QuotaExceededError)
+
+    # Quota and invalid call errors aren't retried.
+    def retryable(err):
+        return not (over_quota(err) or isinstance(err, VendorRequestError))
+
+    # Tickers refused for the daily quota stay
+    # pending for the next run.
+    def record_failures(failed):
+        with db_connection() as conn:
+            fail_tasks(conn, job_id, [
+                (item[0], repr(err)) for item, err in failed if not over_quota(err)
+            ])
+
+    pipeline = IngestPipeline(
+        fetch_ticker,
+        parse_ticker,
+        write_job_batch,
+        fetch_workers=MAX_WORKERS,
+        parse_workers=PARSE_WORKERS,
+        batch_size=WRITE_BATCH_SIZE
+    )
+    print(f"Adding data for {lentickers} tickers")
+    try:
+        with profiled(args.profile):
+            # Failed tickers are retried with exponential
+            # backoff before the run gives up on them.
+            failed = run_with_retries(
+                pipeline.run,
+                items,
+                max_attempts=args.max_attempts,
+                on_failure=record_failures,
+                retryable=retryable
+            )
+        deferred = [item for item, err in failed if over_quota(err)]
+        failed = [(item, err) for item, err in failed if not over_quota(err)]
+
+        # A job that ran out of quota stays running,
+        # so the next run resumes it.
+        if deferred:
+            print(
+                f"\nThe daily AlphaVantage quota was reached; {len(deferred)} tickers "
+                f"are left pending in ingest_job {job_id} for the next run"
+            )
+        else:
+            with db_connection() as conn:
+                status = finish_job(conn, job_id)
+            print(f"\ningest_job {job_id} {status}")
+    finally:
+        write_report(JOB_NAME)
+
+    # Store tickers that failed.
+    failed_tickers = [(item[0], item[1]) for item, err in failed]
 
     # If any tickers failed write the tickers to
     # a csv file and print them to the terminal.
@@ -213,9 +522,10 @@ if __name__ == "__main__":
             "The following tickers generated and error:\n"
             f"{failed_tickers}"
             "\nA csv file with the failed tickers has been "
-            "saved to this directory."
+            "saved to this directory. Run them again with "
+            f"--job {job_id} or --retry-csv failed_inserts/{filename}.csv"
         )
 
-    # Close connection
-    conn.close()
+    # Close connections
+    close_pool()
     print("Successfully added AlphaVantage pricing data to Securities Master database")
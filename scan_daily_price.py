@@ -0,0 +1,460 @@
+# scan_daily_price.py
+
+# Imports
+import argparse
+import csv
+import numpy as np
+import pandas as pd
+
+from datetime import date
+from datetime import datetime as dt
+from pathlib import Path
+from utils.db import close_pool
+from utils.db import db_connection
+from utils.trading_calendar import trading_sessions
+
+# Close-to-close moves larger than this absolute log
+# return (about +65% / -40%) are flagged as jumps, unless
+# they fall on the ex-date of a split or dividend
+JUMP_THRESHOLD = 0.5
+
+# Number of rows fetched from the server per round trip
+CHUNK_SIZE = 100000
+
+# Arrays loaded for every row of daily_price
+PRICE_ARRAYS = {
+    'symbol_id': np.int64,
+    'data_vendor_id': np.int64,
+    'day': np.int64,
+    'open_price': np.float64,
+    'high_price': np.float64,
+    'low_price': np.float64,
+    'close_price': np.float64
+}
+
+
+def load_price_arrays(connection, vendor=None, chunk_size=CHUNK_SIZE):
+    """Load daily_price as NumPy arrays through a named server-side
+    cursor, with each price_date as an integer day number.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    vendor : 'int'
+        The data_vendor id to scan, or None for every vendor
+    chunk_size : 'int'
+        The number of rows fetched per round trip
+
+    Returns
+    -------
+    'dict'
+        The PRICE_ARRAYS keyed by name, sorted by data_vendor_id,
+        symbol_id and day. Missing prices are NaN.
+    """
+
+    query = (
+        "SELECT symbol_id, data_vendor_id, price_date - DATE '1970-01-01', "
+        "open_price::float8, high_price::float8, low_price::float8, close_price::float8 "
+        "FROM daily_price"
+    )
+    params = []
+    if vendor is not None:
+        query += " WHERE data_vendor_id = %s"
+        params.append(vendor)
+
+    chunks = []
+    cur = connection.cursor(name='scan_daily_price')
+    cur.itersize = chunk_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        cur.close()
+        connection.commit()
+
+    table = np.concatenate(chunks) if chunks else np.empty((0, len(PRICE_ARRAYS)))
+    table = table[np.lexsort((table[:, 2], table[:, 0], table[:, 1]))]
+
+    return {
+        name: table[:, i].astype(dtype)
+        for i, (name, dtype) in enumerate(PRICE_ARRAYS.items())
+    }
+
+
+def load_ex_dates(connection):
+    """Load the ex-date of every corporate action as integer day
+    numbers. Unadjusted prices jump on these days, e.g. by half
+    on the ex-date of a 2:1 split.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+
+    Returns
+    -------
+    'tuple'
+        The symbol ids and day numbers of the ex-dates, empty
+        if the corporate_action table doesn't exist
+    """
+
+    cur = connection.cursor()
+    cur.execute("SELECT to_regclass('corporate_action')")
+    rows = []
+    if cur.fetchone()[0] is not None:
+        cur.execute(
+            "SELECT DISTINCT symbol_id, ex_date - DATE '1970-01-01' FROM corporate_action"
+        )
+        rows = cur.fetchall()
+    connection.commit()
+    cur.close()
+
+    table = np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+    return table[:, 0], table[:, 1]
+
+
+def latest_vendors(prices, symbol_ids):
+    """Find the vendor of each symbol's latest stored price, the
+    vendor that currently loads the symbol.
+
+    Parameters
+    ----------
+    prices : 'dict'
+        The arrays from load_price_arrays
+    symbol_ids : 'numpy.ndarray'
+        The symbol ids to look up, each with stored prices
+
+    Returns
+    -------
+    'numpy.ndarray'
+        The data_vendor id of every symbol id
+    """
+
+    order = np.lexsort((prices['day'], prices['symbol_id']))
+    symbols = prices['symbol_id'][order]
+    last = np.append(np.flatnonzero(np.diff(symbols)), len(symbols) - 1)
+    index = np.searchsorted(symbols[last], symbol_ids)
+
+    return prices['data_vendor_id'][order][last][index]
+
+
+def find_missing_sessions(symbol_ids, days, sessions):
+    """Find the trading sessions without a price within each
+    symbol's coverage window, from its first to its last stored
+    price across every vendor.
+
+    Parameters
+    ----------
+    symbol_ids : 'numpy.ndarray'
+        The symbol id of every price
+    days : 'numpy.ndarray'
+        The integer day number of every price
+    sessions : 'numpy.ndarray'
+        The sorted integer day numbers of the trading sessions
+
+    Returns
+    -------
+    'tuple'
+        The symbol ids and session indices of the missing
+        prices, sorted by symbol and session
+    """
+
+    if not len(days):
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+
+    # A price is identified by (symbol, day) across vendors.
+    span = np.int64(days.max() + 1)
+    stored = np.unique(symbol_ids * span + days)
+    symbols, first = np.unique(stored // span, return_index=True)
+    last = np.append(first[1:], len(stored)) - 1
+
+    # Expand every coverage window into its sessions.
+    lo = np.searchsorted(sessions, stored[first] % span)
+    hi = np.searchsorted(sessions, stored[last] % span, side='right')
+    counts = hi - lo
+    expected_symbols = np.repeat(symbols, counts)
+    session_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    session_index += np.repeat(lo, counts)
+    expected = expected_symbols * span + sessions[session_index]
+
+    missing = ~np.isin(expected, stored, assume_unique=True)
+
+    return expected_symbols[missing], session_index[missing]
+
+
+def find_anomalies(prices, sessions, jump_threshold=JUMP_THRESHOLD, ex_dates=None):
+    """Flag prices that are zero or negative, have a high below
+    the low, or close more than a jump away from the previous
+    close of the same symbol and vendor. Jumps on a corporate
+    action's ex-date are expected in unadjusted prices and
+    aren't flagged.
+
+    Parameters
+    ----------
+    prices : 'dict'
+        The arrays from load_price_arrays
+    sessions : 'numpy.ndarray'
+        The sorted integer day numbers of the trading sessions
+    jump_threshold : 'float'
+        The largest absolute log return that isn't a jump
+    ex_dates : 'tuple'
+        The symbol ids and day numbers from load_ex_dates,
+        or None
+
+    Returns
+    -------
+    'tuple'
+        The symbol ids, data_vendor ids and session indices
+        of the anomalous prices, and the reason for each
+    """
+
+    ohlc = np.column_stack([
+        prices['open_price'],
+        prices['high_price'],
+        prices['low_price'],
+        prices['close_price']
+    ])
+    non_positive = (ohlc <= 0).any(axis=1)
+    inverted = prices['high_price'] < prices['low_price']
+
+    # Log returns between consecutive rows of the same
+    # symbol and vendor; the arrays are already sorted.
+    close = np.where(prices['close_price'] > 0, prices['close_price'], np.nan)
+    log_close = np.log(close)
+    same_series = np.zeros(len(close), dtype=bool)
+    same_series[1:] = (
+        (prices['symbol_id'][1:] == prices['symbol_id'][:-1])
+        & (prices['data_vendor_id'][1:] == prices['data_vendor_id'][:-1])
+    )
+    log_return = np.full(len(close), np.nan)
+    log_return[1:] = log_close[1:] - log_close[:-1]
+    with np.errstate(invalid='ignore'):
+        jump = same_series & (np.abs(log_return) > jump_threshold)
+
+    # A price is identified by (symbol, day) as in
+    # find_missing_sessions.
+    if ex_dates is not None and len(ex_dates[0]) and jump.any():
+        span = np.int64(max(prices['day'].max(), ex_dates[1].max()) + 1)
+        jump &= ~np.isin(
+            prices['symbol_id'] * span + prices['day'],
+            ex_dates[0] * span + ex_dates[1]
+        )
+
+    reasons = np.full(len(close), '', dtype=object)
+    reasons[jump] = 'jump'
+    reasons[inverted] = 'high_below_low'
+    reasons[non_positive] = 'non_positive'
+    flagged = reasons != ''
+
+    # Anomalies on non-session days map to the next session.
+    session_index = np.searchsorted(sessions, prices['day'][flagged])
+
+    return (
+        prices['symbol_id'][flagged],
+        prices['data_vendor_id'][flagged],
+        session_index,
+        reasons[flagged]
+    )
+
+
+def collapse_ranges(symbol_ids, vendor_ids, session_index, sessions, reasons):
+    """Collapse sessions into runs of consecutive sessions per
+    symbol, vendor and reason.
+
+    Parameters
+    ----------
+    symbol_ids : 'numpy.ndarray'
+        The symbol id of every session to refetch
+    vendor_ids : 'numpy.ndarray'
+        The data_vendor id every session is refetched from
+    session_index : 'numpy.ndarray'
+        The index into sessions of every session to refetch
+    sessions : 'numpy.ndarray'
+        The sorted integer day numbers of the trading sessions
+    reasons : 'numpy.ndarray'
+        The reason every session needs to be refetched
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The symbol_id, data_vendor_id, start_date, end_date
+        and reason of every run
+    """
+
+    runs_df = pd.DataFrame({
+        'symbol_id': symbol_ids,
+        'data_vendor_id': vendor_ids,
+        'session': np.minimum(session_index, len(sessions) - 1),
+        'reason': reasons
+    }).drop_duplicates().sort_values(['reason', 'data_vendor_id', 'symbol_id', 'session'])
+
+    # A new run starts when the symbol, vendor or reason
+    # changes or a session is skipped.
+    starts = (
+        (runs_df['symbol_id'].diff() != 0)
+        | (runs_df['data_vendor_id'].diff() != 0)
+        | (runs_df['reason'] != runs_df['reason'].shift())
+        | (runs_df['session'].diff() != 1)
+    ).cumsum()
+    runs_df = runs_df.groupby(starts).agg(
+        symbol_id=('symbol_id', 'first'),
+        data_vendor_id=('data_vendor_id', 'first'),
+        start=('session', 'first'),
+        end=('session', 'last'),
+        reason=('reason', 'first')
+    )
+
+    day_zero = np.datetime64('1970-01-01', 'D')
+    return pd.DataFrame({
+        'symbol_id': runs_df['symbol_id'].to_numpy(),
+        'data_vendor_id': runs_df['data_vendor_id'].to_numpy(),
+        'start_date': (day_zero + sessions[runs_df['start'].to_numpy()]).astype(object),
+        'end_date': (day_zero + sessions[runs_df['end'].to_numpy()]).astype(object),
+        'reason': runs_df['reason'].to_numpy()
+    })
+
+
+def scan_daily_price(connection, vendor=None, jump_threshold=JUMP_THRESHOLD):
+    """Scan daily_price for missing sessions and anomalous
+    prices and build a refetch plan.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    vendor : 'int'
+        The data_vendor id to scan, or None for every vendor
+    jump_threshold : 'float'
+        The largest absolute log return that isn't a jump
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The refetch plan with a row per run of sessions to
+        refetch: symbol_id, data_vendor_id, ticker,
+        start_date, end_date and reason ('missing',
+        'non_positive', 'high_below_low' or 'jump').
+        Missing sessions are refetched from the vendor of
+        the symbol's latest price.
+    """
+
+    plan_columns = ['symbol_id', 'data_vendor_id', 'ticker', 'start_date', 'end_date', 'reason']
+    prices = load_price_arrays(connection, vendor)
+    if not len(prices['day']):
+        return pd.DataFrame(columns=plan_columns)
+
+    day_zero = np.datetime64('1970-01-01', 'D')
+    first_day = (day_zero + prices['day'].min()).astype(object)
+    last_day = (day_zero + prices['day'].max()).astype(object)
+    sessions = np.array(
+        trading_sessions(connection, first_day, last_day),
+        dtype='datetime64[D]'
+    ).astype(np.int64)
+
+    missing_symbols, missing_index = find_missing_sessions(
+        prices['symbol_id'],
+        prices['day'],
+        sessions
+    )
+    anomaly_symbols, anomaly_vendors, anomaly_index, anomaly_reasons = find_anomalies(
+        prices,
+        sessions,
+        jump_threshold,
+        load_ex_dates(connection)
+    )
+
+    plan_df = collapse_ranges(
+        np.concatenate([missing_symbols, anomaly_symbols]),
+        np.concatenate([latest_vendors(prices, missing_symbols), anomaly_vendors]),
+        np.concatenate([missing_index, anomaly_index]),
+        sessions,
+        np.concatenate([np.full(len(missing_symbols), 'missing', dtype=object), anomaly_reasons])
+    )
+
+    # Attach the tickers the loaders request.
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT id, ticker FROM symbol WHERE id = ANY(%s)",
+        (plan_df['symbol_id'].unique().tolist(),)
+    )
+    tickers = dict(cur.fetchall())
+    connection.commit()
+    cur.close()
+    plan_df['ticker'] = plan_df['symbol_id'].map(tickers)
+
+    return plan_df[plan_columns]
+
+
+def read_plan_ranges(path, data_vendor_id):
+    """Read the ranges of a refetch plan that are refetched from
+    a data vendor.
+
+    Parameters
+    ----------
+    path : 'str'
+        The path of the refetch plan csv
+    data_vendor_id : 'int'
+        The id of the data vendor from the
+        data_vendor table
+
+    Returns
+    -------
+    'list'
+        The (id, ticker, start_date, end_date) tuples of the
+        vendor's ranges, without duplicates
+    """
+
+    with open(path, newline='') as csvfile:
+        ranges = [
+            (
+                int(row['symbol_id']),
+                row['ticker'],
+                date.fromisoformat(row['start_date']),
+                date.fromisoformat(row['end_date'])
+            )
+            for row in csv.DictReader(csvfile)
+            if int(row['data_vendor_id']) == data_vendor_id
+        ]
+
+    return list(dict.fromkeys(ranges))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scan daily_price for missing sessions and anomalous prices."
+    )
+    parser.add_argument(
+        '--vendor',
+        type=int,
+        default=None,
+        help="data_vendor id to scan, defaults to every vendor"
+    )
+    parser.add_argument(
+        '--jump-threshold',
+        type=float,
+        default=JUMP_THRESHOLD,
+        help="Largest absolute close-to-close log return that isn't flagged"
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help="Path of the refetch plan csv"
+    )
+    args = parser.parse_args()
+
+    with db_connection() as conn:
+        plan_df = scan_daily_price(conn, args.vendor, args.jump_threshold)
+    close_pool()
+
+    output = Path(args.output or f"failed_inserts/refetch_plan_{dt.today().strftime('%Y%m%d')}.csv")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    plan_df.to_csv(output, index=False)
+
+    print(plan_df['reason'].value_counts().to_string() if len(plan_df) else "No gaps or anomalies found.")
+    print(f"The refetch plan was saved to {output}.")
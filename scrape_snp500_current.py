@@ -7,12 +7,18 @@ from snp500_insert import insert_snp500_symbols
 
 
 # scrape and parse snp500 current constituents table
-def obtain_parse_wiki_snp500_current():
+def obtain_parse_wiki_snp500_current(tables=None):
     """Download and parse the Wikipedia list of current
     SNP500 constituents using pandas.
     
     Returns a list of values to add to the Securities
     Master DB.
+
+    Parameters
+    ----------
+    tables : 'list'
+        The DataFrames already parsed from the Wikipedia
+        page, or None to download the page
     
     Returns
     -------
@@ -26,15 +32,18 @@ def obtain_parse_wiki_snp500_current():
     
     # Use pandas to downlaod list of snp500 
     # companies into a dataframe
-    snp500_df = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
+    snp500_df = tables
+    if snp500_df is None:
+        snp500_df = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
     snp500_current_df = snp500_df[0].copy()
     snp500_current_df.drop(columns=['SEC filings',
                                     'GICS Sub-Industry', 
                                     'Headquarters Location', 
                                     'CIK', 
                                     'Founded',
-                                    'Date first added'], 
-                            axis=1,
+                                    'Date first added',
+                                    'Date added'], 
+                            errors='ignore',
                             inplace=True)
 
     # Add instrument, currency and datetime to DataFrame.
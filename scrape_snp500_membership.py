@@ -0,0 +1,99 @@
+# scrape_snp500_membership.py
+
+# Imports
+import pandas as pd
+from snp500_insert import SNP500_INDEX
+from snp500_insert import replace_index_membership
+
+# Wikipedia list of S&P 500 constituents and changes
+SNP500_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+
+
+# parse snp500 membership intervals
+def parse_snp500_membership(current_df, changes_df):
+    """Rebuild the membership interval of every S&P 500
+    constituent by replaying the Wikipedia change history
+    backwards from the current constituents.
+
+    Parameters
+    ----------
+    current_df : 'pandas.DataFrame'
+        The Wikipedia table of current constituents
+    changes_df : 'pandas.DataFrame'
+        The Wikipedia table of selected changes, with
+        (Date, Added, Removed, Reason) column groups
+
+    Returns
+    -------
+    'list'
+        A list of tuples of ticker, start_date and end_date. An
+        interval excludes its end_date; a start_date of None
+        predates the change history and an end_date of None
+        is still open.
+    """
+
+    # The first-added column was renamed on Wikipedia.
+    added_column = 'Date added' if 'Date added' in current_df.columns else 'Date first added'
+    first_added = dict(zip(
+        current_df['Symbol'],
+        pd.to_datetime(current_df[added_column].astype(str).str[:10], errors='coerce').dt.date
+    ))
+
+    changes = pd.DataFrame({
+        'date': pd.to_datetime(changes_df[('Date', 'Date')], errors='coerce').dt.date,
+        'added': changes_df[('Added', 'Ticker')],
+        'removed': changes_df[('Removed', 'Ticker')]
+    }).dropna(subset=['date'])
+    changes = changes.sort_values('date', ascending=False, kind='stable')
+
+    # Walking back in time, a removal opens an interval
+    # that ends on its date and an addition closes it.
+    open_ends = {ticker: None for ticker in current_df['Symbol']}
+    intervals = []
+    for change_date, added, removed in changes.itertuples(index=False):
+        if isinstance(added, str) and added in open_ends:
+            intervals.append((added, change_date, open_ends.pop(added)))
+        if isinstance(removed, str) and removed not in open_ends:
+            open_ends[removed] = change_date
+
+    # Intervals still open started before the change history,
+    # unless Wikipedia lists when the ticker was first added.
+    for ticker, end_date in open_ends.items():
+        start_date = first_added.get(ticker)
+        if pd.isna(start_date) or (end_date is not None and start_date >= end_date):
+            start_date = None
+        intervals.append((ticker, start_date, end_date))
+
+    return intervals
+
+
+# scrape snp500 membership intervals
+def obtain_parse_wiki_snp500_membership(tables=None):
+    """Download the Wikipedia list of S&P 500 constituents
+    and changes and parse the membership intervals.
+
+    Parameters
+    ----------
+    tables : 'list'
+        The DataFrames already parsed from the Wikipedia
+        page, or None to download the page
+
+    Returns
+    -------
+    'list'
+        A list of tuples of ticker, start_date and end_date
+    """
+
+    snp500_df = tables
+    if snp500_df is None:
+        snp500_df = pd.read_html(SNP500_URL)
+
+    return parse_snp500_membership(snp500_df[0], snp500_df[1])
+
+
+if __name__ == "__main__":
+    intervals = obtain_parse_wiki_snp500_membership()
+    num_intervals, missing = replace_index_membership(intervals, SNP500_INDEX)
+    print(f"{num_intervals} {SNP500_INDEX} membership intervals were successfully added.")
+    if missing:
+        print(f"{len(missing)} tickers aren't in the symbol table: {', '.join(missing)}")
@@ -7,12 +7,18 @@ from snp500_insert import insert_snp500_symbols
 
 
 # scrape and parse snp500 past constituents table
-def obtain_parse_wiki_snp500_past():
+def obtain_parse_wiki_snp500_past(tables=None):
     """Download and parse the Wikipedia list of past
     SNP500 constituents using pandas.
     
     Returns a list of values to add to the Securities
     Master DB.
+
+    Parameters
+    ----------
+    tables : 'list'
+        The DataFrames already parsed from the Wikipedia
+        page, or None to download the page
     
     Returns
     -------
@@ -26,10 +32,11 @@ def obtain_parse_wiki_snp500_past():
     
     # Use pandas to downlaod list of snp500 
     # companies into a dataframe
-    snp500_df = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
+    snp500_df = tables
+    if snp500_df is None:
+        snp500_df = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
     snp500_past_df = snp500_df[1].copy()
     snp500_past_df.drop(columns=['Reason', 'Date', 'Added'], level=0,
-                        axis=1,
                         inplace=True)
     snp500_past_df.columns = snp500_past_df.columns.map(''.join).str.strip('')
     snp500_past_df=snp500_past_df.dropna()                    
@@ -1,9 +1,12 @@
 # snp500_insert.py
 
 # imports
-import os
-import psycopg2
-from dotenv import load_dotenv
+from datetime import datetime as dt
+from psycopg2.extras import execute_values
+from utils.db import db_connection
+
+# Name of the S&P 500 in the index_membership table
+SNP500_INDEX = 'S&P 500'
 
 
 # Insert symbols into symbols table
@@ -17,34 +20,209 @@ def insert_snp500_symbols(symbols):
         sector, currency, current_constituent, created, and last_updated
     """
 
-    # connect to securities master db
-    load_dotenv()
-    db_host = os.getenv('UW_SEC_MASTER_HOST')
-    db_user = os.getenv('UW_SEC_MASTER_USER')
-    db_pass = os.getenv('UW_SEC_MASTER_PASSWORD')
-    db_name = 'securities_master'
-    db_port = '5432'
-
-    conn = psycopg2.connect(
-        database=db_name,
-        user=db_user,
-        password=db_pass,
-        host=db_host,
-        port=db_port
-    )
+    # Borrow a connection to the securities master db
+    # from the shared pool.
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        # Create insert string
+        fields = "(ticker, instrument, name, sector, currency, current_constituent, created_date, last_updated)"
+        records_list_template = ','.join(['%s'] * len(symbols))
+        sql_insert = "INSERT INTO symbol {} VALUES {}".format(fields, records_list_template)
+
+        # Insert records into securities master db
+        cur.execute(sql_insert, symbols)
+        conn.commit()
+
+        cur.close()
+
+
+# Replace the membership intervals of an index
+def replace_index_membership(intervals, index_name=SNP500_INDEX):
+    """Replace the index_membership intervals of an index in a
+    single transaction. Tickers are resolved to their ids in the
+    symbol table, and intervals of unknown tickers are skipped.
+
+    Parameters
+    ----------
+    intervals : 'list'
+        The list of tuples comprised of ticker, start_date
+        and end_date
+    index_name : 'str'
+        The name of the index, e.g. 'S&P 500'
+
+    Returns
+    -------
+    'tuple'
+        The number of intervals stored and the sorted
+        list of tickers missing from the symbol table
+    """
+
+    now = dt.utcnow()
 
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    # Create insert string
-    fields = "(ticker, instrument, name, sector, currency, current_constituent, created_date, last_updated)"
-    records_list_template = ','.join(['%s'] * len(symbols))
-    sql_insert = "INSERT INTO symbol {} VALUES {}".format(fields, records_list_template)
+        # Resolve every ticker in one query, keeping the
+        # oldest symbol of a ticker listed more than once.
+        cur.execute(
+            "SELECT DISTINCT ON (ticker) ticker, id FROM symbol "
+            "WHERE ticker = ANY(%s) ORDER BY ticker, id",
+            (sorted({interval[0] for interval in intervals}),)
+        )
+        symbol_ids = dict(cur.fetchall())
 
-    # Insert records into securities master db
-    cur.execute(sql_insert, symbols)
-    conn.commit()
+        records = [
+            (symbol_ids[ticker], index_name, start_date, end_date, now, now)
+            for ticker, start_date, end_date in intervals
+            if ticker in symbol_ids
+        ]
+        missing = sorted({ticker for ticker, _, _ in intervals if ticker not in symbol_ids})
 
-    # Close db connection
+        # Swap the intervals in one transaction.
+        cur.execute("DELETE FROM index_membership WHERE index_name = %s", (index_name,))
+        execute_values(
+            cur,
+            "INSERT INTO index_membership (symbol_id, index_name, start_date, end_date, "
+            "created_date, last_updated) VALUES %s",
+            records,
+            page_size=1000
+        )
+        conn.commit()
+
+        cur.close()
+
+    return len(records), missing
+
+
+# Columns of a symbol record, in the order of the scraped tuples
+SYMBOL_FIELDS = (
+    'ticker', 'instrument', 'name', 'sector', 'currency',
+    'current_constituent', 'created_date', 'last_updated'
+)
+
+
+# Obtain the existing symbols
+def obtain_symbols(connection):
+    """Obtain every row of the symbol table.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+
+    Returns
+    -------
+    'list'
+        The list of tuples of the id and SYMBOL_FIELDS
+        of every symbol, ordered by id
+    """
+
+    cur = connection.cursor()
+    cur.execute("SELECT id, {} FROM symbol ORDER BY id".format(", ".join(SYMBOL_FIELDS)))
+    symbols = cur.fetchall()
+    connection.commit()
+    cur.close()
+
+    return symbols
+
+
+# Diff scraped symbols against the symbol table
+def diff_symbols(existing, symbols):
+    """Compare scraped S&P 500 symbols with the rows of the
+    symbol table in memory.
+
+    A ticker listed more than once is matched to its oldest
+    row so symbol ids stay stable. A ticker scraped both as a
+    current and a past constituent keeps its first entry, so
+    pass the current constituents first.
+
+    Parameters
+    ----------
+    existing : 'list'
+        The rows of the symbol table from obtain_symbols
+    symbols : 'list'
+        The list of scraped values comprised of ticker, instrument,
+        name, sector, currency, current_constituent, created, and
+        last_updated
+
+    Returns
+    -------
+    'dict'
+        The records to 'insert', 'update' and 'deactivate', each
+        a tuple of the id (None for new symbols) and SYMBOL_FIELDS
+    """
+
+    rows = {}
+    for row in existing:
+        rows.setdefault(row[1], row)
+
+    scraped = {}
+    for symbol in symbols:
+        scraped.setdefault(symbol[0], symbol)
+
+    changes = {'insert': [], 'update': [], 'deactivate': []}
+    for ticker, symbol in scraped.items():
+        _, instrument, name, sector, currency, current, created, last_updated = symbol
+        current = str(current).lower() == 'true'
+        # Empty cells are scraped as NaN.
+        name = name if isinstance(name, str) else None
+        sector = sector if isinstance(sector, str) else None
+        row = rows.get(ticker)
+        if row is None:
+            changes['insert'].append(
+                (None, ticker, instrument, name, sector, currency, current, created, last_updated)
+            )
+            continue
+
+        # Past constituents are scraped without a sector,
+        # so keep the sector already stored.
+        if sector == 'missing' and row[4] is not None:
+            sector = row[4]
+        if (name, sector, current) != (row[3], row[4], row[6]):
+            changes['update'].append(
+                (row[0], ticker, row[2], name, sector, row[5], current, row[7], last_updated)
+            )
+
+    # Constituents no longer listed at all are deactivated.
+    for ticker, row in rows.items():
+        if ticker not in scraped and row[6]:
+            changes['deactivate'].append(row[:6] + (False, row[7], dt.utcnow()))
+
+    return changes
+
+
+# Apply a symbol diff
+def apply_symbol_changes(connection, changes):
+    """Apply the inserts, updates and deactivations of a symbol
+    diff with a single bulk upsert on the symbol id. New symbols
+    take the next id of the symbol sequence.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    changes : 'dict'
+        The records to 'insert', 'update' and 'deactivate'
+        from diff_symbols
+    """
+
+    records = changes['insert'] + changes['update'] + changes['deactivate']
+    if not records:
+        return
+
+    cur = connection.cursor()
+    execute_values(
+        cur,
+        "INSERT INTO symbol (id, {}) VALUES %s "
+        "ON CONFLICT (id) DO UPDATE SET "
+        "name = EXCLUDED.name, sector = EXCLUDED.sector, "
+        "current_constituent = EXCLUDED.current_constituent, "
+        "last_updated = EXCLUDED.last_updated".format(", ".join(SYMBOL_FIELDS)),
+        records,
+        template="(COALESCE(%s, nextval(pg_get_serial_sequence('symbol', 'id'))), "
+                 "%s, %s, %s, %s, %s, %s, %s, %s)",
+        page_size=len(records)
+    )
+    connection.commit()
     cur.close()
-    conn.close()
-    
\ No newline at end of file
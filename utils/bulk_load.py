@@ -0,0 +1,354 @@
+# bulk_load.py
+"""Helper functions to bulk load price data.
+This contains helper functions for streaming rows into the
+daily_price table with PostgreSQL COPY FROM STDIN.
+"""
+import csv
+import io
+from time import perf_counter
+
+from utils.consolidation import adjust_sql
+from utils.consolidation import consolidate_sql
+from utils.consolidation import vendor_precedence
+from utils.metrics import metrics
+
+
+# Column order of the rows handed to the bulk loader.
+DAILY_PRICE_FIELDS = (
+    'data_vendor_id',
+    'symbol_id',
+    'price_date',
+    'created_date',
+    'last_updated',
+    'open_price',
+    'high_price',
+    'low_price',
+    'close_price',
+    'volume'
+)
+
+
+def rows_to_buffer(rows):
+    """Write rows of price data to an in-memory CSV buffer
+    that can be streamed to PostgreSQL with COPY.
+
+    Parameters
+    ----------
+    rows : 'iterable'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS
+
+    Returns
+    -------
+    'tuple'
+        The rewound io.StringIO buffer and the number of
+        rows written to it
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    # None is written as an unquoted empty string,
+    # which COPY reads as NULL in CSV format.
+    row_count = 0
+    for row in rows:
+        writer.writerow(row)
+        row_count += 1
+
+    buffer.seek(0)
+
+    return buffer, row_count
+
+
+# Natural key of a row in the daily_price table.
+DAILY_PRICE_KEY = ('data_vendor_id', 'symbol_id', 'price_date')
+
+
+def daily_price_upsert_sql(source, target='daily_price', stamp=True):
+    """Build the INSERT ... ON CONFLICT statement that moves rows
+    from a staging table into daily_price.
+
+    Rows already stored under the same natural key have their
+    prices and last_updated overwritten, while created_date keeps
+    its original value. Duplicate keys within the staging table
+    are collapsed to the most recently updated row.
+
+    Parameters
+    ----------
+    source : 'str'
+        The name of the table holding the staged rows
+    target : 'str'
+        The name of the table the rows are merged into
+    stamp : 'bool'
+        If True, last_updated is set to the server's now(), so
+        readers can compare it with the server clock whatever
+        the loader's clock and timezone; otherwise the staged
+        value is kept
+
+    Returns
+    -------
+    'str'
+        The upsert statement
+    """
+
+    fields = ", ".join(DAILY_PRICE_FIELDS)
+    values = ", ".join(
+        "now()" if stamp and field == 'last_updated' else field
+        for field in DAILY_PRICE_FIELDS
+    )
+    key = ", ".join(DAILY_PRICE_KEY)
+    updates = ", ".join(
+        "{0} = EXCLUDED.{0}".format(field)
+        for field in DAILY_PRICE_FIELDS
+        if field not in DAILY_PRICE_KEY and field != 'created_date'
+    )
+
+    return (
+        "INSERT INTO {4} ({0}) "
+        "SELECT DISTINCT ON ({1}) {5} FROM {2} "
+        "ORDER BY {1}, last_updated DESC "
+        "ON CONFLICT ({1}) DO UPDATE SET {3}"
+    ).format(fields, key, source, updates, target, values)
+
+
+def coverage_update_sql(source):
+    """Build the statement that folds staged rows into the
+    symbol_coverage table. It must run in the same transaction
+    as, and before, the statement that loads the staged rows
+    into daily_price.
+
+    The first and last price_date of every (symbol, vendor) staged
+    are widened to include the new rows, and row_count grows by the
+    number of staged keys not yet in daily_price, so rows an upsert
+    updates in place are not counted again.
+
+    Parameters
+    ----------
+    source : 'str'
+        The name of the table holding the staged rows
+
+    Returns
+    -------
+    'str'
+        The coverage update statement
+    """
+
+    return (
+        "INSERT INTO symbol_coverage (symbol_id, data_vendor_id, first_price_date, "
+        "last_price_date, row_count, last_updated) "
+        "SELECT s.symbol_id, s.data_vendor_id, MIN(s.price_date), MAX(s.price_date), "
+        "COUNT(*) FILTER (WHERE NOT EXISTS ("
+        "SELECT 1 FROM daily_price AS dp WHERE dp.data_vendor_id = s.data_vendor_id "
+        "AND dp.symbol_id = s.symbol_id AND dp.price_date = s.price_date)), now() "
+        "FROM (SELECT DISTINCT data_vendor_id, symbol_id, price_date FROM {}) AS s "
+        "GROUP BY s.symbol_id, s.data_vendor_id "
+        "ON CONFLICT (symbol_id, data_vendor_id) DO UPDATE SET "
+        "first_price_date = LEAST(symbol_coverage.first_price_date, EXCLUDED.first_price_date), "
+        "last_price_date = GREATEST(symbol_coverage.last_price_date, EXCLUDED.last_price_date), "
+        "row_count = symbol_coverage.row_count + EXCLUDED.row_count, "
+        "last_updated = EXCLUDED.last_updated"
+    ).format(source)
+
+
+def copy_daily_prices(connection, rows, staging=False, upsert=False, update_coverage=False,
+                      consolidate=False, commit=True, verbose=False):
+    """Stream rows of price data into the daily_price table
+    using COPY FROM STDIN.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    rows : 'iterable'
+        The tuples of price data ordered as DAILY_PRICE_FIELDS
+    staging : 'bool'
+        If True, COPY the rows into a temporary staging table
+        first and move them into daily_price with a single
+        INSERT ... SELECT
+    upsert : 'bool'
+        If True, stage the rows and merge them into daily_price
+        on its natural key, updating rows that already exist,
+        so reruns and retries don't duplicate prices
+    update_coverage : 'bool'
+        If True, stage the rows and update symbol_coverage
+        in the same transaction that loads them
+    consolidate : 'bool'
+        If True, stage the rows and re-resolve the
+        consolidated_price and adjusted_price rows of the
+        keys they touch in the same transaction that loads
+        them; adjusted_price is skipped if it doesn't exist
+    commit : 'bool'
+        If True, commit the transaction once the rows are loaded
+    verbose : 'bool'
+        If True, print the number of rows loaded and the rows/sec
+
+    Returns
+    -------
+    'int'
+        The number of rows loaded into daily_price
+    """
+
+    start = perf_counter()
+    with metrics.timer(stage='buffer'):
+        buffer, row_count = rows_to_buffer(rows)
+
+    return copy_buffer(connection, buffer, row_count, start, staging, upsert, update_coverage,
+                       consolidate, commit, verbose)
+
+
+def copy_daily_price_frame(connection, price_df, staging=False, upsert=False,
+                           update_coverage=False, consolidate=False, commit=True, verbose=False):
+    """Stream a DataFrame of price data into the daily_price
+    table using COPY FROM STDIN. The columns are written to
+    the CSV buffer in bulk, without building a tuple per row.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    price_df : 'pandas.DataFrame'
+        The price data with the DAILY_PRICE_FIELDS columns
+    staging : 'bool'
+        If True, COPY the rows into a temporary staging table
+        first and move them into daily_price with a single
+        INSERT ... SELECT
+    upsert : 'bool'
+        If True, stage the rows and merge them into daily_price
+        on its natural key
+    update_coverage : 'bool'
+        If True, stage the rows and update symbol_coverage
+        in the same transaction that loads them
+    consolidate : 'bool'
+        If True, stage the rows and re-resolve the
+        consolidated_price and adjusted_price rows of the
+        keys they touch in the same transaction that loads
+        them; adjusted_price is skipped if it doesn't exist
+    commit : 'bool'
+        If True, commit the transaction once the rows are loaded
+    verbose : 'bool'
+        If True, print the number of rows loaded and the rows/sec
+
+    Returns
+    -------
+    'int'
+        The number of rows loaded into daily_price
+    """
+
+    start = perf_counter()
+    buffer = io.StringIO()
+    with metrics.timer(stage='buffer'):
+        price_df.to_csv(
+            buffer,
+            columns=list(DAILY_PRICE_FIELDS),
+            header=False,
+            index=False
+        )
+    buffer.seek(0)
+
+    return copy_buffer(connection, buffer, len(price_df), start, staging, upsert, update_coverage,
+                       consolidate, commit, verbose)
+
+
+def copy_buffer(connection, buffer, row_count, start, staging, upsert, update_coverage,
+                consolidate, commit, verbose):
+    """COPY a CSV buffer of price data into the daily_price
+    table, through a staging table when staging, upsert,
+    update_coverage or consolidate is set. Staged rows are
+    stamped with the server's now() as their last_updated.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    buffer : 'io.StringIO'
+        The rewound CSV buffer of rows ordered as DAILY_PRICE_FIELDS
+    row_count : 'int'
+        The number of rows in the buffer
+    start : 'float'
+        The perf_counter value the load started at
+    staging : 'bool'
+        If True, load through a temporary staging table
+    upsert : 'bool'
+        If True, merge the staged rows on the natural key
+    update_coverage : 'bool'
+        If True, update symbol_coverage in the same transaction
+    consolidate : 'bool'
+        If True, update consolidated_price and, if it exists,
+        adjusted_price in the same transaction
+    commit : 'bool'
+        If True, commit the transaction once the rows are loaded
+    verbose : 'bool'
+        If True, print the number of rows loaded and the rows/sec
+
+    Returns
+    -------
+    'int'
+        The number of rows loaded into daily_price
+    """
+
+    # Nothing to load.
+    if not row_count:
+        return 0
+
+    fields = ", ".join(DAILY_PRICE_FIELDS)
+
+    cur = connection.cursor()
+    if staging or upsert or update_coverage or consolidate:
+        # Stage the rows in a temporary table with the same
+        # column types as daily_price. A previous uncommitted
+        # load in this transaction may have left one behind.
+        cur.execute("DROP TABLE IF EXISTS daily_price_staging")
+        cur.execute(
+            "CREATE TEMP TABLE daily_price_staging ON COMMIT DROP AS "
+            "SELECT {} FROM daily_price WITH NO DATA".format(fields)
+        )
+        with metrics.timer(stage='copy'):
+            cur.copy_expert(
+                "COPY daily_price_staging ({}) FROM STDIN WITH (FORMAT csv)".format(fields),
+                buffer
+            )
+        if update_coverage:
+            with metrics.timer(stage='coverage'):
+                cur.execute(coverage_update_sql('daily_price_staging'))
+        with metrics.timer(stage='insert'):
+            if upsert:
+                cur.execute(daily_price_upsert_sql('daily_price_staging'))
+            else:
+                cur.execute(
+                    "INSERT INTO daily_price ({0}) SELECT {1} FROM daily_price_staging".format(
+                        fields,
+                        ", ".join(
+                            "now()" if field == 'last_updated' else field
+                            for field in DAILY_PRICE_FIELDS
+                        )
+                    )
+                )
+        if consolidate:
+            with metrics.timer(stage='consolidate'):
+                cur.execute(consolidate_sql('daily_price_staging'), (vendor_precedence(),))
+                # adjusted_price is only added with the corporate
+                # action tables.
+                cur.execute("SELECT to_regclass('adjusted_price')")
+                if cur.fetchone()[0] is not None:
+                    cur.execute(adjust_sql('daily_price_staging'))
+    else:
+        with metrics.timer(stage='copy'):
+            cur.copy_expert(
+                "COPY daily_price ({}) FROM STDIN WITH (FORMAT csv)".format(fields),
+                buffer
+            )
+    cur.close()
+    metrics.increment('rows_loaded', row_count)
+
+    if commit:
+        with metrics.timer(stage='commit'):
+            connection.commit()
+
+    if verbose:
+        elapsed = perf_counter() - start
+        rate = row_count / elapsed if elapsed > 0 else float(row_count)
+        print(
+            f"Loaded {row_count} rows into daily_price in "
+            f"{elapsed:.2f}s ({rate:,.0f} rows/sec)"
+        )
+
+    return row_count
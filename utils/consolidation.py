@@ -0,0 +1,161 @@
+# consolidation.py
+"""Helper functions to consolidate prices across data vendors.
+This contains the vendor precedence policy and the statements
+that keep the consolidated_price table, one row per symbol and
+date, and the adjusted_price table in line with daily_price.
+"""
+import os
+
+
+# Data vendor ids in order of precedence, highest first.
+# Vendors left out of the policy are never consolidated.
+DEFAULT_VENDOR_PRECEDENCE = (1, 2)
+
+# Columns copied from the chosen daily_price row
+CONSOLIDATED_FIELDS = (
+    'data_vendor_id',
+    'open_price',
+    'high_price',
+    'low_price',
+    'close_price',
+    'volume'
+)
+
+
+def vendor_precedence():
+    """Read the vendor precedence policy from the VENDOR_PRECEDENCE
+    environment variable, a comma separated list of data vendor ids
+    with the most trusted vendor first, e.g. '1,2'.
+
+    Returns
+    -------
+    'list'
+        The data vendor ids in order of precedence
+    """
+
+    policy = os.getenv('VENDOR_PRECEDENCE')
+    if not policy:
+        return list(DEFAULT_VENDOR_PRECEDENCE)
+
+    return [int(vendor) for vendor in policy.split(',') if vendor.strip()]
+
+
+def consolidate_sql(keys):
+    """Build the statement that re-resolves the consolidated_price
+    row of every (symbol_id, price_date) key selected by a query.
+    It takes the vendor precedence list as its only parameter.
+
+    For each key the daily_price row of the highest precedence
+    vendor is chosen, probing the natural key index once per
+    vendor in the policy.
+
+    Parameters
+    ----------
+    keys : 'str'
+        A query or table returning symbol_id and price_date
+        columns, e.g. the staged rows of a load
+
+    Returns
+    -------
+    'str'
+        The consolidation statement
+    """
+
+    fields = ", ".join(CONSOLIDATED_FIELDS)
+
+    return (
+        "INSERT INTO consolidated_price (symbol_id, price_date, {0}, last_updated) "
+        "SELECT DISTINCT ON (k.symbol_id, k.price_date) k.symbol_id, k.price_date, "
+        "{1}, now() "
+        "FROM (SELECT DISTINCT symbol_id, price_date FROM {2}) AS k "
+        "CROSS JOIN unnest(%s::int[]) WITH ORDINALITY AS v(data_vendor_id, precedence) "
+        "JOIN daily_price AS dp ON dp.data_vendor_id = v.data_vendor_id "
+        "AND dp.symbol_id = k.symbol_id AND dp.price_date = k.price_date "
+        "ORDER BY k.symbol_id, k.price_date, v.precedence "
+        "ON CONFLICT (symbol_id, price_date) DO UPDATE SET {3}, "
+        "last_updated = EXCLUDED.last_updated"
+    ).format(
+        fields,
+        ", ".join(f"dp.{field}" for field in CONSOLIDATED_FIELDS),
+        keys,
+        ", ".join(f"{field} = EXCLUDED.{field}" for field in CONSOLIDATED_FIELDS)
+    )
+
+
+def adjust_sql(keys):
+    """Build the statement that re-adjusts the adjusted_price row
+    of every (symbol_id, price_date) key selected by a query from
+    its consolidated_price row. It must run after consolidate_sql.
+
+    Each price is multiplied by the product of the factors of the
+    symbol's corporate actions with a later ex_date, as stored by
+    the last adjustment of the symbol, so new prices are adjusted
+    without recomputing the symbol's history.
+
+    Parameters
+    ----------
+    keys : 'str'
+        A query or table returning symbol_id and price_date
+        columns, e.g. the staged rows of a load
+
+    Returns
+    -------
+    'str'
+        The adjustment statement
+    """
+
+    return (
+        "INSERT INTO adjusted_price (symbol_id, price_date, open_price, high_price, "
+        "low_price, close_price, volume, price_factor, volume_factor, last_updated) "
+        "SELECT c.symbol_id, c.price_date, c.open_price::float8 * f.price_factor, "
+        "c.high_price::float8 * f.price_factor, c.low_price::float8 * f.price_factor, "
+        "c.close_price::float8 * f.price_factor, round(c.volume * f.volume_factor)::bigint, "
+        "f.price_factor, f.volume_factor, now() "
+        "FROM (SELECT DISTINCT symbol_id, price_date FROM {}) AS k "
+        "JOIN consolidated_price AS c "
+        "ON c.symbol_id = k.symbol_id AND c.price_date = k.price_date "
+        "CROSS JOIN LATERAL ("
+        "SELECT COALESCE(exp(sum(ln(ca.price_factor))), 1) AS price_factor, "
+        "COALESCE(exp(sum(ln(ca.volume_factor))), 1) AS volume_factor "
+        "FROM corporate_action AS ca "
+        "WHERE ca.symbol_id = c.symbol_id AND ca.ex_date > c.price_date "
+        "AND ca.price_factor IS NOT NULL) AS f "
+        "ON CONFLICT (symbol_id, price_date) DO UPDATE SET "
+        "open_price = EXCLUDED.open_price, high_price = EXCLUDED.high_price, "
+        "low_price = EXCLUDED.low_price, close_price = EXCLUDED.close_price, "
+        "volume = EXCLUDED.volume, price_factor = EXCLUDED.price_factor, "
+        "volume_factor = EXCLUDED.volume_factor, last_updated = EXCLUDED.last_updated"
+    ).format(keys)
+
+
+def rebuild_consolidated_price(connection, cursor):
+    """Rebuild the consolidated_price table from daily_price with
+    the current vendor precedence policy, e.g. after the policy
+    changes.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        The connection object to interact
+        with the database
+    cursor : 'psycopg2.extensions.cursor'
+        The cursor object that accepts SQL
+        commands
+    """
+
+    fields = ", ".join(CONSOLIDATED_FIELDS)
+    cursor.execute("TRUNCATE consolidated_price")
+    cursor.execute(
+        "INSERT INTO consolidated_price (symbol_id, price_date, {0}, last_updated) "
+        "SELECT DISTINCT ON (dp.symbol_id, dp.price_date) dp.symbol_id, dp.price_date, "
+        "{1}, now() "
+        "FROM daily_price AS dp "
+        "JOIN unnest(%s::int[]) WITH ORDINALITY AS v(data_vendor_id, precedence) "
+        "ON dp.data_vendor_id = v.data_vendor_id "
+        "ORDER BY dp.symbol_id, dp.price_date, v.precedence".format(
+            fields,
+            ", ".join(f"dp.{field}" for field in CONSOLIDATED_FIELDS)
+        ),
+        (vendor_precedence(),)
+    )
+    connection.commit()
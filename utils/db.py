@@ -0,0 +1,202 @@
+# db.py
+"""Helper functions to connect to the Securities Master database.
+This contains the shared connection pool used by every script,
+configured from the environment and connected lazily.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from time import sleep
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+
+
+# TCP keepalives so idle connections to the remote
+# host aren't silently dropped.
+KEEPALIVE_KWARGS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5
+}
+
+# Number of attempts to open a connection before giving up
+CONNECT_ATTEMPTS = 3
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """Thread-safe connection pool that waits for a connection
+    to be returned when every one is in use, instead of raising
+    PoolError, so more threads than connections can share it.
+
+    Parameters
+    ----------
+    minconn : 'int'
+        The number of connections opened up front
+    maxconn : 'int'
+        The most connections open at once
+    args : 'tuple'
+        The psycopg2.connect arguments
+    kwargs : 'dict'
+        The psycopg2.connect keyword arguments
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        """Take a connection, waiting for a free slot."""
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        """Return a connection and free its slot."""
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+def db_settings():
+    """Read the database settings from the environment.
+
+    Returns
+    -------
+    'dict'
+        The psycopg2 connection keyword arguments
+    """
+
+    load_dotenv()
+
+    return {
+        'database': os.getenv('UW_SEC_MASTER_DB', 'securities_master'),
+        'user': os.getenv('UW_SEC_MASTER_USER'),
+        'password': os.getenv('UW_SEC_MASTER_PASSWORD'),
+        'host': os.getenv('UW_SEC_MASTER_HOST'),
+        'port': os.getenv('UW_SEC_MASTER_PORT', '5432')
+    }
+
+
+def get_pool():
+    """Return the shared connection pool, creating it on first use.
+    No connection is opened until one is requested.
+
+    Returns
+    -------
+    'BlockingConnectionPool'
+        The shared, thread-safe connection pool
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BlockingConnectionPool(
+                0,
+                int(os.getenv('UW_SEC_MASTER_POOL_SIZE', 8)),
+                **db_settings(),
+                **KEEPALIVE_KWARGS
+            )
+
+    return _pool
+
+
+def is_alive(connection):
+    """Check that a pooled connection can still reach the server.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+
+    Returns
+    -------
+    'bool'
+        True if the connection answered a ping
+    """
+
+    if connection.closed:
+        return False
+
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        connection.rollback()
+    except psycopg2.Error:
+        return False
+
+    return True
+
+
+def checkout():
+    """Take a live connection from the pool, replacing dropped
+    connections and retrying failed connects with backoff.
+
+    Returns
+    -------
+    'psycopg2.extensions.connection'
+        A connection that answered a ping
+    """
+
+    pool = get_pool()
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            connection = pool.getconn()
+        except psycopg2.OperationalError:
+            if attempt == CONNECT_ATTEMPTS - 1:
+                raise
+            sleep(2 ** attempt)
+            continue
+
+        if is_alive(connection):
+            return connection
+
+        # Discard the dead connection and try a new one.
+        pool.putconn(connection, close=True)
+
+    raise psycopg2.OperationalError("Could not open a live database connection")
+
+
+@contextmanager
+def db_connection():
+    """Borrow a connection from the shared pool.
+
+    The connection is returned to the pool on exit, with any open
+    transaction rolled back. Connections broken by a network or
+    server failure are closed instead so the next checkout
+    reconnects.
+
+    Yields
+    ------
+    'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    """
+
+    connection = checkout()
+    broken = False
+    try:
+        yield connection
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        get_pool().putconn(connection, close=broken or bool(connection.closed))
+
+
+def close_pool():
+    """Close every connection in the shared pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
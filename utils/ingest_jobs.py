@@ -0,0 +1,313 @@
+# ingest_jobs.py
+"""Helper functions to track loader runs.
+This contains the ingest_job and ingest_task bookkeeping that lets
+an interrupted loader resume where it stopped, and the retry loop
+that re-runs failed tickers with exponential backoff.
+"""
+import csv
+from time import sleep
+
+from psycopg2.extras import execute_values
+
+
+# Number of times a ticker is tried within a run
+MAX_ATTEMPTS = 3
+
+# Delay before the first retry, doubled before every
+# later retry up to MAX_BACKOFF_SECONDS
+BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 300
+
+
+def start_job(connection, job_name, tickers, source=None, resume=True):
+    """Resume the latest unfinished run of a job, or record a new
+    run with a pending task for every ticker.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    job_name : 'str'
+        The name of the loader, e.g. 'retrieve_historic_prices'
+    tickers : 'list'
+        The (id, ticker) tuples of a new run
+    source : 'str'
+        Where the tickers came from, e.g. the csv of
+        failures a run retries
+    resume : 'bool'
+        If True, resume the latest run of the job that was
+        interrupted instead of starting a new one
+
+    Returns
+    -------
+    'tuple'
+        The id of the job and True if it was resumed
+    """
+
+    cur = connection.cursor()
+    if resume:
+        cur.execute(
+            "SELECT id FROM ingest_job WHERE job_name = %s AND status = 'running' "
+            "ORDER BY id DESC LIMIT 1",
+            (job_name,)
+        )
+        row = cur.fetchone()
+        if row is not None:
+            connection.commit()
+            cur.close()
+            return row[0], True
+
+    cur.execute(
+        "INSERT INTO ingest_job (job_name, status, source, created_date, last_updated) "
+        "VALUES (%s, 'running', %s, now(), now()) RETURNING id",
+        (job_name, source)
+    )
+    job_id = cur.fetchone()[0]
+    if tickers:
+        execute_values(
+            cur,
+            "INSERT INTO ingest_task (job_id, symbol_id, ticker, status, created_date, "
+            "last_updated) VALUES %s ON CONFLICT (job_id, symbol_id) DO NOTHING",
+            [(job_id, symbol_id, ticker) for symbol_id, ticker in tickers],
+            template="(%s, %s, %s, 'pending', now(), now())",
+            page_size=1000
+        )
+    connection.commit()
+    cur.close()
+
+    return job_id, False
+
+
+def reopen_job(connection, job_id):
+    """Mark a finished job as running again so its
+    unfinished tasks can be retried.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    job_id : 'int'
+        The id of the job
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "UPDATE ingest_job SET status = 'running', finished_date = NULL, "
+        "last_updated = now() WHERE id = %s",
+        (job_id,)
+    )
+    if not cur.rowcount:
+        raise LookupError(f"No ingest_job with id {job_id}")
+    connection.commit()
+    cur.close()
+
+
+def pending_tasks(connection, job_id):
+    """Get the tickers of a job that haven't completed.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    job_id : 'int'
+        The id of the job
+
+    Returns
+    -------
+    'list'
+        The (id, ticker) tuples of the pending and failed tasks
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT symbol_id, ticker FROM ingest_task "
+        "WHERE job_id = %s AND status <> 'completed' ORDER BY symbol_id",
+        (job_id,)
+    )
+    tasks = cur.fetchall()
+    connection.commit()
+    cur.close()
+
+    return tasks
+
+
+def complete_tasks(cursor, job_id, symbol_ids):
+    """Mark tasks as completed. Run it in the transaction that
+    loads the tasks' prices, so a task is completed exactly
+    when its prices are committed.
+
+    Parameters
+    ----------
+    cursor : 'psycopg2.extensions.cursor'
+        A cursor in the loading transaction
+    job_id : 'int'
+        The id of the job
+    symbol_ids : 'list'
+        The symbol ids of the completed tasks
+    """
+
+    cursor.execute(
+        "UPDATE ingest_task SET status = 'completed', attempts = attempts + 1, "
+        "last_error = NULL, finished_date = now(), last_updated = now() "
+        "WHERE job_id = %s AND symbol_id = ANY(%s)",
+        (job_id, list(symbol_ids))
+    )
+
+
+def fail_tasks(connection, job_id, failures):
+    """Record a failed attempt of several tasks.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    job_id : 'int'
+        The id of the job
+    failures : 'list'
+        The (symbol id, error message) tuples of the failures
+    """
+
+    if not failures:
+        return
+
+    cur = connection.cursor()
+    execute_values(
+        cur,
+        "UPDATE ingest_task AS t SET status = 'failed', attempts = t.attempts + 1, "
+        "last_error = f.error, last_updated = now() "
+        "FROM (VALUES %s) AS f(job_id, symbol_id, error) "
+        "WHERE t.job_id = f.job_id AND t.symbol_id = f.symbol_id",
+        [(job_id, symbol_id, error[:1000]) for symbol_id, error in failures],
+        page_size=1000
+    )
+    connection.commit()
+    cur.close()
+
+
+def finish_job(connection, job_id):
+    """Mark a job as completed, or as failed if any of
+    its tasks didn't complete.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    job_id : 'int'
+        The id of the job
+
+    Returns
+    -------
+    'str'
+        The final status of the job
+    """
+
+    cur = connection.cursor()
+    cur.execute(
+        "UPDATE ingest_job SET status = CASE WHEN EXISTS ("
+        "SELECT 1 FROM ingest_task WHERE job_id = %(job_id)s AND status <> 'completed') "
+        "THEN 'failed' ELSE 'completed' END, finished_date = now(), last_updated = now() "
+        "WHERE id = %(job_id)s RETURNING status",
+        {'job_id': job_id}
+    )
+    status = cur.fetchone()[0]
+    connection.commit()
+    cur.close()
+
+    return status
+
+
+def backoff_delay(attempt, base=BACKOFF_SECONDS, cap=MAX_BACKOFF_SECONDS):
+    """Return the delay before a retry, doubling per attempt.
+
+    Parameters
+    ----------
+    attempt : 'int'
+        The number of attempts made so far, starting at 1
+    base : 'float'
+        The delay before the first retry in seconds
+    cap : 'float'
+        The longest delay in seconds
+
+    Returns
+    -------
+    'float'
+        The delay in seconds
+    """
+
+    return min(cap, base * 2 ** (attempt - 1))
+
+
+def run_with_retries(run, items, max_attempts=MAX_ATTEMPTS, base=BACKOFF_SECONDS,
+                     on_failure=None, retryable=None):
+    """Run items and re-run the ones that fail, waiting an
+    exponentially growing delay before every retry.
+
+    Parameters
+    ----------
+    run : 'function'
+        Called as run(items); returns the (item, error) tuples
+        of the items that failed, e.g. IngestPipeline.run
+    items : 'list'
+        The items to run
+    max_attempts : 'int'
+        The number of times an item is tried
+    base : 'float'
+        The delay before the first retry in seconds
+    on_failure : 'function'
+        Called as on_failure(failed) after every pass with
+        failures, e.g. to record them
+    retryable : 'function'
+        Called as retryable(error); items whose error it
+        returns False for are not retried, e.g. when the
+        vendor's daily quota is used up
+
+    Returns
+    -------
+    'list'
+        The (item, error) tuples of the items that failed
+        every attempt or weren't retried
+    """
+
+    failed = run(items)
+    final = []
+    attempt = 1
+    while failed:
+        if on_failure is not None:
+            on_failure(failed)
+        if retryable is not None:
+            final.extend((item, err) for item, err in failed if not retryable(err))
+            failed = [(item, err) for item, err in failed if retryable(err)]
+        if not failed or attempt >= max_attempts:
+            break
+
+        delay = backoff_delay(attempt, base)
+        print(
+            f"\nRetrying {len(failed)} failed items in {delay:.0f}s "
+            f"(attempt {attempt + 1} of {max_attempts})"
+        )
+        sleep(delay)
+        failed = run([item for item, _ in failed])
+        attempt += 1
+
+    return final + failed
+
+
+def read_failed_tickers(path):
+    """Read the (id, ticker) rows of a csv of failed tickers
+    written by utils.fileio.save_csv.
+
+    Parameters
+    ----------
+    path : 'str'
+        The path of the csv
+
+    Returns
+    -------
+    'list'
+        The (id, ticker) tuples, without duplicates
+    """
+
+    with open(path, newline='') as csvfile:
+        tickers = [(int(row[0]), row[1]) for row in csv.reader(csvfile) if row]
+
+    return list(dict.fromkeys(tickers))
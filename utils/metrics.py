@@ -0,0 +1,365 @@
+# metrics.py
+"""Helper class to instrument the loaders.
+This contains an in-process registry of counters and latency
+histograms, the JSON and Prometheus textfile run reports built
+from it, and an optional cProfile hook for entry points.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime as dt
+from math import inf
+from pathlib import Path
+from time import perf_counter
+from time import time
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, inf)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = 'securities_master'
+
+
+class Metrics:
+    """Thread-safe registry of counters and latency histograms.
+
+    Every metric is identified by its name and keyword labels,
+    e.g. ('stage_seconds', stage='fetch'). Histograms keep a count
+    per LATENCY_BUCKETS bucket, the sum and the largest value, so
+    recording a value is a few additions under a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear every metric and restart the run clock."""
+        with self._lock:
+            self.started = time()
+            self._counters = {}
+            self._histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        """Add to a counter.
+
+        Parameters
+        ----------
+        name : 'str'
+            The counter name, e.g. 'api_calls'
+        value : 'float'
+            The amount to add
+        labels : 'str'
+            The labels of the counter, e.g. vendor='alpaca'
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record a latency in a histogram.
+
+        Parameters
+        ----------
+        name : 'str'
+            The histogram name, e.g. 'stage_seconds'
+        seconds : 'float'
+            The latency to record
+        labels : 'str'
+            The labels of the histogram, e.g. stage='fetch'
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        bucket = next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    'buckets': [0] * len(LATENCY_BUCKETS),
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0
+                }
+            histogram['buckets'][bucket] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+
+    @contextmanager
+    def timer(self, name='stage_seconds', **labels):
+        """Record the wall clock time of a block in a histogram,
+        including blocks that raise.
+
+        Parameters
+        ----------
+        name : 'str'
+            The histogram name
+        labels : 'str'
+            The labels of the histogram, e.g. stage='commit'
+        """
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Copy the registry into plain, picklable data.
+
+        Returns
+        -------
+        'dict'
+            The counters and histograms keyed by (name, labels)
+        """
+
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {
+                    key: dict(histogram, buckets=list(histogram['buckets']))
+                    for key, histogram in self._histograms.items()
+                }
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot taken in another process, e.g. a
+        pipeline parse worker, to the registry.
+
+        Parameters
+        ----------
+        snapshot : 'dict'
+            The data returned by snapshot()
+        """
+
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, other in snapshot['histograms'].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    self._histograms[key] = dict(other, buckets=list(other['buckets']))
+                    continue
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['count'] += other['count']
+                histogram['sum'] += other['sum']
+                histogram['max'] = max(histogram['max'], other['max'])
+
+    def throughput(self):
+        """Return the rows loaded into daily_price since the run
+        started and the run's rows per second.
+
+        Returns
+        -------
+        'tuple'
+            The rows loaded, the run's duration in seconds and
+            the rows per second
+        """
+
+        with self._lock:
+            rows = self._counters.get(('rows_loaded', ()), 0)
+        seconds = time() - self.started
+
+        return rows, seconds, rows / seconds if seconds > 0 else float(rows)
+
+    def to_dict(self, job):
+        """Build the JSON run report.
+
+        Parameters
+        ----------
+        job : 'str'
+            The name of the job, e.g. 'daily_price_updates'
+
+        Returns
+        -------
+        'dict'
+            The run's start, duration, rows per second, counters
+            and histograms with cumulative bucket counts
+        """
+
+        snapshot = self.snapshot()
+        rows, seconds, rate = self.throughput()
+
+        return {
+            'job': job,
+            'started': dt.utcfromtimestamp(self.started).isoformat() + 'Z',
+            'duration_seconds': seconds,
+            'rows_per_second': rate,
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(snapshot['counters'].items())
+            ],
+            'histograms': [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram['count'],
+                    'sum': histogram['sum'],
+                    'max': histogram['max'],
+                    'buckets': {
+                        _format_bound(bound): cumulative
+                        for bound, cumulative in zip(LATENCY_BUCKETS, _cumulative(histogram['buckets']))
+                    }
+                }
+                for (name, labels), histogram in sorted(snapshot['histograms'].items())
+            ]
+        }
+
+    def to_prometheus(self, job):
+        """Build the Prometheus text exposition of the run, for
+        the node_exporter textfile collector.
+
+        Parameters
+        ----------
+        job : 'str'
+            The name of the job, added as a label of every metric
+
+        Returns
+        -------
+        'str'
+            The metrics in the Prometheus text format
+        """
+
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {METRIC_PREFIX}_run_start_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_run_start_timestamp_seconds{_labels({'job': job})} {self.started}",
+            f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+            f"{METRIC_PREFIX}_run_duration_seconds{_labels({'job': job})} {time() - self.started}",
+            f"# TYPE {METRIC_PREFIX}_rows_per_second gauge",
+            f"{METRIC_PREFIX}_rows_per_second{_labels({'job': job})} {self.throughput()[2]}"
+        ]
+
+        # One TYPE line per metric name.
+        typed = set()
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_labels(dict(labels, job=job))} {value}")
+
+        for (name, labels), histogram in sorted(snapshot['histograms'].items()):
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, cumulative in zip(LATENCY_BUCKETS, _cumulative(histogram['buckets'])):
+                bucket_labels = dict(labels, job=job, le=_format_bound(bound))
+                lines.append(f"{metric}_bucket{_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(dict(labels, job=job))} {histogram['sum']}")
+            lines.append(f"{metric}_count{_labels(dict(labels, job=job))} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(counts):
+    """Return the running totals of bucket counts."""
+    total = 0
+    cumulative = []
+    for count in counts:
+        total += count
+        cumulative.append(total)
+
+    return cumulative
+
+
+def _format_bound(bound):
+    """Format a bucket bound as a Prometheus le label."""
+    return '+Inf' if bound == inf else repr(float(bound))
+
+
+def _labels(labels):
+    """Format labels as a Prometheus label set."""
+    if not labels:
+        return ''
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in sorted(labels.items())
+    )
+
+    return "{" + pairs + "}"
+
+
+def write_report(job, directory=None, registry=None):
+    """Write the run report of a job as JSON and as a Prometheus
+    textfile, and print the run's throughput. The JSON report is
+    kept per run and the textfile is replaced atomically, so a
+    collector only sees the latest run.
+
+    Parameters
+    ----------
+    job : 'str'
+        The name of the job, e.g. 'daily_price_updates'
+    directory : 'str'
+        The directory the reports are written to, defaults to the
+        METRICS_DIR environment variable or 'metrics'
+    registry : 'Metrics'
+        The registry to report, defaults to the shared registry
+
+    Returns
+    -------
+    'tuple'
+        The paths of the JSON report and the textfile
+    """
+
+    registry = registry or metrics
+    directory = Path(directory or os.getenv('METRICS_DIR', 'metrics'))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    json_path = directory / f"{job}_{dt.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(json_path, 'w') as f:
+        json.dump(registry.to_dict(job), f, indent=2)
+
+    prom_path = directory / f"{job}.prom"
+    tmp_path = prom_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(registry.to_prometheus(job))
+    os.replace(tmp_path, prom_path)
+
+    rows, seconds, rate = registry.throughput()
+    print(f"Loaded {rows:,.0f} rows into daily_price in {seconds:.2f}s ({rate:,.0f} rows/sec)")
+
+    return json_path, prom_path
+
+
+@contextmanager
+def profiled(path=None, limit=25):
+    """Run a block under cProfile, dump the stats to a file for
+    snakeviz or pstats and print the slowest calls. Without a
+    path, or the PROFILE_OUTPUT environment variable, the block
+    runs unprofiled.
+
+    Parameters
+    ----------
+    path : 'str'
+        The file the profile stats are written to
+    limit : 'int'
+        The number of calls printed by cumulative time
+    """
+
+    path = path or os.getenv('PROFILE_OUTPUT')
+    if not path:
+        yield
+        return
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+        print(f"Profile stats were saved to {path}.")
+
+
+# Registry shared by the loaders in this process
+metrics = Metrics()
@@ -0,0 +1,91 @@
+# parsing.py
+"""Helper functions to parse vendor price data.
+This contains vectorized parsers that turn raw vendor
+responses into typed columns of price data.
+"""
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+
+# Keys of each bar in the AlphaVantage `Time Series (Daily)` dict
+ALPHA_VANTAGE_BAR_FIELDS = (
+    '1. open',
+    '2. high',
+    '3. low',
+    '4. close',
+    '5. volume'
+)
+
+# Columns of the parsed price data
+PRICE_COLUMNS = (
+    'price_date',
+    'open_price',
+    'high_price',
+    'low_price',
+    'close_price',
+    'volume'
+)
+
+
+def empty_price_frame():
+    """Create an empty DataFrame with the typed
+    price data columns.
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        An empty DataFrame of price data
+    """
+
+    return pd.DataFrame({
+        'price_date': np.array([], dtype='datetime64[ns]'),
+        'open_price': np.array([], dtype=np.float64),
+        'high_price': np.array([], dtype=np.float64),
+        'low_price': np.array([], dtype=np.float64),
+        'close_price': np.array([], dtype=np.float64),
+        'volume': np.array([], dtype=np.int64)
+    })
+
+
+def parse_alphavantage_daily(time_series):
+    """Parse the AlphaVantage `Time Series (Daily)` dict into
+    typed columns in bulk.
+
+    The date keys are parsed to datetime64 and the bar values
+    are converted from strings in a single NumPy cast per
+    column instead of per value.
+
+    Parameters
+    ----------
+    time_series : 'dict'
+        The bars keyed by 'YYYY-MM-DD' date strings
+
+    Returns
+    -------
+    'pandas.DataFrame'
+        The price data sorted by price_date with datetime64
+        dates, float64 OHLC prices and int64 volumes
+    """
+
+    if not time_series:
+        return empty_price_frame()
+
+    dates = np.array(list(time_series.keys()), dtype='datetime64[D]')
+    values = np.array(
+        list(map(itemgetter(*ALPHA_VANTAGE_BAR_FIELDS), time_series.values()))
+    )
+    ohlc = values[:, :4].astype(np.float64)
+
+    # Sort the bars by date.
+    order = np.argsort(dates)
+
+    return pd.DataFrame({
+        'price_date': dates[order].astype('datetime64[ns]'),
+        'open_price': ohlc[order, 0],
+        'high_price': ohlc[order, 1],
+        'low_price': ohlc[order, 2],
+        'close_price': ohlc[order, 3],
+        'volume': values[order, 4].astype(np.int64)
+    })
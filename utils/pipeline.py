@@ -0,0 +1,236 @@
+# pipeline.py
+"""Helper class to run ingestion as a pipeline.
+This contains a producer/consumer engine that overlaps fetching,
+parsing and writing, with bounded queues between the stages so a
+slow stage applies backpressure to the ones before it.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import metrics
+from utils.progress import print_progress_bar
+
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def _parse_in_worker(parse, item, payload):
+    """Parse an item in a worker process and return the result
+    with the metrics recorded while parsing, which the parent
+    merges into its own registry."""
+    metrics.reset()
+    with metrics.timer(stage='parse'):
+        result = parse(item, payload)
+
+    return result, metrics.snapshot()
+
+
+class IngestPipeline:
+    """Fetch, parse and write items concurrently.
+
+    Fetchers run as asyncio tasks that hand the blocking network
+    calls to a thread pool, parsers run in a process pool, and a
+    single writer groups several items per database transaction.
+    An item that fails in any stage is recorded and dropped; a
+    batch whose write fails is written again one item at a time,
+    so only the items that fail alone are dropped. The time each
+    item spends in each stage is recorded in the stage_seconds
+    histogram of the shared metrics registry.
+
+    Parameters
+    ----------
+    fetch : 'function'
+        Called as fetch(item) in a thread; returns the raw payload
+    parse : 'function'
+        Called as parse(item, payload) in a worker process; returns
+        the result to write. Must be a picklable module-level
+        function when use_processes is True.
+    write : 'function'
+        Called as write(batch) in the writer thread, where batch
+        is a list of (item, result) tuples. If it raises, it must
+        have rolled back its transaction
+    fetch_workers : 'int'
+        The number of fetches kept in flight
+    parse_workers : 'int'
+        The number of parser processes
+    queue_size : 'int'
+        The maximum number of items waiting between two stages
+    batch_size : 'int'
+        The maximum number of items written per transaction
+    use_processes : 'bool'
+        If False, parse in threads instead of processes
+    """
+
+    def __init__(self, fetch, parse, write, fetch_workers=4, parse_workers=2,
+                 queue_size=16, batch_size=8, use_processes=True):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.use_processes = use_processes
+        self.failed = []
+
+    def run(self, items, show_progress=True):
+        """Run every item through the pipeline.
+
+        Parameters
+        ----------
+        items : 'list'
+            The items to ingest, e.g. (id, ticker) tuples
+        show_progress : 'bool'
+            If True, print a progress bar as batches are written
+
+        Returns
+        -------
+        'list'
+            The (item, error) tuples of the items that failed
+        """
+
+        self.failed = []
+        asyncio.run(self._run(list(items), show_progress))
+
+        return self.failed
+
+    async def _run(self, items, show_progress):
+        """Start the stages and wait for them to drain."""
+        loop = asyncio.get_running_loop()
+        fetch_queue = asyncio.Queue(maxsize=self.queue_size)
+        parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        if self.use_processes:
+            parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        else:
+            parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers)
+
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as fetch_executor, \
+                ThreadPoolExecutor(max_workers=1) as write_executor, \
+                parse_executor:
+            fetchers = [
+                asyncio.create_task(
+                    self._fetch_stage(loop, fetch_executor, fetch_queue, parse_queue)
+                )
+                for _ in range(self.fetch_workers)
+            ]
+            parsers = [
+                asyncio.create_task(
+                    self._parse_stage(loop, parse_executor, parse_queue, write_queue)
+                )
+                for _ in range(self.parse_workers)
+            ]
+            writer = asyncio.create_task(
+                self._write_stage(loop, write_executor, write_queue, len(items), show_progress)
+            )
+
+            # Feed the items; put() waits while the
+            # fetchers are behind.
+            for item in items:
+                await fetch_queue.put(item)
+
+            # Shut the stages down in order.
+            for _ in fetchers:
+                await fetch_queue.put(_DONE)
+            await asyncio.gather(*fetchers)
+            for _ in parsers:
+                await parse_queue.put(_DONE)
+            await asyncio.gather(*parsers)
+            await write_queue.put(_DONE)
+            await writer
+
+    async def _fetch_stage(self, loop, executor, in_queue, out_queue):
+        """Fetch the payload of each item."""
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                return
+            try:
+                with metrics.timer(stage='fetch'):
+                    payload = await loop.run_in_executor(executor, self.fetch, item)
+            except Exception as err:
+                metrics.increment('pipeline_failures', stage='fetch')
+                self.failed.append((item, err))
+                continue
+            await out_queue.put((item, payload))
+
+    async def _parse_stage(self, loop, executor, in_queue, out_queue):
+        """Parse the payload of each item."""
+        while True:
+            entry = await in_queue.get()
+            if entry is _DONE:
+                return
+            item, payload = entry
+            try:
+                if self.use_processes:
+                    # Worker processes have their own registry.
+                    result, snapshot = await loop.run_in_executor(
+                        executor, _parse_in_worker, self.parse, item, payload
+                    )
+                    metrics.merge(snapshot)
+                else:
+                    with metrics.timer(stage='parse'):
+                        result = await loop.run_in_executor(executor, self.parse, item, payload)
+            except Exception as err:
+                metrics.increment('pipeline_failures', stage='parse')
+                self.failed.append((item, err))
+                continue
+            await out_queue.put((item, result))
+
+    async def _write_stage(self, loop, executor, in_queue, total, show_progress):
+        """Write the parsed items in batches."""
+        batch = []
+        written = 0
+        finished = False
+        while not finished:
+            entry = await in_queue.get()
+            if entry is _DONE:
+                finished = True
+            else:
+                batch.append(entry)
+
+            if batch and (finished or len(batch) >= self.batch_size):
+                written += await self._write_batch(loop, executor, batch)
+                batch = []
+
+                # Items that failed in an earlier stage count as done.
+                if show_progress and total:
+                    print_progress_bar(
+                        min(total, written + len(self.failed)),
+                        total,
+                        prefix='Progress',
+                        suffix='Complete',
+                        length=50
+                    )
+
+    async def _write_batch(self, loop, executor, batch):
+        """Write a batch. If the write fails, write its items one
+        at a time so one bad item doesn't fail the others.
+
+        Returns
+        -------
+        'int'
+            The number of items written
+        """
+
+        try:
+            with metrics.timer(stage='write'):
+                await loop.run_in_executor(executor, self.write, batch)
+        except Exception as err:
+            if len(batch) == 1:
+                metrics.increment('pipeline_failures', stage='write')
+                self.failed.append((batch[0][0], err))
+                return 0
+
+            metrics.increment('pipeline_batch_splits')
+            written = 0
+            for entry in batch:
+                written += await self._write_batch(loop, executor, [entry])
+            return written
+
+        metrics.increment('pipeline_items_written', len(batch))
+
+        return len(batch)
@@ -0,0 +1,143 @@
+# rate_limit.py
+"""Helper class to rate limit API calls.
+This contains a thread-safe token bucket used to keep
+concurrent API requests within a vendor's quota, and an
+adaptive variant that slows down when the vendor throttles.
+"""
+import threading
+from time import monotonic
+from time import sleep
+
+from utils.metrics import metrics
+
+
+class TokenBucket:
+    """Token bucket rate limiter shared by worker threads.
+
+    Tokens refill continuously at `calls_per_minute / 60` per
+    second up to `capacity`. Each API call consumes one token,
+    so the long run request rate equals the quota ceiling.
+
+    Parameters
+    ----------
+    calls_per_minute : 'float'
+        The number of calls the API plan allows per minute
+    capacity : 'int'
+        The maximum number of tokens that can accumulate,
+        i.e. the largest burst of back to back calls
+    """
+
+    def __init__(self, calls_per_minute, capacity=1):
+        if calls_per_minute <= 0:
+            raise ValueError("calls_per_minute must be positive")
+
+        self.rate = calls_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._last_refill = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last refill."""
+        now = monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a token is available and consume it. Calls
+        that had to wait are counted as throttled."""
+        start = monotonic()
+        throttled = False
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                wait = (1 - self._tokens) / self.rate
+
+            # Sleep outside the lock so other
+            # threads can check the bucket.
+            throttled = True
+            sleep(wait)
+
+        if throttled:
+            metrics.increment('throttled_calls')
+            metrics.observe('throttle_wait_seconds', monotonic() - start)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Token bucket that adapts its rate to a vendor's throttling
+    with additive increase, multiplicative decrease (AIMD).
+
+    Every throttled call multiplies the rate by `decrease` and
+    empties the bucket, so the next call waits for a full token at
+    the lower rate, plus any delay the vendor asked for. Every
+    successful call adds `increase` calls per minute back, until
+    the rate is at the plan's ceiling again.
+
+    Parameters
+    ----------
+    calls_per_minute : 'float'
+        The number of calls the API plan allows per minute,
+        used as the starting rate and the ceiling
+    capacity : 'int'
+        The maximum number of tokens that can accumulate
+    min_calls_per_minute : 'float'
+        The floor of the rate, defaults to a sixteenth
+        of calls_per_minute
+    increase : 'float'
+        The calls per minute added after a successful call,
+        defaults to a twentieth of calls_per_minute
+    decrease : 'float'
+        The factor the rate is multiplied by after a
+        throttled call
+    """
+
+    def __init__(self, calls_per_minute, capacity=1, min_calls_per_minute=None,
+                 increase=None, decrease=0.5):
+        super().__init__(calls_per_minute, capacity)
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+
+        self.max_rate = self.rate
+        self.min_rate = (min_calls_per_minute or calls_per_minute / 16) / 60.0
+        self.increase = (increase or calls_per_minute / 20) / 60.0
+        self.decrease = decrease
+
+    @property
+    def calls_per_minute(self):
+        """The current rate in calls per minute."""
+        return self.rate * 60.0
+
+    def on_success(self):
+        """Raise the rate after a call that wasn't throttled."""
+        with self._lock:
+            # Tokens earned so far are
+            # counted at the old rate.
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        """Lower the rate after a throttled call and hold back
+        the next call.
+
+        Parameters
+        ----------
+        retry_after : 'float'
+            The seconds the vendor asked to wait, e.g.
+            from a Retry-After header
+        """
+
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+            # A negative balance delays the next
+            # token by the requested wait.
+            self._tokens = min(0.0, self._tokens) - (retry_after or 0) * self.rate
+
+        metrics.increment('rate_decreases')
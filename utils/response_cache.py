@@ -0,0 +1,289 @@
+# response_cache.py
+"""Helper class to cache raw vendor responses.
+This contains a compressed on-disk cache so downloaded API
+responses can be replayed without spending API quota.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from time import time
+
+from utils.metrics import metrics
+
+
+class ResponseCache:
+    """Content-addressed cache of gzip compressed vendor responses.
+
+    Each response is stored under the SHA-256 digest of its key,
+    e.g. (vendor, endpoint, symbol, outputsize, as-of date).
+    Entries older than `ttl_seconds` are treated as misses, and
+    the oldest entries are evicted once the cache grows past
+    `max_bytes`.
+
+    Parameters
+    ----------
+    directory : 'str'
+        The directory the cached responses are written to
+    ttl_seconds : 'float'
+        How long a cached response stays valid
+    max_bytes : 'int'
+        The maximum total size of the cache on disk
+    offline : 'bool'
+        If True, a cache miss raises a LookupError instead
+        of letting the caller download the response
+    """
+
+    def __init__(self, directory='response_cache', ttl_seconds=7 * 24 * 3600,
+                 max_bytes=2 * 1024 ** 3, offline=False):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        # Bytes on disk, scanned once on the first write and
+        # kept up to date so a write doesn't list the cache.
+        self._total_bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        """Return the file path of a cache key."""
+        digest = hashlib.sha256(
+            json.dumps([str(part) for part in key]).encode('utf-8')
+        ).hexdigest()
+
+        return self.directory / digest[:2] / f"{digest}.gz"
+
+    def get(self, key):
+        """Return the cached response for a key.
+
+        Parameters
+        ----------
+        key : 'tuple'
+            The parts identifying the request
+
+        Returns
+        -------
+        'bytes'
+            The cached response, or None on a miss
+        """
+
+        path = self._path(key)
+        try:
+            if time() - path.stat().st_mtime > self.ttl_seconds:
+                path.unlink()
+                return None
+            with gzip.open(path, 'rb') as f:
+                return f.read()
+        except (OSError, EOFError):
+            return None
+
+    def put(self, key, payload):
+        """Store a response under a key and evict the oldest
+        responses if the cache is over its size limit.
+
+        Parameters
+        ----------
+        key : 'tuple'
+            The parts identifying the request
+        payload : 'bytes'
+            The raw response
+        """
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            replaced_bytes = path.stat().st_size
+        except OSError:
+            replaced_bytes = 0
+
+        # Write to a temporary file and rename it so readers
+        # never see a partially written response. The name is
+        # unique per process and thread, as fetch threads may
+        # write the same key at once.
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(payload)
+        written_bytes = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._entries()[1]
+            else:
+                self._total_bytes += written_bytes - replaced_bytes
+            over_limit = self._total_bytes > self.max_bytes
+
+        if over_limit:
+            self.evict()
+
+    def fetch(self, key, download, cacheable=None):
+        """Read a response through the cache.
+
+        Parameters
+        ----------
+        key : 'tuple'
+            The parts identifying the request
+        download : 'function'
+            Called with no arguments on a cache miss; returns the
+            response bytes to cache, or None if the response
+            should not be cached
+        cacheable : 'function'
+            Called with a downloaded response; returns False if
+            it should be returned without being cached, e.g.
+            because the vendor hasn't published all of it yet
+
+        Returns
+        -------
+        'bytes'
+            The cached or downloaded response
+        """
+
+        vendor = str(key[0])
+        payload = self.get(key)
+        if payload is not None:
+            metrics.increment('response_cache_hits', vendor=vendor)
+            return payload
+
+        if self.offline:
+            raise LookupError(f"No cached response for {key}")
+
+        # Every miss is a vendor API call.
+        metrics.increment('api_calls', vendor=vendor)
+        with metrics.timer('api_request_seconds', vendor=vendor):
+            payload = download()
+        if payload is not None and (cacheable is None or cacheable(payload)):
+            self.put(key, payload)
+
+        return payload
+
+    def fetch_conditional(self, url, headers=None, timeout=30):
+        """Read a web page through the cache with a conditional
+        request. The page's ETag and Last-Modified validators are
+        kept with it, and an unchanged page is answered with a 304
+        and read from the cache instead of downloaded again.
+
+        Parameters
+        ----------
+        url : 'str'
+            The URL of the page
+        headers : 'dict'
+            Extra request headers, e.g. a User-Agent
+        timeout : 'float'
+            The request timeout in seconds
+
+        Returns
+        -------
+        'bytes'
+            The cached or downloaded page
+        """
+
+        # Imported here to keep the nightly job's startup fast.
+        import requests
+
+        path = self._path(('http', url))
+        validators_path = path.with_suffix('.json')
+        try:
+            with gzip.open(path, 'rb') as f:
+                payload = f.read()
+            with open(validators_path) as f:
+                validators = json.load(f)
+        except (OSError, EOFError, ValueError):
+            payload = None
+            validators = {}
+
+        if self.offline:
+            if payload is None:
+                raise LookupError(f"No cached response for {url}")
+            return payload
+
+        request_headers = dict(headers or {})
+        if payload is not None:
+            if 'etag' in validators:
+                request_headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                request_headers['If-Modified-Since'] = validators['last_modified']
+
+        metrics.increment('api_calls', vendor='http')
+        with metrics.timer('api_request_seconds', vendor='http'):
+            response = requests.get(url, headers=request_headers, timeout=timeout)
+        if response.status_code == 304 and payload is not None:
+            # Mark the cached page as recently used.
+            metrics.increment('response_cache_hits', vendor='http')
+            os.utime(path)
+            return payload
+        response.raise_for_status()
+
+        self.put(('http', url), response.content)
+        validators = {
+            name: response.headers[header]
+            for name, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')]
+            if header in response.headers
+        }
+        tmp_path = validators_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(validators, f)
+        os.replace(tmp_path, validators_path)
+
+        return response.content
+
+    def _entries(self):
+        """List the cached responses.
+
+        Returns
+        -------
+        'tuple'
+            The (modified time, size, path) tuples of the
+            responses and their total size in bytes
+        """
+
+        entries = []
+        total_bytes = 0
+        for path in self.directory.glob('*/*.gz'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        return entries, total_bytes
+
+    def evict(self):
+        """Delete the oldest responses until the cache fits
+        within max_bytes."""
+        entries, total_bytes = self._entries()
+
+        if total_bytes > self.max_bytes:
+            for _, size, path in sorted(entries):
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total_bytes -= size
+                if total_bytes <= self.max_bytes:
+                    break
+
+        # Resynchronize with writes by other processes.
+        with self._lock:
+            self._total_bytes = total_bytes
+
+
+def response_cache_from_env():
+    """Create the response cache configured by the
+    RESPONSE_CACHE_* environment variables.
+
+    Returns
+    -------
+    'utils.response_cache.ResponseCache'
+        The configured response cache
+    """
+
+    return ResponseCache(
+        directory=os.getenv('RESPONSE_CACHE_DIR', 'response_cache'),
+        ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 3600)),
+        max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 2 * 1024 ** 3)),
+        offline=os.getenv('RESPONSE_CACHE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+    )
@@ -0,0 +1,147 @@
+# trading_calendar.py
+"""Helper functions to query the NYSE trading calendar.
+This contains functions that read trading sessions from the
+trading_day table, which is filled from pandas_market_calendars
+only when a date outside the stored range is requested.
+"""
+from datetime import date
+from datetime import datetime as dt
+
+from psycopg2.extras import execute_values
+
+
+# Exchange calendar the trading_day table is built from
+TRADING_CALENDAR = 'NYSE'
+
+
+def fill_trading_days(connection, start, end):
+    """Compute the trading calendar between two dates and
+    store every calendar day in the trading_day table.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    start : 'datetime.date'
+        The first date to store
+    end : 'datetime.date'
+        The last date to store
+    """
+
+    # Only imported when the stored calendar must be extended.
+    import pandas as pd
+    import pandas_market_calendars as mcal
+
+    schedule = mcal.get_calendar(TRADING_CALENDAR).schedule(start, end)
+    sessions = {
+        session.date(): (market_open.to_pydatetime(), market_close.to_pydatetime())
+        for session, market_open, market_close in zip(
+            schedule.index,
+            schedule['market_open'],
+            schedule['market_close']
+        )
+    }
+
+    now = dt.now()
+    rows = [
+        (day, day in sessions) + sessions.get(day, (None, None)) + (now, now)
+        for day in pd.date_range(start, end).date
+    ]
+
+    cur = connection.cursor()
+    execute_values(
+        cur,
+        "INSERT INTO trading_day (calendar_date, is_session, market_open, market_close, "
+        "created_date, last_updated) VALUES %s "
+        "ON CONFLICT (calendar_date) DO UPDATE SET "
+        "is_session = EXCLUDED.is_session, market_open = EXCLUDED.market_open, "
+        "market_close = EXCLUDED.market_close, last_updated = EXCLUDED.last_updated",
+        rows,
+        page_size=1000
+    )
+    connection.commit()
+    cur.close()
+
+
+def ensure_trading_days(connection, start, end):
+    """Extend the trading_day table so it covers two dates.
+    The calendar is filled through the end of the following
+    year so it rarely needs to be extended.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    start : 'datetime.date'
+        The first date that must be stored
+    end : 'datetime.date'
+        The last date that must be stored
+    """
+
+    cur = connection.cursor()
+    cur.execute("SELECT MIN(calendar_date), MAX(calendar_date) FROM trading_day")
+    first_day, last_day = cur.fetchone()
+    connection.commit()
+    cur.close()
+
+    if first_day is None:
+        fill_trading_days(connection, start, date(end.year + 1, 12, 31))
+        return
+
+    if start < first_day:
+        fill_trading_days(connection, start, first_day)
+    if end > last_day:
+        fill_trading_days(connection, last_day, date(end.year + 1, 12, 31))
+
+
+def trading_sessions(connection, start, end):
+    """List the trading sessions between two dates.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    start : 'datetime.date'
+        The first date to include
+    end : 'datetime.date'
+        The last date to include
+
+    Returns
+    -------
+    'list'
+        The dates of the sessions in ascending order
+    """
+
+    ensure_trading_days(connection, start, end)
+
+    cur = connection.cursor()
+    cur.execute(
+        "SELECT calendar_date FROM trading_day "
+        "WHERE is_session AND calendar_date BETWEEN %s AND %s "
+        "ORDER BY calendar_date",
+        (start, end)
+    )
+    sessions = [row[0] for row in cur.fetchall()]
+    connection.commit()
+    cur.close()
+
+    return sessions
+
+
+def is_trading_day(connection, day):
+    """Check whether the exchange held a session on a date.
+
+    Parameters
+    ----------
+    connection : 'psycopg2.extensions.connection'
+        A Python connection to a PostgreSQL database.
+    day : 'datetime.date'
+        The date to check
+
+    Returns
+    -------
+    'bool'
+        True if the date was a trading session
+    """
+
+    return bool(trading_sessions(connection, day, day))
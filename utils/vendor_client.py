@@ -0,0 +1,355 @@
+# vendor_client.py
+"""Helper classes to call rate limited vendor APIs.
+This contains the HTTP client that recognizes throttled
+responses and adapts its request rate, and the daily call
+quota it shares across runs through the vendor_quota table.
+"""
+import json
+import os
+import threading
+from datetime import datetime as dt
+
+import requests
+
+from utils.db import db_connection
+from utils.metrics import metrics
+from utils.rate_limit import AdaptiveTokenBucket
+
+
+# Outcomes of a throttle check
+THROTTLED = 'throttled'
+QUOTA_EXHAUSTED = 'quota_exhausted'
+
+# Throttle responses are short; larger bodies hold data
+MAX_THROTTLE_BODY_BYTES = 2048
+
+# Longest Retry-After delay honoured, in seconds
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+class RateLimitedError(Exception):
+    """A vendor kept throttling a request after every retry."""
+
+
+class QuotaExceededError(Exception):
+    """The vendor's daily call quota is used up."""
+
+
+class VendorRequestError(ValueError):
+    """The vendor rejected a request, e.g. for an unknown
+    symbol, so retrying it won't help."""
+
+
+def today():
+    """Return the UTC date the daily quotas are counted on."""
+    return dt.utcnow().date()
+
+
+class DailyQuota:
+    """Daily call quota of a vendor, counted in the vendor_quota
+    table so a backfill spanning several runs or days uses every
+    allowed call and never more.
+
+    Each call is reserved with one atomic upsert, so concurrent
+    threads and processes share the quota. Once it is used up,
+    the rest of the day is refused without querying the database.
+
+    Parameters
+    ----------
+    vendor : 'str'
+        The vendor name, e.g. 'alphavantage'
+    calls_per_day : 'int'
+        The number of calls the API plan allows per UTC day
+    """
+
+    def __init__(self, vendor, calls_per_day):
+        if calls_per_day <= 0:
+            raise ValueError("calls_per_day must be positive")
+
+        self.vendor = vendor
+        self.calls_per_day = int(calls_per_day)
+        self._exhausted_on = None
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Count a call against today's quota.
+
+        Returns
+        -------
+        'int'
+            The number of calls left today
+
+        Raises
+        ------
+        QuotaExceededError
+            If today's quota is used up
+        """
+
+        usage_date = today()
+        if self._exhausted_on == usage_date:
+            raise QuotaExceededError(f"The {self.vendor} quota for {usage_date} is used up")
+
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO vendor_quota (vendor, usage_date, calls, throttled, last_updated) "
+                "VALUES (%(vendor)s, %(usage_date)s, 1, 0, now()) "
+                "ON CONFLICT (vendor, usage_date) DO UPDATE "
+                "SET calls = vendor_quota.calls + 1, last_updated = now() "
+                "WHERE vendor_quota.calls < %(limit)s RETURNING calls",
+                {'vendor': self.vendor, 'usage_date': usage_date, 'limit': self.calls_per_day}
+            )
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+
+        if row is None:
+            with self._lock:
+                self._exhausted_on = usage_date
+            raise QuotaExceededError(f"The {self.vendor} quota for {usage_date} is used up")
+
+        return self.calls_per_day - row[0]
+
+    def record_throttle(self, exhausted=False):
+        """Count a throttled call, and use up today's quota if
+        the vendor said it was reached.
+
+        Parameters
+        ----------
+        exhausted : 'bool'
+            If True, the vendor refused the call because
+            the daily limit was reached
+        """
+
+        usage_date = today()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE vendor_quota SET throttled = throttled + 1, "
+                "calls = CASE WHEN %(exhausted)s THEN GREATEST(calls, %(limit)s) ELSE calls END, "
+                "last_updated = now() WHERE vendor = %(vendor)s AND usage_date = %(usage_date)s",
+                {
+                    'vendor': self.vendor,
+                    'usage_date': usage_date,
+                    'limit': self.calls_per_day,
+                    'exhausted': exhausted
+                }
+            )
+            conn.commit()
+            cur.close()
+
+        if exhausted:
+            with self._lock:
+                self._exhausted_on = usage_date
+
+
+class VendorClient:
+    """HTTP client for a rate limited vendor API.
+
+    Requests are paced by an adaptive token bucket and counted
+    against an optional daily quota. A response is throttled if
+    it has status 429 or if the vendor's `is_throttled` check
+    says so. A throttled request lowers the rate and is retried,
+    and a response saying the daily limit was reached stops every
+    later request for the rest of the day.
+
+    Parameters
+    ----------
+    vendor : 'str'
+        The vendor name, used as the metrics label
+    limiter : 'utils.rate_limit.AdaptiveTokenBucket'
+        The rate limiter shared by the client's threads
+    quota : 'DailyQuota'
+        The daily call quota, or None if the plan has none
+    is_throttled : 'function'
+        Called with a 200 response; returns THROTTLED,
+        QUOTA_EXHAUSTED or None
+    max_retries : 'int'
+        The number of times a throttled request is retried
+    timeout : 'float'
+        The request timeout in seconds
+    """
+
+    def __init__(self, vendor, limiter, quota=None, is_throttled=None, max_retries=3,
+                 timeout=30):
+        self.vendor = vendor
+        self.limiter = limiter
+        self.quota = quota
+        self.is_throttled = is_throttled
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._exhausted_on = None
+
+    def _check(self, response):
+        """Return the throttle outcome of a response."""
+        if response.status_code == 429:
+            return THROTTLED
+        if self.is_throttled is None or response.status_code != 200:
+            return None
+
+        return self.is_throttled(response)
+
+    def get(self, url, **kwargs):
+        """Send a GET request, retrying it while it's throttled.
+
+        Parameters
+        ----------
+        url : 'str'
+            The request URL
+        kwargs : 'dict'
+            Extra arguments of requests.get, e.g. headers
+
+        Returns
+        -------
+        'requests.Response'
+            The first response that wasn't throttled
+
+        Raises
+        ------
+        QuotaExceededError
+            If the daily quota is used up
+        RateLimitedError
+            If the request was still throttled after
+            max_retries retries
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        for _ in range(self.max_retries + 1):
+            if self._exhausted_on == today():
+                raise QuotaExceededError(f"The {self.vendor} daily limit was reached")
+            if self.quota is not None:
+                self.quota.reserve()
+            self.limiter.acquire()
+
+            response = requests.get(url, **kwargs)
+            outcome = self._check(response)
+            if outcome is None:
+                self.limiter.on_success()
+                return response
+
+            metrics.increment('api_throttled', vendor=self.vendor)
+            if self.quota is not None:
+                self.quota.record_throttle(exhausted=outcome == QUOTA_EXHAUSTED)
+            if outcome == QUOTA_EXHAUSTED:
+                self._exhausted_on = today()
+                raise QuotaExceededError(f"The {self.vendor} daily limit was reached")
+            self.limiter.on_throttle(retry_after(response))
+
+        raise RateLimitedError(
+            f"{self.vendor} throttled the request {self.max_retries + 1} times "
+            f"at {self.limiter.calls_per_minute:.2f} calls/minute"
+        )
+
+
+def retry_after(response):
+    """Return the delay a response's Retry-After header asks for.
+
+    Parameters
+    ----------
+    response : 'requests.Response'
+        The throttled response
+
+    Returns
+    -------
+    'float'
+        The delay in seconds, or None if the header is
+        missing or an HTTP date
+    """
+
+    try:
+        seconds = float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+
+def alphavantage_throttle(response):
+    """Recognize AlphaVantage's throttle responses. They are
+    answered with status 200 and a short JSON body holding only
+    a "Note" or "Information" message.
+
+    Parameters
+    ----------
+    response : 'requests.Response'
+        The AlphaVantage response
+
+    Returns
+    -------
+    'str'
+        QUOTA_EXHAUSTED if the daily limit was reached,
+        THROTTLED if the calls were too frequent, or None
+    """
+
+    if len(response.content) > MAX_THROTTLE_BODY_BYTES:
+        return None
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+
+    if 'Note' in body:
+        return THROTTLED
+    message = str(body.get('Information', '')).lower()
+    if 'per day' in message:
+        return QUOTA_EXHAUSTED
+    # Other messages, e.g. about premium
+    # endpoints, are real errors.
+    if any(hint in message for hint in ('rate limit', 'frequency', 'per minute', 'per second',
+                                        'sparingly')):
+        return THROTTLED
+
+    return None
+
+
+def alphavantage_error(response):
+    """Return the message of an AlphaVantage error response.
+    Invalid calls, e.g. for an unknown symbol, are answered
+    with status 200 and a JSON body holding an "Error Message".
+
+    Parameters
+    ----------
+    response : 'requests.Response'
+        The AlphaVantage response
+
+    Returns
+    -------
+    'str'
+        The error message, or None if the response
+        isn't an error
+    """
+
+    if len(response.content) > MAX_THROTTLE_BODY_BYTES:
+        return None
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or 'Error Message' not in body:
+        return None
+
+    return str(body['Error Message'])
+
+
+def alphavantage_client_from_env():
+    """Create the AlphaVantage client configured by the
+    ALPHAVANTAGE_CALLS_PER_MINUTE and ALPHAVANTAGE_CALLS_PER_DAY
+    environment variables. Without a daily limit, no quota is
+    kept.
+
+    Returns
+    -------
+    'VendorClient'
+        The configured AlphaVantage client
+    """
+
+    calls_per_day = os.getenv('ALPHAVANTAGE_CALLS_PER_DAY')
+
+    return VendorClient(
+        'alphavantage',
+        AdaptiveTokenBucket(float(os.getenv('ALPHAVANTAGE_CALLS_PER_MINUTE', 5))),
+        quota=DailyQuota('alphavantage', int(calls_per_day)) if calls_per_day else None,
+        is_throttled=alphavantage_throttle
+    )